@@ -0,0 +1,10 @@
+"""
+Load-testing and latency benchmarks of the search API
+
+* query_mix: realistic, reproducible mix of search and paper requests
+* es_stub: deterministic local stand-in for Elasticsearch with injected latency
+* load_test: closed-loop load generator reporting throughput and p50/p95/p99 latency
+* run_benchmark: boots the API under gunicorn through the WSGI and/or ASGI entry point and load-tests it
+
+Run from the dir of manage.py, e.g. python3 -m benchmarks.run_benchmark --server both --es stub
+"""
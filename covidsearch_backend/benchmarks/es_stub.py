@@ -0,0 +1,178 @@
+"""
+Deterministic local stand-in for Elasticsearch, for measuring the search API's own serving overhead
+
+It answers the requests search_api makes (mapping, search, msearch, mget, get) with synthetic papers and facets from a
+hash of the request, so the same request always gets the same response, after a fixed injected latency plus seeded
+jitter. With ES's own work reduced to a known delay, changes in the API's latency come from the Python serving path:
+event loops, JSON shaping and serialization.
+
+python3 -m benchmarks.es_stub --port 9250 --latency-ms 5
+"""
+import argparse
+import asyncio
+import json
+import random
+import zlib
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+STUB_INDEX = "covid19_papers_stub"
+STUB_GENERATION = "stub"
+STUB_NUM_PAPERS = 200000
+STUB_ABSTRACT_WORDS = 250  # A typical CORD-19 abstract
+STUB_WORDS = [
+    "coronavirus",
+    "patients",
+    "infection",
+    "respiratory",
+    "clinical",
+    "viral",
+    "protein",
+    "vaccine",
+    "transmission",
+    "study",
+    "results",
+    "cells",
+    "severe",
+    "acute",
+    "syndrome",
+    "analysis",
+]
+
+
+def stub_paper(paper_id: int) -> Dict[str, Any]:
+    rng = random.Random(paper_id)
+    return {
+        "cord_uid": f"stub{paper_id:06d}",
+        "title": " ".join(rng.choices(STUB_WORDS, k=12)).capitalize(),
+        "authors": "; ".join(f"Author{rng.randint(1, 9999)}, A." for _ in range(rng.randint(1, 8))),
+        "abstract": " ".join(rng.choices(STUB_WORDS, k=STUB_ABSTRACT_WORDS)),
+        "url": f"https://doi.org/10.1000/stub{paper_id:06d}",
+        "publish_time": f"2020-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "journal": rng.choice(["Lancet", "Nature", "BMJ", "JAMA", "Virology", ""]),
+    }
+
+
+def _paper_id(cord_uid: str) -> int:
+    try:
+        return int(cord_uid.replace("stub", ""))
+    except ValueError:
+        return zlib.crc32(cord_uid.encode("utf-8")) % STUB_NUM_PAPERS
+
+
+def stub_search_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    size, offset = body.get("size", 10), body.get("from", 0)
+    query_hash = zlib.crc32(json.dumps(body.get("query", {}), sort_keys=True).encode("utf-8"))
+    total = query_hash % 5000
+    hits = []
+    for rank in range(offset, min(offset + size, total)):
+        paper_id = (query_hash + rank * 7919) % STUB_NUM_PAPERS
+        paper = stub_paper(paper_id)
+        score = 20.0 / (rank + 1)
+        hit = {"_index": STUB_INDEX, "_id": paper["cord_uid"], "_score": score}
+        if body.get("_source", True) is not False:
+            hit["_source"] = paper
+        if "highlight" in body:
+            hit["highlight"] = {"abstract": [f"<em>{paper['title'].split()[0]}</em> {paper['abstract'][:180]}"]}
+        if "sort" in body:
+            hit["sort"] = [score, paper["cord_uid"]]
+        hits.append(hit)
+    res = {
+        "took": 1,
+        "timed_out": False,
+        "hits": {"total": {"value": total, "relation": "eq"}, "max_score": 20.0 if hits else None, "hits": hits},
+    }
+    if "aggs" in body:
+        res["aggregations"] = stub_aggregations(body["aggs"], query_hash, total)
+    return res
+
+
+def stub_aggregations(aggs: Dict[str, Any], query_hash: int, total: int) -> Dict[str, Any]:
+    rng = random.Random(query_hash)
+    aggregations = {}
+    for name, agg in aggs.items():
+        if "date_histogram" in agg:
+            keys = [str(year) for year in range(2020, 2000, -1)]
+        elif name == "journal":
+            keys = ["Lancet", "Nature", "BMJ", "JAMA", "Virology"]
+        else:
+            keys = ["true", "false"]
+        buckets = [{"key": key, "key_as_string": key, "doc_count": rng.randint(0, total)} for key in keys]
+        aggregations[name] = {"buckets": sorted(buckets, key=lambda bucket: -bucket["doc_count"])}
+    return aggregations
+
+
+class StubElasticsearch:
+    def __init__(self, latency: float, jitter: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    async def _delay(self) -> None:
+        await asyncio.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+
+    async def info(self, request: web.Request) -> web.Response:
+        # The client's product check needs the version, build flavor and tagline of a real 7.x node
+        return web.json_response(
+            {"version": {"number": "7.8.0", "build_flavor": "default"}, "tagline": "You Know, for Search"}
+        )
+
+    async def mapping(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response({STUB_INDEX: {"mappings": {"_meta": {"generation": STUB_GENERATION}}}})
+
+    async def search(self, request: web.Request) -> web.Response:
+        body = await request.json() if request.body_exists else {}
+        await self._delay()
+        return web.json_response(stub_search_response(body))
+
+    async def msearch(self, request: web.Request) -> web.Response:
+        lines = [json.loads(line) for line in (await request.text()).splitlines() if line.strip()]
+        await self._delay()
+        responses: List[Dict[str, Any]] = [{**stub_search_response(body), "status": 200} for body in lines[1::2]]
+        return web.json_response({"took": 1, "responses": responses})
+
+    async def mget(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await self._delay()
+        docs = [
+            {"_index": STUB_INDEX, "_id": doc_id, "found": True, "_source": stub_paper(_paper_id(doc_id))}
+            for doc_id in body.get("ids", [])
+        ]
+        return web.json_response({"docs": docs})
+
+    async def get(self, request: web.Request) -> web.Response:
+        doc_id = request.match_info["doc_id"]
+        await self._delay()
+        paper = {**stub_paper(_paper_id(doc_id)), "body": " ".join(STUB_WORDS * 400)}
+        return web.json_response({"_index": STUB_INDEX, "_id": doc_id, "found": True, "_source": paper})
+
+
+def stub_application(latency: float, jitter: float = 0.0, seed: int = 0) -> web.Application:
+    stub = StubElasticsearch(latency, jitter, seed)
+    app = web.Application()
+    app.router.add_get("/", stub.info)
+    app.router.add_route("*", "/{index}/_mapping", stub.mapping)
+    app.router.add_route("*", "/{index}/_search", stub.search)
+    app.router.add_route("*", "/{index}/_msearch", stub.msearch)
+    app.router.add_route("*", "/_msearch", stub.msearch)
+    app.router.add_route("*", "/{index}/_mget", stub.mget)
+    app.router.add_get("/{index}/_doc/{doc_id}", stub.get)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic Elasticsearch stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9250)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Injected latency of every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- jitter added to the latency")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = stub_application(args.latency_ms / 1000, args.jitter_ms / 1000, args.seed)
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Closed-loop load generator: `concurrency` clients replay request paths back to back against a running API
+
+python3 -m benchmarks.load_test --url http://127.0.0.1:5000 --requests 5000 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import numpy as np
+
+from .query_mix import query_mix
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+async def run_load_test(
+    base_url: str, paths: List[str], concurrency: int, warmup: int = 0, host_header: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Replay paths with `concurrency` concurrent clients; the first `warmup` requests aren't measured
+    """
+    headers = {"Host": host_header} if host_header else {}
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=False)
+    async with aiohttp.ClientSession(base_url, connector=connector, headers=headers) as session:
+
+        async def replay(worker_paths: List[str], latencies: List[float], statuses: Counter) -> None:
+            for path in worker_paths:
+                start = time.perf_counter()
+                try:
+                    async with session.get(path) as response:
+                        await response.read()
+                        statuses[response.status] += 1
+                except aiohttp.ClientError as exc:
+                    statuses[type(exc).__name__] += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        async def replay_all(all_paths: List[str]) -> Dict[str, Any]:
+            latencies: List[float] = []
+            statuses: Counter = Counter()
+            start = time.perf_counter()
+            await asyncio.gather(*[replay(all_paths[i::concurrency], latencies, statuses) for i in range(concurrency)])
+            seconds = time.perf_counter() - start
+            return {
+                "num_requests": len(all_paths),
+                "seconds": seconds,
+                "requests_per_second": len(all_paths) / seconds,
+                "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+                "error_rate": 1 - statuses[200] / len(all_paths),
+                **latency_stats(latencies),
+            }
+
+        if warmup:
+            await replay_all(paths[:warmup])
+        return {"concurrency": concurrency, **await replay_all(paths[warmup:])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running search API with a realistic query mix")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--modes", nargs="+", default=["lexical"], help="Search modes in the mix")
+    parser.add_argument("--host-header", default=None, help="Host header (must be in ALLOWED_HOSTS)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = query_mix(args.requests + args.warmup, seed=args.seed, modes=args.modes)
+    results = asyncio.run(run_load_test(args.url, paths, args.concurrency, args.warmup, args.host_header))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
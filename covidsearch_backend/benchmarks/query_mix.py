@@ -0,0 +1,102 @@
+"""
+Reproducible mix of API requests shaped like real traffic
+
+Query popularity follows a Zipf distribution, so popular queries repeat and exercise the search cache while the
+long tail misses it. Most searches ask for the first page; some page deeper or open a paper.
+"""
+import random
+from typing import List, Sequence
+from urllib.parse import urlencode
+
+QUERIES = [
+    "covid",
+    "coronavirus transmission",
+    "sars-cov-2 vaccine",
+    "incubation period",
+    "asymptomatic carriers",
+    "hydroxychloroquine",
+    "remdesivir clinical trial",
+    "mask efficacy",
+    "social distancing",
+    "ace2 receptor",
+    "spike protein",
+    "cytokine storm",
+    "ventilator shortage",
+    "mortality rate elderly",
+    "children infection",
+    "aerosol transmission",
+    "surface stability",
+    "antibody response",
+    "herd immunity",
+    "reinfection",
+    "long covid symptoms",
+    "loss of smell",
+    "pcr test sensitivity",
+    "serology testing",
+    "contact tracing app",
+    "nosocomial infection",
+    "healthcare workers protective equipment",
+    "diabetes comorbidity",
+    "obesity risk factor",
+    "vitamin d",
+    "dexamethasone",
+    "convalescent plasma",
+    "mrna vaccine",
+    "viral load",
+    "superspreading events",
+    "basic reproduction number",
+    "mers",
+    "sars 2003 outbreak",
+    "bat coronavirus origin",
+    "pangolin",
+    "wuhan seafood market",
+    "lockdown mental health",
+    "school closures",
+    "air pollution",
+    "pregnancy outcomes",
+    "blood clotting thrombosis",
+    "kawasaki disease children",
+    "ivermectin",
+    "interferon treatment",
+    "monoclonal antibodies",
+    "neutralizing antibodies",
+    "variants mutation d614g",
+    "genome sequencing",
+    "diagnostic imaging ct",
+    "lung ultrasound",
+    "icu admission",
+    "epidemic model seir",
+    "travel restrictions",
+    "economic impact",
+    "telemedicine",
+]
+ZIPF_EXPONENT = 1.1
+PAGE_SIZE = 20
+DEEP_PAGE_FRACTION = 0.15  # Searches asking for page 2-5
+PAPER_FRACTION = 0.1  # Requests fetching a full paper instead of searching
+
+
+def query_mix(
+    num_requests: int,
+    seed: int = 0,
+    modes: Sequence[str] = ("lexical",),
+    paper_ids: Sequence[str] = (),
+) -> List[str]:
+    """
+    Request paths (with query strings) of the mix; paper requests are only included if paper_ids are given
+    """
+    rng = random.Random(seed)
+    query_weights = [1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(len(QUERIES))]
+    paths = []
+    for _ in range(num_requests):
+        if paper_ids and rng.random() < PAPER_FRACTION:
+            paths.append(f"/paper/{rng.choice(paper_ids)}/")
+            continue
+        params = {"query": rng.choices(QUERIES, weights=query_weights)[0], "size": PAGE_SIZE}
+        if rng.random() < DEEP_PAGE_FRACTION:
+            params["from"] = PAGE_SIZE * rng.randint(1, 4)
+        mode = rng.choice(modes)
+        if mode != "lexical":
+            params["mode"] = mode
+        paths.append(f"/search/?{urlencode(params)}")
+    return paths
@@ -0,0 +1,140 @@
+"""
+Boot the search API under gunicorn through its WSGI and/or ASGI entry point and load-test /search/ with the query mix
+
+With --es stub, Elasticsearch is replaced by benchmarks.es_stub (deterministic responses after --es-latency-ms),
+so the numbers measure the API's own serving overhead on one box. With --es real, the API uses its ES settings.
+
+python3 -m benchmarks.run_benchmark --server both --es stub --concurrency 8 32 --requests 3000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterator, List
+
+from .es_stub import STUB_NUM_PAPERS
+from .load_test import run_load_test
+from .query_mix import query_mix
+
+SERVER_COMMANDS = {
+    # Django runs each async view in a new event loop per request (async_to_sync) under WSGI
+    "wsgi": ["covidsearch_backend.wsgi:application", "-k", "gthread"],
+    # One long-lived event loop per worker, as deployed by run_backend.sh
+    "asgi": ["covidsearch_backend.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+}
+STARTUP_TIMEOUT = 60  # Seconds
+NUM_PAPER_IDS = 1000  # Distinct papers fetched by the mix
+
+
+def _allowed_host() -> str:
+    from covidsearch_backend.settings import ALLOWED_HOSTS
+
+    return ALLOWED_HOSTS[0] if ALLOWED_HOSTS else "localhost"
+
+
+def _wait_until_ready(url: str, host_header: str) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            request = urllib.request.Request(url, headers={"Host": host_header})
+            with urllib.request.urlopen(request, timeout=5):
+                return
+        except urllib.error.HTTPError:
+            return  # The app answered, even if with an error status
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} didn't come up within {STARTUP_TIMEOUT} seconds")
+
+
+@contextmanager
+def _process(command: List[str], env: Dict[str, str], ready_url: str, host_header: str = "") -> Iterator[None]:
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_until_ready(ready_url, host_header)
+        yield
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+@contextmanager
+def _es_stub(port: int, latency_ms: float, jitter_ms: float) -> Iterator[None]:
+    command = [sys.executable, "-m", "benchmarks.es_stub", "--port", str(port)]
+    command += ["--latency-ms", str(latency_ms), "--jitter-ms", str(jitter_ms)]
+    with _process(command, dict(os.environ), f"http://127.0.0.1:{port}/"):
+        yield
+
+
+def benchmark_server(
+    server: str, args: argparse.Namespace, env: Dict[str, str], paths: List[str], host_header: str
+) -> Dict[str, Any]:
+    command = [sys.executable, "-m", "gunicorn", *SERVER_COMMANDS[server], "-b", f"127.0.0.1:{args.port}"]
+    command += ["-w", str(args.workers)]
+    if server == "wsgi":
+        command += ["--threads", str(args.wsgi_threads)]
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = {"workers": args.workers, "runs": []}
+    with _process(command, env, f"{base_url}/search/?query=warmup", host_header):
+        for concurrency in args.concurrency:
+            run = asyncio.run(run_load_test(base_url, paths, concurrency, args.warmup, host_header))
+            print(
+                f"{server} @ concurrency {concurrency}: {run['requests_per_second']:.1f} req/s, "
+                f"p99 {run.get('p99_ms', float('nan')):.1f} ms, error rate {run['error_rate']:.1%}"
+            )
+            results["runs"].append(run)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the search API through its WSGI and ASGI entry points")
+    parser.add_argument("--server", choices=["wsgi", "asgi", "both"], default="both")
+    parser.add_argument("--es", choices=["stub", "real"], default="stub")
+    parser.add_argument("--es-latency-ms", type=float, default=5.0, help="Injected latency of the ES stub")
+    parser.add_argument("--es-jitter-ms", type=float, default=1.0)
+    parser.add_argument("--es-stub-port", type=int, default=9250)
+    parser.add_argument("--port", type=int, default=5050, help="Port the API is served on")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--wsgi-threads", type=int, default=8, help="Threads per gthread worker under WSGI")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=2000, help="Measured requests per run")
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--modes", nargs="+", default=["lexical"], help="Search modes in the mix")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the search result cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.no_cache:
+        env["SEARCH_CACHE_MAX_ENTRIES"] = "0"
+    paper_ids: List[str] = []
+    if args.es == "stub":
+        env["ES_HOSTS"] = f"127.0.0.1:{args.es_stub_port}"
+        paper_ids = [f"stub{paper_id:06d}" for paper_id in range(0, STUB_NUM_PAPERS, STUB_NUM_PAPERS // NUM_PAPER_IDS)]
+    paths = query_mix(args.requests + args.warmup, seed=args.seed, modes=args.modes, paper_ids=paper_ids)
+    host_header = _allowed_host()
+    servers = ["wsgi", "asgi"] if args.server == "both" else [args.server]
+
+    results: Dict[str, Any] = {"config": {k: v for k, v in vars(args).items() if k != "output"}}
+    with ExitStack() as stack:
+        if args.es == "stub":
+            stack.enter_context(_es_stub(args.es_stub_port, args.es_latency_ms, args.es_jitter_ms))
+        for server in servers:
+            results[server] = benchmark_server(server, args, env, paths, host_header)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
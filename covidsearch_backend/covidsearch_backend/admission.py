@@ -0,0 +1,138 @@
+"""
+Load protection for Elasticsearch: single-flight coalescing of identical searches and admission control
+
+Concurrent identical searches (e.g. a trending query) share one in-flight ES request whose result fans out to every
+waiter. Outstanding ES work per worker is bounded: requests beyond ES_MAX_IN_FLIGHT wait in a bounded queue and fail
+fast with a 503 and Retry-After once the queue is full or they've waited ES_QUEUE_TIMEOUT seconds, so an overload sheds
+requests at the API instead of tripping ES's circuit breakers (429s) and cascading.
+Both rely on state shared across requests, so they only apply on the worker's long-lived ASGI event loop.
+"""
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from elasticsearch import TransportError
+
+from .es_client import on_serving_loop
+from .metrics import ADMISSION_REJECTIONS, COALESCED_REQUESTS
+
+
+class Overloaded(Exception):
+    """
+    Raised when an ES request isn't admitted because too many are outstanding
+    """
+
+
+class AdmissionController:
+    """
+    At most max_in_flight admitted blocks at once; up to max_queued more wait up to queue_timeout seconds for a slot
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float):
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._num_queued = 0
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._slots.locked():
+            if self._num_queued >= self.max_queued:
+                ADMISSION_REJECTIONS.labels("queue_full").inc()
+                raise Overloaded("ES request queue is full")
+            self._num_queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                ADMISSION_REJECTIONS.labels("queue_timeout").inc()
+                raise Overloaded(f"Waited {self.queue_timeout}s for an ES request slot")
+            finally:
+                self._num_queued -= 1
+        else:
+            await self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+_admission_controller: Optional[AdmissionController] = None
+_in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+
+
+@asynccontextmanager
+async def admit() -> AsyncIterator[None]:
+    """
+    Admit a block of ES requests, raising Overloaded if the worker has too many outstanding
+    """
+    global _admission_controller
+    if not on_serving_loop():
+        yield
+        return
+    if _admission_controller is None:
+        # Created on the serving loop, which its semaphore binds to
+        _admission_controller = AdmissionController(
+            settings.ES_MAX_IN_FLIGHT, settings.ES_MAX_QUEUED, settings.ES_QUEUE_TIMEOUT
+        )
+    async with _admission_controller.admit():
+        yield
+
+
+async def coalesced(key: str, compute: Callable[[], Awaitable[Any]], kind: str = "search") -> Any:
+    """
+    Await compute(), or the in-flight computation of the same key if one was already started by another request
+    """
+    if not on_serving_loop():
+        return await compute()
+    search = _in_flight.get(key)
+    if search is None:
+        search = asyncio.ensure_future(compute())
+        _in_flight[key] = search
+        search.add_done_callback(functools.partial(_finish_search, key))
+    else:
+        COALESCED_REQUESTS.labels(kind).inc()
+    # Shielded, so a client that goes away doesn't cancel the search for the other waiters
+    return await asyncio.shield(search)
+
+
+def _finish_search(key: str, search: "asyncio.Future[Any]") -> None:
+    _in_flight.pop(key, None)
+    if not search.cancelled():
+        search.exception()  # Mark an error as retrieved, even if every waiter went away
+
+
+def es_overloaded(exc: TransportError) -> bool:
+    """
+    Whether ES rejected (429) or failed (5xx, e.g. no shards available) a request, rather than the request being bad
+    """
+    # Connection errors carry "N/A" instead of an HTTP status
+    return isinstance(exc.status_code, int) and (exc.status_code == 429 or exc.status_code >= 500)
+
+
+def _overloaded(retry_after: int) -> JsonResponse:
+    response = JsonResponse(data={"status": 503, "error": "Search is overloaded; retry later"}, status=503)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def sheds_load(view: Callable[..., Awaitable[HttpResponse]]) -> Callable[..., Awaitable[HttpResponse]]:
+    """
+    Turn Overloaded, and ES rejecting or failing a request with a 429 or 5xx, into a 503 with Retry-After
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        try:
+            return await view(request, *args, **kwargs)
+        except Overloaded:
+            return _overloaded(settings.OVERLOAD_RETRY_AFTER)
+        except TransportError as te:
+            if not es_overloaded(te):
+                raise
+            ADMISSION_REJECTIONS.labels("es_rejected" if te.status_code == 429 else "es_failed").inc()
+            return _overloaded(settings.OVERLOAD_RETRY_AFTER)
+
+    return wrapper
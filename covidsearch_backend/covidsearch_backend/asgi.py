@@ -13,4 +13,31 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'covidsearch_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from .es_client import close_es_client, register_serving_loop  # noqa: E402 (needs configured settings)
+from .search_cache import close_search_cache  # noqa: E402
+
+
+async def _handle_lifespan(receive, send) -> None:
+    """
+    Close the pooled ES and redis clients on worker shutdown, since Django doesn't implement the ASGI lifespan protocol
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            register_serving_loop()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_es_client()
+            await close_search_cache()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _handle_lifespan(receive, send)
+        return
+    register_serving_loop()
+    await django_application(scope, receive, send)
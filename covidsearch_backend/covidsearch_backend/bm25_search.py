@@ -0,0 +1,42 @@
+"""
+ES-free lexical search over the memory-mapped BM25 index (scripts/bm25_index.py) written by the index build
+
+Serves searches when Elasticsearch is unreachable, or every search if SEARCH_ENGINE is "bm25".
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .build_artifacts import artifact_available, cached_artifact
+from .scripts.bm25_index import BM25_DIR, BM25_META_FILENAME, Bm25Index
+
+
+def _get_bm25_index() -> Optional[Bm25Index]:
+    return cached_artifact(os.path.join(settings.MODELS_DIR, BM25_DIR), BM25_META_FILENAME, Bm25Index)
+
+
+def bm25_index_available() -> bool:
+    return artifact_available(os.path.join(settings.MODELS_DIR, BM25_DIR), BM25_META_FILENAME)
+
+
+def bm25_generation() -> str:
+    """
+    Identifies the build of the BM25 index, like the index generation does for ES (e.g. in search cache keys)
+    """
+    return f"bm25_{_get_bm25_index().meta['built_at']}"
+
+
+def _bm25_search(query: str, size: int, offset: int) -> Tuple[int, List[Tuple[Dict[str, Any], float]]]:
+    bm25_index = _get_bm25_index()
+    total, top_docs = bm25_index.search(query, offset + size)
+    return total, [(bm25_index.doc(doc), score) for doc, score in top_docs[offset:]]
+
+
+async def bm25_search(query: str, size: int, offset: int) -> Tuple[int, List[Tuple[Dict[str, Any], float]]]:
+    """
+    Number of papers matching every query term and a page of (result fields, BM25 score), best first
+    """
+    # Off the event loop: scoring long postings lists and page faults on the mmap'd files take a while
+    return await asyncio.get_running_loop().run_in_executor(None, _bm25_search, query, size, offset)
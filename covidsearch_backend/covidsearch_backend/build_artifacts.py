@@ -0,0 +1,39 @@
+"""
+Read-only artifacts of the index build (ANN index, TF-IDF vectors, BM25, spelling and suggest indexes) in MODELS_DIR
+
+Builds write each artifact into a new directory or file and rename it into place, writing its meta file last, so a
+new mtime of the meta file means a complete new version is in place. cached_artifact reopens an artifact then, and
+otherwise hands out the instance the worker already has open.
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+Artifact = TypeVar("Artifact")
+
+_artifacts: Dict[str, Tuple[int, Any]] = {}  # Meta file path -> (its mtime, artifact opened from it)
+# Executor threads may open the same new version at once; the lock keeps it to one open per version
+_artifacts_lock = threading.Lock()
+
+
+def artifact_available(directory: str, meta_filename: str) -> bool:
+    return os.path.exists(os.path.join(directory, meta_filename))
+
+
+def cached_artifact(
+    directory: str, meta_filename: str, artifact_class: Callable[[str], Artifact]
+) -> Optional[Artifact]:
+    """
+    The artifact_class(directory) instance of the current build of the artifact, or None if it hasn't been built yet
+    """
+    meta_path = os.path.join(directory, meta_filename)
+    try:
+        mtime = os.stat(meta_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _artifacts_lock:
+        cached = _artifacts.get(meta_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, artifact_class(directory))
+            _artifacts[meta_path] = cached
+    return cached[1]
@@ -0,0 +1,98 @@
+"""
+Process-wide, pooled AsyncElasticsearch client shared by every search request
+
+Under ASGI (see asgi.py) all requests of a worker run on one event loop, so a single client and its aiohttp
+connection pool can be reused for the lifetime of the worker and closed on lifespan shutdown.
+Under WSGI, Django runs each async view in a throwaway event loop, so a short-lived client is created and closed
+around the request instead of leaking its sockets.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+from django.conf import settings
+from elasticsearch import AsyncElasticsearch
+from elasticsearch._async.http_aiohttp import AIOHttpConnection, ESClientResponse
+
+_shared_es_client: Optional[AsyncElasticsearch] = None
+_serving_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class KeepAliveAIOHttpConnection(AIOHttpConnection):
+    """
+    AIOHttpConnection whose connector keeps idle sockets alive for ES_KEEPALIVE_TIMEOUT seconds,
+    so bursts of searches reuse warm connections instead of paying for a new TCP handshake
+    """
+
+    async def _create_aiohttp_session(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            skip_auto_headers=("accept", "accept-encoding", "user-agent"),
+            auto_decompress=True,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            response_class=ESClientResponse,
+            connector=aiohttp.TCPConnector(
+                limit=self._limit,
+                keepalive_timeout=settings.ES_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True,
+                enable_cleanup_closed=True,
+                ssl=self._ssl_context,
+            ),
+        )
+
+
+def _create_es_client() -> AsyncElasticsearch:
+    return AsyncElasticsearch(
+        hosts=settings.ES_HOSTS,
+        connection_class=KeepAliveAIOHttpConnection,
+        maxsize=settings.ES_MAX_CONNECTIONS,  # Size of the connection pool per ES node
+        timeout=settings.ES_REQUEST_TIMEOUT,
+        max_retries=settings.ES_MAX_RETRIES,
+        retry_on_timeout=True,
+    )
+
+
+def register_serving_loop() -> None:
+    """
+    Mark the running event loop as the long-lived loop of this worker; called by the ASGI application
+    """
+    global _serving_loop
+    _serving_loop = asyncio.get_running_loop()
+
+
+def on_serving_loop() -> bool:
+    """
+    Whether the caller runs on the worker's long-lived event loop (i.e. under ASGI)
+    """
+    return _serving_loop is not None and asyncio.get_running_loop() is _serving_loop
+
+
+@asynccontextmanager
+async def es_client() -> AsyncIterator[AsyncElasticsearch]:
+    """
+    Yield the shared client when running on the worker's serving loop, otherwise a request-scoped client
+    """
+    global _shared_es_client
+    if on_serving_loop():
+        if _shared_es_client is None:
+            _shared_es_client = _create_es_client()
+        yield _shared_es_client
+    else:
+        es = _create_es_client()
+        try:
+            yield es
+        finally:
+            await es.close()
+
+
+async def close_es_client() -> None:
+    """
+    Close the shared client and its pooled connections; called on ASGI lifespan shutdown
+    """
+    global _shared_es_client
+    if _shared_es_client is not None:
+        await _shared_es_client.close()
+        _shared_es_client = None
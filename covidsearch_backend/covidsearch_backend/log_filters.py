@@ -0,0 +1,36 @@
+"""
+Logging filters used by the LOGGING config in settings.py
+"""
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let at most `rate` records per call site (file and line) through every `per` seconds.
+    The first record let through after a window reports how many records of the call site were dropped in it.
+    """
+
+    def __init__(self, rate: int = 10, per: float = 60.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self._windows: Dict[Tuple[str, int], Tuple[float, int, int]] = {}  # Window start, records passed, dropped
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        call_site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window_start, num_passed, num_dropped = self._windows.get(call_site, (now, 0, 0))
+            if now - window_start >= self.per:
+                if num_dropped:
+                    record.msg = f"{record.msg} ({num_dropped} similar messages suppressed)"
+                window_start, num_passed, num_dropped = now, 0, 0
+            if num_passed >= self.rate:
+                self._windows[call_site] = (window_start, num_passed, num_dropped + 1)
+                return False
+            self._windows[call_site] = (window_start, num_passed + 1, num_dropped)
+            return True
@@ -0,0 +1,200 @@
+"""
+Prometheus metrics of the search API, scraped from /metrics, and per-request stage timings for Server-Timing headers
+
+Each gunicorn worker keeps its own registry. To aggregate all workers on /metrics, point PROMETHEUS_MULTIPROC_DIR at an
+empty dir shared by the workers before they start (prometheus_client then writes the metrics to mmap'd files there).
+"""
+import contextvars
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+
+ES_REQUEST_SECONDS = Histogram(
+    "covidsearch_es_request_seconds",
+    "Round-trip time of Elasticsearch requests, as seen by the API",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+ES_TOOK_SECONDS = Histogram(
+    "covidsearch_es_took_seconds",
+    "Time Elasticsearch reports it spent on searches (took)",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+RESULT_SHAPING_SECONDS = Histogram(
+    "covidsearch_result_shaping_seconds",
+    "Time spent shaping Elasticsearch responses into API results",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+SERIALIZATION_SECONDS = Histogram(
+    "covidsearch_serialization_seconds",
+    "Time spent serializing API responses to JSON",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+SPELLING_CORRECTION_SECONDS = Histogram(
+    "covidsearch_spelling_correction_seconds",
+    "Time spent correcting the spelling of queries",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+REQUEST_SECONDS = Histogram(
+    "covidsearch_request_seconds",
+    "Time spent handling API requests",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter("covidsearch_requests", "API responses by status code", ["endpoint", "status"])
+SEARCH_HITS = Counter("covidsearch_search_hits", "Papers returned by searches", ["mode"])
+SEARCH_CACHE_LOOKUPS = Counter(
+    "covidsearch_search_cache_lookups", "Search cache lookups by outcome (local_hit, redis_hit, miss)", ["outcome"]
+)
+ERRORS = Counter("covidsearch_errors", "Errors by where they were raised", ["source"])
+COALESCED_REQUESTS = Counter(
+    "covidsearch_coalesced_requests", "ES requests saved by joining an identical in-flight one, by kind", ["kind"]
+)
+BM25_FALLBACKS = Counter(
+    "covidsearch_bm25_fallbacks", "Searches served by the BM25 index because ES was unreachable or overloaded"
+)
+ADMISSION_REJECTIONS = Counter(
+    "covidsearch_admission_rejections",
+    "Requests shed with a 503 (queue_full, queue_timeout, es_rejected, es_failed)",
+    ["reason"],
+)
+
+
+class RequestTimings:
+    """
+    Time spent per stage of the current request, e.g. {"es": 0.012, "serialize": 0.001}, plus stage descriptions
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.descriptions: Dict[str, str] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def server_timing_header(self) -> str:
+        metrics = []
+        for stage in dict.fromkeys([*self.durations, *self.descriptions]):
+            metric = stage
+            if stage in self.durations:
+                metric += f";dur={self.durations[stage] * 1000:.2f}"
+            if stage in self.descriptions:
+                metric += f';desc="{self.descriptions[stage]}"'
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+
+# Set per request by instrumented_view; tasks spawned by the view (asyncio.gather) share the same RequestTimings
+_request_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def record_stage(stage: str, seconds: Optional[float] = None, description: Optional[str] = None) -> None:
+    timings = _request_timings.get()
+    if timings is None:
+        return
+    if seconds is not None:
+        timings.add(stage, seconds)
+    if description is not None:
+        timings.descriptions[stage] = description
+
+
+@contextmanager
+def timed(stage: str, histogram: Histogram) -> Iterator[None]:
+    """
+    Observe the duration of the block in histogram and add it to the request's timings of stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        histogram.observe(seconds)
+        record_stage(stage, seconds)
+
+
+async def observe_es(operation: str, es_call: Awaitable[Dict]) -> Dict:
+    """
+    Await an Elasticsearch call, recording its round trip and (for searches) the took it reports
+    """
+    try:
+        with timed("es", ES_REQUEST_SECONDS.labels(operation)):
+            res = await es_call
+    except Exception:
+        ERRORS.labels("elasticsearch").inc()
+        raise
+    if "took" in res:
+        ES_TOOK_SECONDS.labels(operation).observe(res["took"] / 1000)
+        record_stage("es_took", res["took"] / 1000)
+    return res
+
+
+def instrumented_view(endpoint: str) -> Callable:
+    """
+    Decorate an async view: count and time its responses, log slow requests and, if SERVER_TIMING_HEADERS is on,
+    report the request's stage timings in a Server-Timing header
+    """
+
+    def decorator(view: Callable[..., Awaitable[HttpResponse]]) -> Callable[..., Awaitable[HttpResponse]]:
+        @functools.wraps(view)
+        async def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            timings = RequestTimings()
+            _request_timings.set(timings)
+            start = time.perf_counter()
+            try:
+                response = await view(request, *args, **kwargs)
+            except Exception:
+                REQUESTS.labels(endpoint, "500").inc()
+                ERRORS.labels(endpoint).inc()
+                raise
+            seconds = time.perf_counter() - start
+            REQUEST_SECONDS.labels(endpoint).observe(seconds)
+            REQUESTS.labels(endpoint, str(response.status_code)).inc()
+            if seconds > settings.SLOW_REQUEST_THRESHOLD:
+                # Rate-limited by the logging config, so a latency regression doesn't flood the logs
+                logger.warning(
+                    "Slow request (%.0fms) %s: %s",
+                    seconds * 1000,
+                    request.get_full_path(),
+                    timings.server_timing_header(),
+                )
+            if settings.SERVER_TIMING_HEADERS:
+                timings.add("total", seconds)
+                response["Server-Timing"] = timings.server_timing_header()
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _metrics_registry() -> CollectorRegistry:
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Prometheus scrape endpoint
+    """
+    return HttpResponse(generate_latest(_metrics_registry()), content_type=CONTENT_TYPE_LATEST)
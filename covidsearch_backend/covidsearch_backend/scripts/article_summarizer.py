@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+# article_summarizer.py
+# Summarizes news articles with T5 for throughput (articles/sec on CPU) rather than per-article latency:
+# * One long-lived worker thread keeps the model loaded and summarizes whatever articles are pending in batches.
+#   Each batch is sorted by length, so padding wastes little compute in model.generate.
+# * torch's intra-op threads are bounded per worker, instead of forking processes that share the model
+#   (the earlier multiprocessing attempts hung or ran slower).
+# * Summaries are cached in SQLite, keyed by a hash of the article's content and of the model + generation params,
+#   so re-crawled articles are never summarized twice.
+
+from concurrent.futures import Future
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SUMMARIZER_MODEL_NAME = "t5-base"
+SUMMARIZER_MAX_INPUT_TOKENS = 512
+SUMMARIZER_BATCH_SIZE = 8
+SUMMARIZER_BATCHES_PER_ROUND = 4  # Pending articles the worker takes at once, so sorting by length has more to sort
+SUMMARIZER_MAX_BATCH_DELAY = 0.05  # Seconds the worker waits for more articles once one is pending
+SUMMARIZER_GENERATE_KWARGS = {
+    "max_length": 150,
+    "min_length": 100,
+    "length_penalty": 1.2,
+    "num_beams": 4,
+    "early_stopping": True,
+}
+# CPU inference profiles, from the full-precision baseline to the fastest; compare them with benchmark_summarizer.py
+SUMMARIZER_PROFILES = {
+    "baseline": {"model_name": SUMMARIZER_MODEL_NAME, "quantize": False, "generate_kwargs": SUMMARIZER_GENERATE_KWARGS},
+    "int8_beam2": {
+        "model_name": SUMMARIZER_MODEL_NAME,
+        "quantize": True,
+        "generate_kwargs": {**SUMMARIZER_GENERATE_KWARGS, "num_beams": 2},
+    },
+    "int8_greedy": {
+        "model_name": SUMMARIZER_MODEL_NAME,
+        "quantize": True,
+        "generate_kwargs": {"max_length": 150, "min_length": 100, "num_beams": 1},
+    },
+    "small_int8_greedy": {
+        "model_name": "t5-small",
+        "quantize": True,
+        "generate_kwargs": {"max_length": 150, "min_length": 100, "num_beams": 1},
+    },
+}
+SUMMARY_CACHE_PATH = "article_summaries.sqlite3"
+
+
+def article_content_hash(article: str) -> str:
+    return hashlib.sha256(article.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """
+    On-disk summaries keyed by (article content hash, summarizer key); safe to share between threads
+    """
+
+    def __init__(self, cache_path: str = SUMMARY_CACHE_PATH):
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "content_hash TEXT NOT NULL, summarizer_key TEXT NOT NULL, summary TEXT NOT NULL, "
+            "PRIMARY KEY (content_hash, summarizer_key))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, content_hash: str, summarizer_key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE content_hash = ? AND summarizer_key = ?",
+                (content_hash, summarizer_key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, summarizer_key: str, summaries: Iterable[Tuple[str, str]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO summaries (content_hash, summarizer_key, summary) VALUES (?, ?, ?)",
+                [(content_hash, summarizer_key, summary) for content_hash, summary in summaries],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ArticleSummarizer:
+    """
+    Batched T5 summarizer; the model is loaded on first use since importing torch and loading weights is slow
+    """
+
+    def __init__(
+        self,
+        model_name: str = SUMMARIZER_MODEL_NAME,
+        batch_size: int = SUMMARIZER_BATCH_SIZE,
+        num_threads: Optional[int] = None,
+        generate_kwargs: Optional[Dict[str, Any]] = None,
+        quantize: bool = False,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_threads = num_threads  # torch intra-op threads; None keeps torch's default of one per core
+        self.quantize = quantize  # Dynamic int8 quantization of the Linear layers
+        self.generate_kwargs = dict(SUMMARIZER_GENERATE_KWARGS if generate_kwargs is None else generate_kwargs)
+        self._tokenizer = None
+        self._model = None
+
+    @property
+    def cache_key(self) -> str:
+        """
+        Identifies the summaries this summarizer produces; other models or generation params get their own entries
+        """
+        quantization = ":int8" if self.quantize else ""
+        return f"{self.model_name}{quantization}:{json.dumps(self.generate_kwargs, sort_keys=True)}"
+
+    def _load(self) -> None:
+        import torch
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self._model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+        self._model.eval()
+        if self.quantize:
+            # Weights of the Linear layers (most of T5's compute) become int8; activations are quantized on the fly
+            self._model = torch.quantization.quantize_dynamic(self._model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def summarize(self, articles: List[str]) -> List[str]:
+        import torch
+
+        if self._model is None:
+            self._load()
+        summaries = [""] * len(articles)
+        # Batches of similar lengths waste less compute on padding
+        order = sorted(range(len(articles)), key=lambda i: len(articles[i]))
+        with torch.no_grad():
+            for start in range(0, len(articles), self.batch_size):
+                batch_idxs = order[start : start + self.batch_size]
+                inputs = self._tokenizer(
+                    [f"summarize: {articles[i]}" for i in batch_idxs],
+                    padding=True,
+                    truncation=True,
+                    max_length=SUMMARIZER_MAX_INPUT_TOKENS,
+                    return_tensors="pt",
+                )
+                outputs = self._model.generate(**inputs, **self.generate_kwargs)
+                for i, summary in zip(batch_idxs, self._tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+                    summaries[i] = summary
+        return summaries
+
+
+def summarizer_from_profile(
+    profile: str, batch_size: int = SUMMARIZER_BATCH_SIZE, num_threads: Optional[int] = None
+) -> ArticleSummarizer:
+    if profile not in SUMMARIZER_PROFILES:
+        raise ValueError(f"Unknown summarizer profile {profile}; must be one of {list(SUMMARIZER_PROFILES)}")
+    return ArticleSummarizer(batch_size=batch_size, num_threads=num_threads, **SUMMARIZER_PROFILES[profile])
+
+
+class SummarizationWorker:
+    """
+    Long-lived worker thread: summarize() returns a future, and pending articles are summarized in batches
+    """
+
+    def __init__(self, summarizer: ArticleSummarizer, cache: SummaryCache):
+        self.summarizer = summarizer
+        self.cache = cache
+        self._pending: "queue.Queue[Optional[Tuple[str, str, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="summarization-worker", daemon=True)
+        self._thread.start()
+
+    def summarize(self, article: str) -> "Future[str]":
+        content_hash = article_content_hash(article)
+        future: Future = Future()
+        summary = self.cache.get(content_hash, self.summarizer.cache_key)
+        if summary is not None:
+            future.set_result(summary)
+        else:
+            self._pending.put((content_hash, article, future))
+        return future
+
+    def _next_round(self) -> Optional[List[Tuple[str, str, Future]]]:
+        item = self._pending.get()
+        if item is None:
+            return None
+        batch = [item]
+        while len(batch) < self.summarizer.batch_size * SUMMARIZER_BATCHES_PER_ROUND:
+            try:
+                item = self._pending.get(timeout=SUMMARIZER_MAX_BATCH_DELAY)
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this round first, then stop
+                self._pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            pending = self._next_round()
+            if pending is None:
+                return
+            summaries = {}
+            # Articles submitted more than once are summarized once, whether they're pending together or not
+            articles_by_hash = {}
+            for content_hash, article, _ in pending:
+                if content_hash in summaries or content_hash in articles_by_hash:
+                    continue
+                summary = self.cache.get(content_hash, self.summarizer.cache_key)
+                if summary is not None:
+                    summaries[content_hash] = summary
+                else:
+                    articles_by_hash[content_hash] = article
+            try:
+                new_summaries = self.summarizer.summarize(list(articles_by_hash.values())) if articles_by_hash else []
+                self.cache.put_many(self.summarizer.cache_key, zip(articles_by_hash, new_summaries))
+            except Exception as exc:
+                for _, _, future in pending:
+                    future.set_exception(exc)
+                continue
+            summaries.update(zip(articles_by_hash, new_summaries))
+            for content_hash, _, future in pending:
+                future.set_result(summaries[content_hash])
+
+    def close(self) -> None:
+        self._pending.put(None)
+        self._thread.join()
+
+
+def summarize_article_files(article_filenames: List[str], worker: SummarizationWorker) -> Dict[str, str]:
+    """
+    Summaries of the articles saved by the RSS crawler, by filename
+    """
+    futures = {}
+    for article_filename in article_filenames:
+        with open(article_filename, "r") as article_file:
+            futures[article_filename] = worker.summarize(article_file.read())
+    return {article_filename: future.result() for article_filename, future in futures.items()}
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+# benchmark_index_mapping.py
+# Before/after benchmark of the explicit index mapping: loads the preprocessed papers (research_paper_bodies/) into
+# a dynamically mapped index and into one created with index_mappings.py, then compares index size and the latency
+# of the search query search_api runs.
+# Run from cord_19_dataset/ after a build, e.g.
+# python3 ../covidsearch_backend/covidsearch_backend/scripts/benchmark_index_mapping.py
+
+import argparse
+from benchmark_utils import latency_percentiles
+from bulk_indexer import bulk_index_parquet_files
+from elasticsearch import Elasticsearch
+import glob
+from index_mappings import INDEX_MAPPING_VERSION, covid19_papers_index_body
+import json
+import numpy as np
+import os
+import time
+from typing import Any, Dict, List
+
+BENCHMARK_QUERIES = [
+    "coronavirus",
+    "covid transmission",
+    "incubation period",
+    "asymptomatic carriers",
+    "vaccine efficacy",
+    "hydroxychloroquine",
+    "social distancing",
+    "respiratory syndrome",
+    "viral load in children",
+    "sars-cov-2 spike protein",
+    "ace2 receptor binding",
+    "mortality rate elderly patients",
+]
+NUM_WARMUP_RUNS = 3
+NUM_TIMED_RUNS = 20
+BENCHMARK_REQUEST_TIMEOUT = 600  # Seconds
+PAPERS_PARQUET_DIR = "research_paper_bodies/"
+
+
+def build_search_body(query: str, tiebreaker_field: str) -> Dict[str, Any]:
+    """
+    Same query, highlighting and sort as search_api._build_search_body
+    """
+    return {
+        "size": 20,
+        "query": {
+            "bool": {
+                "must": {
+                    "multi_match": {
+                        "query": query,
+                        "fields": ["title^2", "abstract", "body"],
+                        "fuzziness": "AUTO",
+                        "operator": "AND",
+                    }
+                },
+                "should": {"multi_match": {"query": query, "fields": ["title^2", "abstract"], "type": "phrase"}},
+            }
+        },
+        "_source": ["cord_uid", "title", "authors", "abstract", "url", "publish_time", "journal"],
+        "highlight": {
+            "fields": {
+                "title": {"number_of_fragments": 0},
+                "abstract": {"fragment_size": 200, "number_of_fragments": 2},
+                "body": {"fragment_size": 200, "number_of_fragments": 3},
+            }
+        },
+        "sort": ["_score", {tiebreaker_field: "asc"}],
+    }
+
+
+def load_index(es: Elasticsearch, es_idx: str, index_body: Dict[str, Any]) -> float:
+    es.indices.delete(index=es_idx, ignore=[404])
+    es.indices.create(index=es_idx, body=index_body)
+    start = time.time()
+    report = bulk_index_parquet_files(es, es_idx, sorted(glob.glob(os.path.join(PAPERS_PARQUET_DIR, "*.parquet"))))
+    es.indices.refresh(index=es_idx)
+    es.indices.forcemerge(index=es_idx, max_num_segments=1, request_timeout=BENCHMARK_REQUEST_TIMEOUT)
+    print(f"Loaded {es_idx}: {report.as_dict()}")
+    return time.time() - start
+
+
+def time_queries(es: Elasticsearch, es_idx: str, tiebreaker_field: str, queries: List[str]) -> Dict[str, float]:
+    latencies, took = [], []
+    for query in queries:
+        search_body = build_search_body(query, tiebreaker_field)
+        for run in range(NUM_WARMUP_RUNS + NUM_TIMED_RUNS):
+            start = time.perf_counter()
+            # Bypass the shard request cache so every run does the full search
+            res = es.search(index=es_idx, body=search_body, request_cache=False)
+            if run >= NUM_WARMUP_RUNS:
+                latencies.append(time.perf_counter() - start)
+                took.append(res["took"])
+    return {**latency_percentiles(latencies), "mean_took_ms": float(np.mean(took))}
+
+
+def benchmark_index(es: Elasticsearch, es_idx: str, index_body: Dict, tiebreaker_field: str) -> Dict[str, Any]:
+    load_time = load_index(es, es_idx, index_body)
+    store_stats = es.indices.stats(index=es_idx, metric="store,docs")["indices"][es_idx]["primaries"]
+    return {
+        "load_seconds": load_time,
+        "num_docs": store_stats["docs"]["count"],
+        "store_size_bytes": store_stats["store"]["size_in_bytes"],
+        **time_queries(es, es_idx, tiebreaker_field, BENCHMARK_QUERIES),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the dynamic and the explicit research papers index mapping")
+    parser.add_argument("--es-host", default="localhost")
+    parser.add_argument("--keep-indices", action="store_true", help="Don't delete the benchmark indices afterwards")
+    args = parser.parse_args()
+
+    es = Elasticsearch(hosts=[args.es_host], timeout=BENCHMARK_REQUEST_TIMEOUT)
+    # docker-compose runs a single-node cluster, where replicas can't be allocated
+    dynamic_index_body = {"settings": {"number_of_replicas": 0}}
+    mapped_index_body = covid19_papers_index_body()
+    mapped_index_body["settings"]["number_of_replicas"] = 0
+    results = {
+        "dynamic": benchmark_index(es, "covid19_papers_bench_dynamic", dynamic_index_body, "cord_uid.keyword"),
+        f"mapping_v{INDEX_MAPPING_VERSION}": benchmark_index(
+            es, "covid19_papers_bench_mapped", mapped_index_body, "cord_uid"
+        ),
+    }
+    print(json.dumps(results, indent=2))
+    before, after = results["dynamic"], results[f"mapping_v{INDEX_MAPPING_VERSION}"]
+    print(f"Index size: {before['store_size_bytes']} -> {after['store_size_bytes']} bytes")
+    print(f"p50 latency: {before['p50_ms']:.1f} -> {after['p50_ms']:.1f} ms")
+    print(f"p95 latency: {before['p95_ms']:.1f} -> {after['p95_ms']:.1f} ms")
+    if not args.keep_indices:
+        es.indices.delete(index="covid19_papers_bench_dynamic,covid19_papers_bench_mapped", ignore=[404])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+# benchmark_rss_crawler.py
+# Crawls local stub RSS sites with rss_crawler.py to check that a crawl stays network-bound:
+# every stub host serves one feed of --articles articles, each response delayed by --latency-ms.
+# A cold crawl should take ~(# articles per host / RSS_CRAWL_MAX_REQUESTS_PER_HOST) round trips instead of one round
+# trip per article, and a warm crawl should only see 304s. Reports wall time, articles/sec and peak requests per host.
+# Run e.g. python3 covidsearch_backend/covidsearch_backend/scripts/benchmark_rss_crawler.py --hosts 5 --articles 100
+
+from aiohttp import web
+import argparse
+import asyncio
+import json
+import os
+from rss_crawler import RSS_CRAWL_MAX_REQUESTS_PER_HOST, crawl_rss_feeds
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+STUB_SCRAPE_TAG = "article__chunks"
+STUB_PARAGRAPHS_PER_ARTICLE = 30
+
+
+class StubSite:
+    """
+    One stub host: an RSS feed plus its articles, with ETags and a per-request delay
+    """
+
+    def __init__(self, name: str, num_articles: int, latency: float):
+        self.name = name
+        self.num_articles = num_articles
+        self.latency = latency
+        self.base_url = ""
+        self.num_requests = 0
+        self.num_not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def rss(self) -> str:
+        items = "".join(
+            f"<item><title>{self.name} article {i}</title><link>{self.base_url}/article/{i}</link></item>"
+            for i in range(self.num_articles)
+        )
+        return f'<?xml version="1.0"?><rss version="2.0"><channel><title>{self.name}</title>{items}</channel></rss>'
+
+    def article(self, i: int) -> str:
+        paragraphs = "".join(
+            f"<p>Paragraph {j} of article {i} about coronavirus transmission and vaccines.</p>"
+            for j in range(STUB_PARAGRAPHS_PER_ARTICLE)
+        )
+        return f'<html><body><nav>menu</nav><div class="{STUB_SCRAPE_TAG}">{paragraphs}</div></body></html>'
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.num_requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            etag = f'"{request.path}-v1"'
+            if request.headers.get("If-None-Match") == etag:
+                self.num_not_modified += 1
+                return web.Response(status=304, headers={"ETag": etag})
+            if request.path == "/feed.xml":
+                return web.Response(text=self.rss(), content_type="application/rss+xml", headers={"ETag": etag})
+            return web.Response(
+                text=self.article(int(request.match_info["i"])), content_type="text/html", headers={"ETag": etag}
+            )
+        finally:
+            self.in_flight -= 1
+
+
+async def start_stub_sites(
+    num_hosts: int, num_articles: int, latency: float
+) -> Tuple[List[StubSite], List[web.AppRunner]]:
+    sites, runners = [], []
+    for host in range(num_hosts):
+        site = StubSite(f"stub_{host}", num_articles, latency)
+        app = web.Application()
+        app.router.add_get("/feed.xml", site.handle)
+        app.router.add_get("/article/{i}", site.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        tcp_site = web.TCPSite(runner, "127.0.0.1", 0)
+        await tcp_site.start()
+        # Every stub listens on its own port, i.e. is a separate host to the crawler's per-host semaphores
+        site.base_url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        sites.append(site)
+        runners.append(runner)
+    return sites, runners
+
+
+async def timed_crawl(sites: List[StubSite], work_dir: str) -> Dict[str, Any]:
+    feeds = {site.name: f"{site.base_url}/feed.xml" for site in sites}
+    feeds_scrape_tag = {site.name: STUB_SCRAPE_TAG for site in sites}
+    for site in sites:
+        site.num_requests = site.num_not_modified = site.max_in_flight = 0
+    start = time.perf_counter()
+    stats = await crawl_rss_feeds(
+        feeds,
+        feeds_scrape_tag,
+        os.path.join(work_dir, "feeds"),
+        os.path.join(work_dir, "feed_data.txt"),
+        http_cache_path=os.path.join(work_dir, "http_cache.json"),
+    )
+    seconds = time.perf_counter() - start
+    num_requests = sum(site.num_requests for site in sites)
+    return {
+        "seconds": seconds,
+        "articles_per_second": stats["articles_written"] / seconds,
+        "num_requests": num_requests,
+        "num_not_modified": sum(site.num_not_modified for site in sites),
+        "max_requests_in_flight_per_host": max(site.max_in_flight for site in sites),
+        "crawl_stats": stats,
+    }
+
+
+async def run_benchmark(num_hosts: int, num_articles: int, latency_ms: float) -> Dict[str, Any]:
+    latency = latency_ms / 1000
+    sites, runners = await start_stub_sites(num_hosts, num_articles, latency)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            cold = await timed_crawl(sites, work_dir)
+            warm = await timed_crawl(sites, work_dir)
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+    return {
+        "num_hosts": num_hosts,
+        "num_articles": num_hosts * num_articles,
+        "latency_ms": latency_ms,
+        "serial_seconds_estimate": cold["num_requests"] * latency,
+        "network_bound_seconds_estimate": (1 + num_articles / RSS_CRAWL_MAX_REQUESTS_PER_HOST) * latency,
+        "cold": cold,
+        "warm": warm,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RSS crawler against local stub sites")
+    parser.add_argument("--hosts", type=int, default=5)
+    parser.add_argument("--articles", type=int, default=100, help="# articles per host")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Delay of every stub response")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_benchmark(args.hosts, args.articles, args.latency_ms)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
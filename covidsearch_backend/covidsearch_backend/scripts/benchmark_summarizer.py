@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+# benchmark_summarizer.py
+# Speed/quality trade-off of the summarizer's inference profiles (article_summarizer.SUMMARIZER_PROFILES) on a fixed
+# set of saved articles:
+# * latency: each article summarized alone, as the summarizer used to run (p50/p95/p99)
+# * throughput: all articles summarized in length-sorted batches (articles/sec)
+# * ROUGE drift: ROUGE-1/2/L F1 of the profile's summaries against the full-precision baseline's
+# Baseline summaries are saved to --reference, so later runs only benchmark the faster profiles.
+# Run from the dir the articles were crawled into, e.g. python3 benchmark_summarizer.py --profiles int8_greedy
+
+import argparse
+from article_summarizer import SUMMARIZER_BATCH_SIZE, SUMMARIZER_PROFILES, summarizer_from_profile
+from benchmark_utils import latency_percentiles
+from collections import Counter
+from covid19_rss_feeds import SAVED_ARTICLE_FILES
+import json
+import numpy as np
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+REFERENCE_PROFILE = "baseline"
+REFERENCE_SUMMARIES_FILENAME = "summarizer_reference.json"
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _f1(num_overlap: int, num_candidate: int, num_reference: int) -> float:
+    if not num_overlap:
+        return 0.0
+    precision, recall = num_overlap / num_candidate, num_overlap / num_reference
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_n(candidate: List[str], reference: List[str], n: int) -> float:
+    candidate_ngrams = Counter(tuple(candidate[i : i + n]) for i in range(len(candidate) - n + 1))
+    reference_ngrams = Counter(tuple(reference[i : i + n]) for i in range(len(reference) - n + 1))
+    num_overlap = sum((candidate_ngrams & reference_ngrams).values())
+    return _f1(num_overlap, sum(candidate_ngrams.values()), sum(reference_ngrams.values()))
+
+
+def rouge_l(candidate: List[str], reference: List[str]) -> float:
+    # Length of the longest common subsequence, one DP row at a time
+    previous_row = [0] * (len(reference) + 1)
+    for candidate_token in candidate:
+        row = [0]
+        for j, reference_token in enumerate(reference):
+            row.append(previous_row[j] + 1 if candidate_token == reference_token else max(previous_row[j + 1], row[j]))
+        previous_row = row
+    return _f1(previous_row[-1], len(candidate), len(reference))
+
+
+def rouge_scores(candidates: List[str], references: List[str]) -> Dict[str, float]:
+    scores = {"rouge1_f1": [], "rouge2_f1": [], "rougeL_f1": []}
+    for candidate, reference in zip(candidates, references):
+        candidate_tokens, reference_tokens = _tokens(candidate), _tokens(reference)
+        scores["rouge1_f1"].append(rouge_n(candidate_tokens, reference_tokens, 1))
+        scores["rouge2_f1"].append(rouge_n(candidate_tokens, reference_tokens, 2))
+        scores["rougeL_f1"].append(rouge_l(candidate_tokens, reference_tokens))
+    return {name: float(np.mean(values)) for name, values in scores.items()}
+
+
+def benchmark_profile(
+    profile: str, articles: List[str], batch_size: int, num_threads: Optional[int]
+) -> Dict[str, Any]:
+    summarizer = summarizer_from_profile(profile, batch_size=batch_size, num_threads=num_threads)
+    warmup_start = time.perf_counter()
+    summarizer.summarize(articles[:1])  # Loads (and quantizes) the model
+    warmup_seconds = time.perf_counter() - warmup_start
+
+    single_summaries, latencies = [], []
+    for article in articles:
+        start = time.perf_counter()
+        single_summaries.extend(summarizer.summarize([article]))
+        latencies.append(time.perf_counter() - start)
+    batch_start = time.perf_counter()
+    summarizer.summarize(articles)
+    batch_seconds = time.perf_counter() - batch_start
+    return {
+        "summaries": single_summaries,
+        "warmup_seconds": warmup_seconds,
+        **latency_percentiles(latencies),
+        "batched_articles_per_second": len(articles) / batch_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latency, throughput and ROUGE drift of summarizer profiles")
+    parser.add_argument("articles", nargs="*", help="Article text files (default: SAVED_ARTICLE_FILES)")
+    parser.add_argument("--profiles", nargs="+", choices=list(SUMMARIZER_PROFILES), default=list(SUMMARIZER_PROFILES))
+    parser.add_argument("--reference", default=REFERENCE_SUMMARIES_FILENAME, help="Saved baseline summaries")
+    parser.add_argument("--batch-size", type=int, default=SUMMARIZER_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    article_filenames = list(dict.fromkeys(args.articles or SAVED_ARTICLE_FILES))
+    articles = []
+    for article_filename in article_filenames:
+        with open(article_filename, "r") as article_file:
+            articles.append(article_file.read())
+
+    reference_summaries = {}
+    if os.path.exists(args.reference):
+        with open(args.reference) as reference_file:
+            reference_summaries = json.load(reference_file)
+    profiles = list(args.profiles)
+    if any(article_filename not in reference_summaries for article_filename in article_filenames):
+        # The reference has to be computed first; the rest is compared against it
+        profiles = [REFERENCE_PROFILE] + [profile for profile in profiles if profile != REFERENCE_PROFILE]
+
+    results = {}
+    for profile in profiles:
+        print(f"Benchmarking summarizer profile {profile}: {SUMMARIZER_PROFILES[profile]}")
+        profile_results = benchmark_profile(profile, articles, args.batch_size, args.threads)
+        summaries = profile_results.pop("summaries")
+        if profile == REFERENCE_PROFILE:
+            reference_summaries.update(zip(article_filenames, summaries))
+            with open(args.reference, "w") as reference_file:
+                json.dump(reference_summaries, reference_file, indent=2)
+        references = [reference_summaries[article_filename] for article_filename in article_filenames]
+        results[profile] = {**profile_results, **rouge_scores(summaries, references)}
+    print(json.dumps({"num_articles": len(articles), "profiles": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+
+# benchmark_utils.py
+# Helpers shared by the benchmark_*.py scripts.
+
+import numpy as np
+from typing import Dict, List
+
+
+def latency_percentiles(latencies: List[float]) -> Dict[str, float]:
+    """
+    p50/p95/p99 in milliseconds of latencies in seconds
+    """
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+# benchmark_vector_index.py
+# Recall and latency of the ANN index (vector_index.py) against exact brute-force NumPy search, for float32 and int8
+# indices over a sweep of nprobe. Queries are "more like this paper" lookups of randomly sampled papers.
+# Run from cord_19_dataset/ after a build, e.g.
+# python3 ../covidsearch_backend/covidsearch_backend/scripts/benchmark_vector_index.py
+
+import argparse
+from benchmark_utils import latency_percentiles
+import json
+import numpy as np
+import os
+from paper_embeddings import load_paper_embeddings
+import tempfile
+import time
+from typing import Any, Dict
+from vector_index import ANN_DIR, ANN_FILENAMES, VectorIndex, build_vector_index, exact_search
+
+MODELS_DIR = "../covidsearch_backend/covidsearch_backend/models/"
+NPROBES = [1, 4, 8, 16, 32, 64]
+
+
+def benchmark_exact(embeddings: np.ndarray, query_rows: np.ndarray, k: int) -> Dict[str, Any]:
+    ground_truth, latencies = {}, []
+    for row in query_rows:
+        start = time.perf_counter()
+        top = exact_search(embeddings, embeddings[row], k + 1)
+        latencies.append(time.perf_counter() - start)
+        ground_truth[row] = [neighbor for neighbor in top if neighbor != row][:k]
+    return {"ground_truth": ground_truth, **latency_percentiles(latencies)}
+
+
+def benchmark_ann(
+    ids: np.ndarray, embeddings: np.ndarray, query_rows: np.ndarray, ground_truth: Dict, k: int, quantize: bool
+) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_dir = os.path.join(tmp_dir, ANN_DIR)
+        build_start = time.time()
+        build_vector_index(ids, embeddings, index_dir, quantize=quantize)
+        build_seconds = time.time() - build_start
+        index_bytes = sum(os.path.getsize(os.path.join(index_dir, filename)) for filename in ANN_FILENAMES.values())
+        vector_index = VectorIndex(index_dir)
+        results = {"build_seconds": build_seconds, "index_bytes": index_bytes, "nprobe": {}}
+        for nprobe in NPROBES:
+            recalls, latencies = [], []
+            for row in query_rows:
+                start = time.perf_counter()
+                neighbors = vector_index.similar(str(ids[row]), k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - start)
+                expected = {str(ids[neighbor]) for neighbor in ground_truth[row]}
+                recalls.append(len(expected & {cord_uid for cord_uid, _ in neighbors}) / len(expected))
+            results["nprobe"][nprobe] = {f"recall@{k}": float(np.mean(recalls)), **latency_percentiles(latencies)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ANN index against exact brute-force search")
+    parser.add_argument("--embeddings-dir", default=MODELS_DIR)
+    parser.add_argument("--num-queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    ids, embeddings = load_paper_embeddings(args.embeddings_dir, mmap=False)
+    query_rows = np.random.default_rng(0).choice(len(ids), min(args.num_queries, len(ids)), replace=False)
+    exact = benchmark_exact(embeddings, query_rows, args.k)
+    ground_truth = exact.pop("ground_truth")
+    results = {
+        "num_vectors": len(ids),
+        "exact": {**exact, "matrix_bytes": embeddings.nbytes},
+        "ivf_float32": benchmark_ann(ids, embeddings, query_rows, ground_truth, args.k, quantize=False),
+        "ivf_int8": benchmark_ann(ids, embeddings, query_rows, ground_truth, args.k, quantize=True),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
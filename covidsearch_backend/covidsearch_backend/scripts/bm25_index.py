@@ -0,0 +1,320 @@
+#!/usr/bin/python3
+
+# bm25_index.py
+# Embedded inverted index of the papers' title + abstract, so the search API can rank papers with BM25 without
+# Elasticsearch (when it's down, or in small deployments that don't run it at all).
+# 1. Each Dask partition is tokenized into (term hash, doc, weighted term frequency) postings, sorted by term, and
+#    written to disk as a block. Title terms count BM25_FIELD_WEIGHTS["title"] times, like the title^2 boost of the
+#    lexical query.
+# 2. Blocks are merged one range of term hashes at a time, so only a slice of the postings is ever in memory.
+#    The doc ids of each term's postings are delta-encoded as varints; term frequencies are one byte each.
+# 3. The term dictionary (sorted 64-bit term hashes and offsets into the postings), doc lengths and the stored
+#    result fields are plain arrays, so the search API memory-maps them and scores queries with NumPy.
+
+import dask
+import dask.dataframe as dd
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import shutil
+from collections import Counter
+from datetime import datetime
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from typing import Any, Dict, List, Optional, Tuple
+
+BM25_DIR = "bm25"  # Subdirectory of the models dir
+BM25_META_FILENAME = "bm25_index.json"
+BM25_FILENAMES = {
+    "term_hashes": "bm25_term_hashes.npy",
+    "term_postings": "bm25_term_postings.npy",  # Offset of each term's first posting, plus the total
+    "term_bytes": "bm25_term_bytes.npy",  # Offset of each term's first encoded doc gap, plus the total
+    "doc_gaps": "bm25_doc_gaps.bin",
+    "term_frequencies": "bm25_term_frequencies.bin",
+    "doc_lengths": "bm25_doc_lengths.npy",
+    "doc_offsets": "bm25_doc_offsets.npy",
+    "docs": "bm25_docs.bin",  # UTF-8 JSON of each paper's result fields
+}
+BM25_DOC_FIELDS = ["cord_uid", "title", "authors", "abstract", "url", "publish_time", "journal"]
+BM25_FIELD_WEIGHTS = {"title": 2, "abstract": 1}
+BM25_K1 = 1.2  # Lucene's (and so ES's) defaults
+BM25_B = 0.75
+MAX_TERM_FREQUENCY = 255  # Stored in one byte; BM25 saturates long before that
+NUM_MERGE_RANGES = 16
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def analyze(text: str) -> List[str]:
+    """
+    Lowercased word tokens without English stop words; used for papers and queries alike
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in ENGLISH_STOP_WORDS]
+
+
+def term_hash(term: str) -> int:
+    # 64 bits, so collisions are negligible for CORD-19's vocabulary and the dictionary needs no term strings
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def encode_varint_sizes(values: np.ndarray) -> np.ndarray:
+    """
+    Number of bytes encode_varints takes for each value
+    """
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        num_bytes += values >= (1 << shift)
+    return num_bytes
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """
+    LEB128 varints of non-negative values below 2^35: 7 bits per byte, high bit set on all but the last byte
+    """
+    values = values.astype(np.uint64)
+    num_bytes = encode_varint_sizes(values)
+    starts = np.cumsum(num_bytes) - num_bytes
+    encoded = np.empty(int(num_bytes.sum()), dtype=np.uint8)
+    for byte in range(int(num_bytes.max(initial=0))):
+        has_byte = num_bytes > byte
+        low_bits = (values[has_byte] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        continuation = (num_bytes[has_byte] > byte + 1).astype(np.uint8) << 7
+        encoded[starts[has_byte] + byte] = low_bits.astype(np.uint8) | continuation
+    return encoded
+
+
+def decode_varints(encoded: np.ndarray) -> np.ndarray:
+    encoded = np.asarray(encoded)
+    ends = np.flatnonzero(encoded < 0x80)
+    if not len(ends):
+        return np.zeros(0, dtype=np.int64)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = 7 * (np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((encoded & 0x7F).astype(np.int64) << shifts, starts)
+
+
+def _block_path(blocks_dir: str, partition: int, name: str) -> str:
+    return os.path.join(blocks_dir, f"block_{partition:05d}_{name}.npy")
+
+
+def _write_partition_block(df: pd.DataFrame, blocks_dir: str, partition: int) -> int:
+    """
+    Write the partition's postings sorted by (term hash, doc), its doc lengths and its result fields
+    """
+    term_hashes, docs, term_frequencies = [], [], []
+    doc_lengths = np.zeros(len(df), dtype=np.float32)
+    for doc, (title, abstract) in enumerate(zip(df.title.fillna(""), df.abstract.fillna(""))):
+        weighted_counts: Counter = Counter()
+        for field, text in [("title", title), ("abstract", abstract)]:
+            tokens = analyze(text)
+            doc_lengths[doc] += BM25_FIELD_WEIGHTS[field] * len(tokens)
+            for token, count in Counter(tokens).items():
+                weighted_counts[token] += BM25_FIELD_WEIGHTS[field] * count
+        for token, count in weighted_counts.items():
+            term_hashes.append(term_hash(token))
+            docs.append(doc)
+            term_frequencies.append(min(count, MAX_TERM_FREQUENCY))
+    term_hashes = np.array(term_hashes, dtype=np.uint64)
+    docs = np.array(docs, dtype=np.int64)
+    order = np.lexsort((docs, term_hashes))
+    np.save(_block_path(blocks_dir, partition, "term_hashes"), term_hashes[order])
+    np.save(_block_path(blocks_dir, partition, "docs"), docs[order])
+    np.save(_block_path(blocks_dir, partition, "term_frequencies"), np.array(term_frequencies, dtype=np.uint8)[order])
+    np.save(_block_path(blocks_dir, partition, "doc_lengths"), doc_lengths)
+    doc_jsons = [json.dumps(record).encode("utf-8") for record in df[BM25_DOC_FIELDS].fillna("").to_dict("records")]
+    np.save(_block_path(blocks_dir, partition, "doc_sizes"), np.array([len(d) for d in doc_jsons], dtype=np.int64))
+    with open(os.path.join(blocks_dir, f"block_{partition:05d}_docs.bin"), "wb") as docs_file:
+        docs_file.write(b"".join(doc_jsons))
+    return len(df)
+
+
+def _merge_postings(blocks_dir: str, doc_offsets: List[int], output_dir: str) -> int:
+    """
+    Merge the blocks' postings into one term dictionary and postings file, one range of term hashes at a time.
+    Blocks hold consecutive docs, so concatenating a term's postings block by block keeps its docs ascending.
+    """
+    blocks = [
+        {
+            name: np.load(_block_path(blocks_dir, i, name), mmap_mode="r")
+            for name in ("term_hashes", "docs", "term_frequencies")
+        }
+        for i in range(len(doc_offsets))
+    ]
+    range_bounds = [(2 ** 64 * i) // NUM_MERGE_RANGES for i in range(NUM_MERGE_RANGES)] + [2 ** 64]
+    term_hashes, term_postings, term_bytes = [], [np.zeros(1, dtype=np.int64)], [np.zeros(1, dtype=np.int64)]
+    num_postings, num_bytes = 0, 0
+    with open(os.path.join(output_dir, BM25_FILENAMES["doc_gaps"]), "wb") as gaps_file, open(
+        os.path.join(output_dir, BM25_FILENAMES["term_frequencies"]), "wb"
+    ) as frequencies_file:
+        for low, high in zip(range_bounds[:-1], range_bounds[1:]):
+            range_hashes, range_docs, range_frequencies = [], [], []
+            for block, doc_offset in zip(blocks, doc_offsets):
+                block_hashes = block["term_hashes"]
+                start = np.searchsorted(block_hashes, np.uint64(low))
+                # 2^64 doesn't fit in a uint64
+                end = len(block_hashes) if high == 2 ** 64 else np.searchsorted(block_hashes, np.uint64(high))
+                range_hashes.append(np.asarray(block_hashes[start:end]))
+                range_docs.append(np.asarray(block["docs"][start:end]) + doc_offset)
+                range_frequencies.append(np.asarray(block["term_frequencies"][start:end]))
+            hashes = np.concatenate(range_hashes)
+            order = np.argsort(hashes, kind="stable")
+            hashes, docs = hashes[order], np.concatenate(range_docs)[order]
+            frequencies = np.concatenate(range_frequencies)[order]
+            if not len(hashes):
+                continue
+
+            term_starts = np.flatnonzero(np.concatenate([[True], hashes[1:] != hashes[:-1]]))
+            gaps = np.diff(docs, prepend=0)
+            gaps[term_starts] = docs[term_starts]  # Each term's first doc is stored as is
+            encoded_sizes = np.add.reduceat(encode_varint_sizes(gaps), term_starts)
+            gaps_file.write(encode_varints(gaps).tobytes())
+            frequencies_file.write(frequencies.tobytes())
+            term_hashes.append(hashes[term_starts])
+            term_postings.append(num_postings + np.append(term_starts[1:], len(hashes)))
+            term_bytes.append(num_bytes + np.cumsum(encoded_sizes))
+            num_postings += len(hashes)
+            num_bytes += int(encoded_sizes.sum())
+
+    np.save(
+        os.path.join(output_dir, BM25_FILENAMES["term_hashes"]),
+        np.concatenate(term_hashes) if term_hashes else np.zeros(0, dtype=np.uint64),
+    )
+    np.save(os.path.join(output_dir, BM25_FILENAMES["term_postings"]), np.concatenate(term_postings).astype(np.int64))
+    np.save(os.path.join(output_dir, BM25_FILENAMES["term_bytes"]), np.concatenate(term_bytes).astype(np.int64))
+    return num_postings
+
+
+def _merge_docs(blocks_dir: str, num_blocks: int, output_dir: str) -> Tuple[int, float]:
+    doc_lengths = [np.load(_block_path(blocks_dir, i, "doc_lengths")) for i in range(num_blocks)]
+    doc_sizes = [np.load(_block_path(blocks_dir, i, "doc_sizes")) for i in range(num_blocks)]
+    all_doc_lengths = np.concatenate(doc_lengths) if doc_lengths else np.zeros(0, dtype=np.float32)
+    np.save(os.path.join(output_dir, BM25_FILENAMES["doc_lengths"]), all_doc_lengths)
+    all_doc_sizes = np.concatenate(doc_sizes) if doc_sizes else np.zeros(0, dtype=np.int64)
+    np.save(os.path.join(output_dir, BM25_FILENAMES["doc_offsets"]), np.concatenate([[0], np.cumsum(all_doc_sizes)]))
+    with open(os.path.join(output_dir, BM25_FILENAMES["docs"]), "wb") as docs_file:
+        for i in range(num_blocks):
+            with open(os.path.join(blocks_dir, f"block_{i:05d}_docs.bin"), "rb") as block_docs_file:
+                shutil.copyfileobj(block_docs_file, docs_file)
+    return len(all_doc_lengths), float(all_doc_lengths.mean()) if len(all_doc_lengths) else 0.0
+
+
+def build_bm25_index(papers_dd: dd, output_dir: str, scheduler: str = "processes") -> Dict[str, Any]:
+    """
+    Index every paper of papers_dd (BM25_DOC_FIELDS) and save the index to output_dir.
+    The new index is written next to the old one and swapped in once complete.
+    """
+    next_output_dir = f"{output_dir.rstrip('/')}_next/"
+    blocks_dir = os.path.join(next_output_dir, "blocks")
+    shutil.rmtree(next_output_dir, ignore_errors=True)
+    os.makedirs(blocks_dir)
+    block_tasks = [
+        dask.delayed(_write_partition_block)(partition, blocks_dir, i)
+        for i, partition in enumerate(papers_dd[BM25_DOC_FIELDS].to_delayed())
+    ]
+    block_sizes = dask.compute(*block_tasks, scheduler=scheduler)
+    doc_offsets = np.concatenate([[0], np.cumsum(block_sizes, dtype=np.int64)])[:-1].tolist()
+    num_postings = _merge_postings(blocks_dir, doc_offsets, next_output_dir)
+    num_docs, average_doc_length = _merge_docs(blocks_dir, len(block_sizes), next_output_dir)
+    shutil.rmtree(blocks_dir)
+    meta = {
+        "built_at": datetime.utcnow().strftime("%Y%m%d%H%M%S%f"),
+        "num_docs": num_docs,
+        "num_postings": num_postings,
+        "average_doc_length": average_doc_length,
+        "field_weights": BM25_FIELD_WEIGHTS,
+    }
+    with open(os.path.join(next_output_dir, BM25_META_FILENAME), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(next_output_dir, output_dir)
+    print(f"Built BM25 index in {output_dir}: {meta}")
+    return meta
+
+
+def _map_bytes(path: str) -> np.ndarray:
+    # np.memmap can't map an empty file
+    return np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, dtype=np.uint8)
+
+
+class Bm25Index:
+    """
+    Read-only, memory-mapped BM25 index of the papers' title + abstract
+    """
+
+    def __init__(self, index_dir: str, k1: float = BM25_K1, b: float = BM25_B):
+        with open(os.path.join(index_dir, BM25_META_FILENAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        self.k1 = k1
+        self.b = b
+        arrays = {
+            name: np.load(os.path.join(index_dir, filename), mmap_mode="r")
+            for name, filename in BM25_FILENAMES.items()
+            if filename.endswith(".npy")
+        }
+        self.term_hashes = arrays["term_hashes"]
+        self.term_postings = arrays["term_postings"]
+        self.term_bytes = arrays["term_bytes"]
+        self.doc_lengths = arrays["doc_lengths"]
+        self.doc_offsets = arrays["doc_offsets"]
+        self.doc_gaps = _map_bytes(os.path.join(index_dir, BM25_FILENAMES["doc_gaps"]))
+        self.term_frequencies = _map_bytes(os.path.join(index_dir, BM25_FILENAMES["term_frequencies"]))
+        self.docs = _map_bytes(os.path.join(index_dir, BM25_FILENAMES["docs"]))
+
+    def __len__(self) -> int:
+        return self.meta["num_docs"]
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (docs, term frequencies) of the term, or None if no paper has it
+        """
+        hashed = np.uint64(term_hash(term))
+        position = int(np.searchsorted(self.term_hashes, hashed))
+        if position == len(self.term_hashes) or self.term_hashes[position] != hashed:
+            return None
+        gaps = decode_varints(self.doc_gaps[self.term_bytes[position] : self.term_bytes[position + 1]])
+        start, end = self.term_postings[position], self.term_postings[position + 1]
+        return np.cumsum(gaps), np.asarray(self.term_frequencies[start:end], dtype=np.float32)
+
+    def search(self, query: str, k: int, match_all_terms: bool = True) -> Tuple[int, List[Tuple[int, float]]]:
+        """
+        Number of matching papers and the top k (doc, BM25 score), ties broken by doc.
+        With match_all_terms, papers must contain every query term (like the lexical query's AND operator).
+        """
+        query_terms = Counter(analyze(query))
+        matched_docs, scores = [], []
+        for term, query_frequency in query_terms.items():
+            postings = self.postings(term)
+            if postings is None:
+                if match_all_terms:
+                    return 0, []
+                continue
+            docs, term_frequencies = postings
+            idf = np.log(1 + (len(self) - len(docs) + 0.5) / (len(docs) + 0.5))
+            length_norms = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.meta["average_doc_length"])
+            matched_docs.append(docs)
+            scores.append(query_frequency * idf * term_frequencies * (self.k1 + 1) / (term_frequencies + length_norms))
+        if not matched_docs:
+            return 0, []
+
+        docs, term_positions = np.unique(np.concatenate(matched_docs), return_inverse=True)
+        doc_scores = np.bincount(term_positions, weights=np.concatenate(scores))
+        if match_all_terms:
+            has_all_terms = np.bincount(term_positions) == len(query_terms)
+            docs, doc_scores = docs[has_all_terms], doc_scores[has_all_terms]
+        if len(docs) > k:
+            # Keep every doc tied with the k-th score, so the tiebreak below is deterministic
+            kth_score = np.partition(doc_scores, len(docs) - k)[len(docs) - k]
+            candidates = doc_scores >= kth_score
+            docs, doc_scores, total = docs[candidates], doc_scores[candidates], len(docs)
+        else:
+            total = len(docs)
+        order = np.lexsort((docs, -doc_scores))[:k]
+        return total, [(int(doc), float(score)) for doc, score in zip(docs[order], doc_scores[order])]
+
+    def doc(self, doc: int) -> Dict[str, Any]:
+        """
+        Result fields (BM25_DOC_FIELDS) of the paper
+        """
+        return json.loads(bytes(self.docs[self.doc_offsets[doc] : self.doc_offsets[doc + 1]]).decode("utf-8"))
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+# build_profiler.py
+# Per-stage profile of the index build: wall time, peak RSS of the build's process tree (sampled in a background thread,
+# so dask and extraction worker processes are counted), optionally the tracemalloc peak of the main process,
+# docs per second, bytes sent and the dask tasks run by the stage (grouped by task name, so the slowest partition
+# of each step stands out). The report is written as JSON, so builds with different settings can be compared:
+# python3 build_profiler.py build_profile_old.json build_profile_new.json
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import psutil
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional
+
+BUILD_PROFILE_FILENAME = "build_profile.json"
+RSS_SAMPLE_INTERVAL = 0.1  # Seconds
+STAGE_COMPARISON_FIELDS = [  # (field, unit, scale)
+    ("wall_seconds", "s", 1),
+    ("docs_per_second", "docs/s", 1),
+    ("peak_rss_bytes", "MB", 2 ** 20),
+]
+
+
+def _process_tree_rss(process: psutil.Process) -> int:
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass  # Exited between listing and sampling
+    return rss
+
+
+def _summarize_dask_tasks(task_results: List[Any]) -> Dict[str, Dict[str, float]]:
+    from dask.utils import key_split
+
+    tasks: Dict[str, Dict[str, float]] = {}
+    for task in task_results:
+        seconds = task.end_time - task.start_time
+        summary = tasks.setdefault(key_split(task.key), {"num_tasks": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        summary["num_tasks"] += 1
+        summary["total_seconds"] += seconds
+        summary["max_seconds"] = max(summary["max_seconds"], seconds)
+    return dict(sorted(tasks.items(), key=lambda name_summary: -name_summary[1]["total_seconds"]))
+
+
+class BuildProfiler:
+    """
+    Records the stages of a build. Wall time and doc counts are always recorded (and printed);
+    with enabled=True, memory is sampled, dask tasks are profiled and the report can be written as JSON.
+    """
+
+    def __init__(self, enabled: bool = False, trace_malloc: bool = False, config: Optional[Dict[str, Any]] = None):
+        self.enabled = enabled
+        self.trace_malloc = enabled and trace_malloc
+        self.config = config or {}
+        self.started_at = datetime.utcnow().isoformat()
+        self.stages: List[Dict[str, Any]] = []
+        self._peak_rss = 0
+        self._stage_peak_rss = 0
+        self._lock = threading.Lock()
+        self._stop_sampling = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        if self.enabled:
+            self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+            self._sampler.start()
+        if self.trace_malloc:
+            tracemalloc.start()
+
+    def _sample_rss(self) -> None:
+        process = psutil.Process(os.getpid())
+        while not self._stop_sampling.is_set():
+            rss = _process_tree_rss(process)
+            with self._lock:
+                self._peak_rss = max(self._peak_rss, rss)
+                self._stage_peak_rss = max(self._stage_peak_rss, rss)
+            self._stop_sampling.wait(RSS_SAMPLE_INTERVAL)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """
+        Profile the block as stage name. The block can add num_docs, bytes_sent or other fields to the yielded record.
+        """
+        record: Dict[str, Any] = {"stage": name}
+        if not self.enabled:
+            start = time.perf_counter()
+            yield record
+            record["wall_seconds"] = time.perf_counter() - start
+            self._finish_stage(record)
+            return
+
+        from dask.diagnostics import Profiler
+
+        with self._lock:
+            self._stage_peak_rss = _process_tree_rss(psutil.Process(os.getpid()))
+        record["rss_start_bytes"] = self._stage_peak_rss
+        if self.trace_malloc:
+            tracemalloc.clear_traces()  # Also resets the peak, so it only counts what the stage allocates
+        start = time.perf_counter()
+        with Profiler() as dask_profiler:
+            yield record
+        record["wall_seconds"] = time.perf_counter() - start
+        with self._lock:
+            record["peak_rss_bytes"] = self._stage_peak_rss
+        if self.trace_malloc:
+            record["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        if dask_profiler.results:
+            record["dask_tasks"] = _summarize_dask_tasks(dask_profiler.results)
+        self._finish_stage(record)
+
+    def _finish_stage(self, record: Dict[str, Any]) -> None:
+        if record.get("num_docs") is not None and record["wall_seconds"] > 0:
+            record["docs_per_second"] = record["num_docs"] / record["wall_seconds"]
+        self.stages.append(record)
+        summary = f"Stage {record['stage']}: {record['wall_seconds']:.1f}s"
+        if "docs_per_second" in record:
+            summary += f", {record['num_docs']} docs ({record['docs_per_second']:.0f} docs/s)"
+        if "peak_rss_bytes" in record:
+            summary += f", peak RSS {record['peak_rss_bytes'] / 2 ** 20:.0f}MB"
+        print(summary)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "config": self.config,
+            "total_wall_seconds": sum(stage["wall_seconds"] for stage in self.stages),
+            "peak_rss_bytes": self._peak_rss if self.enabled else None,
+            "stages": self.stages,
+        }
+
+    def write_report(self, report_filename: str = BUILD_PROFILE_FILENAME) -> None:
+        with open(report_filename, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        print(f"Wrote build profile to {report_filename}")
+
+    def close(self) -> None:
+        self._stop_sampling.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self.trace_malloc:
+            tracemalloc.stop()
+
+
+def compare_reports(reports: List[Dict[str, Any]]) -> List[List[str]]:
+    """
+    Rows of wall time, docs/sec and peak RSS per stage, one column per report
+    """
+    stage_names = list(dict.fromkeys(stage["stage"] for report in reports for stage in report["stages"]))
+    rows = []
+    for stage_name in stage_names:
+        for field, unit, scale in STAGE_COMPARISON_FIELDS:
+            cells = []
+            for report in reports:
+                value = next((stage.get(field) for stage in report["stages"] if stage["stage"] == stage_name), None)
+                cells.append("-" if value is None else f"{value / scale:.1f}")
+            if any(cell != "-" for cell in cells):
+                rows.append([f"{stage_name} ({unit})", *cells])
+    rows.append(["total (s)", *[f"{report['total_wall_seconds']:.1f}" for report in reports]])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare build profiles written by build_research_paper_index.py")
+    parser.add_argument("reports", nargs="+", help="Build profile JSON files, oldest first")
+    args = parser.parse_args()
+    reports = []
+    for report_filename in args.reports:
+        with open(report_filename) as report_file:
+            reports.append(json.load(report_file))
+
+    for report_filename, report in zip(args.reports, reports):
+        print(f"{report_filename}: started at {report['started_at']}, config {report['config']}")
+    rows = [["", *[os.path.basename(report_filename) for report_filename in args.reports]], *compare_reports(reports)]
+    widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    main()
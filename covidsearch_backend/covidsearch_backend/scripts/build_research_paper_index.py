@@ -2,67 +2,113 @@
 
 # build_research_paper_index.pyi
 
+import argparse
+from bm25_index import BM25_DIR, BM25_DOC_FIELDS, build_bm25_index
+from build_profiler import BUILD_PROFILE_FILENAME, BuildProfiler
+from bulk_indexer import (
+    BULK_MAX_CHUNK_BYTES,
+    BULK_MAX_CHUNK_DOCS,
+    NUM_BULK_WORKERS,
+    BulkIndexingReport,
+    bulk_delete_docs,
+    bulk_index_parquet_files,
+)
 import dask.dataframe as dd
 from dask.distributed import Client
 from datetime import datetime
-from elasticsearch import Elasticsearch, RequestError, TransportError
-import json
+from elasticsearch import Elasticsearch
+from extract_body_text import (
+    NUM_BODY_TEXT_CACHE_BUCKETS,
+    NUM_EXTRACTION_PROCESSES,
+    attach_body_text,
+    body_text_cache_bucket,
+    choose_body_paths,
+    load_bib_titles,
+    split_pdf_json_files,
+    update_body_text_cache,
+)
+import glob
+from index_generations import (
+    create_generation_index,
+    current_generation_index,
+    delete_old_generations,
+    finalize_generation_index,
+    index_meta,
+    new_generation_index_name,
+    swap_alias,
+)
+from index_mappings import INDEX_MAPPING_VERSION, covid19_papers_index_body
+from index_manifest import (
+    MANIFEST_COLS,
+    clear_build_checkpoint,
+    empty_manifest,
+    load_build_checkpoint,
+    load_manifest,
+    save_build_checkpoint,
+    save_manifest,
+)
 import multiprocessing
 import numpy as np
 import os
 import pandas as pd
-import pickle
-from retrying import retry
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-from sklearn.feature_extraction.text import TfidfVectorizer
-import time
-from typing import List
-
-COVID19_PAPERS_INDEX = "covid19_papers"
-MAX_NUM_RETRIES = 3
+from paper_embeddings import build_paper_embeddings, find_cord19_embeddings_csv, load_paper_embeddings
+from paper_quality import PAPER_QUALITY_DIR, build_paper_quality, load_citation_signals, paper_completeness
+import shutil
+from spelling_index import SPELLING_DIR, build_spelling_index
+from suggest_index import SUGGEST_DIR, build_suggest_index
+from tfidf_vectors import TFIDF_DIR, build_tfidf_vectors
+from typing import Any, Callable, Dict, List, Optional, Set
+from vector_index import ANN_DIR, build_vector_index
+
+BULK_FAILURES_FILENAME = "bulk_failures.jsonl"
+BULK_REQUEST_TIMEOUT = 120  # Seconds
+COVID19_PAPERS_INDEX = "covid19_papers"  # Alias of the live index generation
 NUM_CPU_CORES = multiprocessing.cpu_count()
 NUM_DF_PARTITIONS = 30
+PARQUET_PARTITION_SIZE = "100MB"  # In-memory size of each partition written to Parquet
 RESEARCH_PAPER_DATA_DIR = "research_papers"
-UPLOAD_CHUNK_SIZE = 1000
-DEEP_EMBEDDINGS_MAP = {
-    "cord19": "<insert_filepath_here>",  # 768-length vector
-    "distilbert": "<insert_filepath_here>",  # 256-length vector
-    "bert": "<insert_filepath_here>",  # 768-length vector (1024 for large)
-}
-
-
-def retrieve_paper_body_text(pdf_json_files: str) -> str:
-    if pdf_json_files and type(pdf_json_files) is str:
-        for json_path in pdf_json_files.split("; "):
-            paper_body_text = []
-            abs_json_path = os.path.join(os.getcwd(), json_path)
-
-            try:
-                with open(abs_json_path) as paper_json:
-                    full_text_dict = json.load(paper_json)
-
-                    for paragraph_dict in full_text_dict["body_text"]:
-                        paragraph_text = paragraph_dict["text"]
-                        section_name = paragraph_dict["section"]
-                        if section_name.lower() != "abstract":
-                            paper_body_text.append(paragraph_text)
-
-                if paper_body_text:  # Stop searching through pdf_json_files
-                    return "\n".join(paper_body_text)
-            except FileNotFoundError as e:
-                print(f"Failed on {abs_json_path} with exception: {str(e)}")
-
-    return ""
-
-
-def retrieve_paper_body_text_for_series(pdf_json_files_series: pd.Series) -> pd.Series:
-    return pdf_json_files_series.apply(lambda pdf_json_files: retrieve_paper_body_text(pdf_json_files))
-
-
-def gather_papers_data(metadata_dd: dd) -> dd:
-    return metadata_dd.map_partitions(
-        lambda df: df.assign(body=retrieve_paper_body_text_for_series(df.pdf_json_files))
+PAPERS_PARQUET_DIR = "research_paper_bodies/"  # Every indexed paper, with body
+PAPERS_DELTA_PARQUET_DIR = "research_paper_bodies_delta/"  # New or changed papers of the current build
+METADATA_COLS = [
+    "cord_uid",
+    "title",
+    "authors",
+    "abstract",
+    "publish_time",
+    "url",
+    "journal",
+    "pdf_json_files",
+]
+MODELS_DIR = "../covidsearch_backend/covidsearch_backend/models/"  # Artifacts loaded by the search API
+ANN_QUANTIZE_INT8 = True  # 4x smaller ANN index for a negligible loss of recall (see benchmark_vector_index.py)
+
+
+def list_pdf_json_paths(metadata_dd: dd) -> Set[str]:
+    return {
+        json_path
+        for pdf_json_files in metadata_dd.pdf_json_files.compute()
+        for json_path in split_pdf_json_files(pdf_json_files)
+    }
+
+
+def gather_papers_data(metadata_dd: dd, profiler: BuildProfiler) -> dd:
+    """
+    Attach the body text of each paper, parsing only PDF parses that aren't in the body text cache yet
+    """
+    with profiler.stage("body_extraction") as stage:
+        json_paths = list_pdf_json_paths(metadata_dd)
+        cache_index_df = update_body_text_cache(json_paths)
+        stage["num_docs"] = len(json_paths)
+    num_chars_by_path = dict(zip(cache_index_df.path, cache_index_df.num_chars))
+    metadata_dd = metadata_dd.map_partitions(
+        lambda df: df.assign(body_path=choose_body_paths(df.pdf_json_files, num_chars_by_path))
+    )
+    # One partition per cache bucket, so every bucket's bodies are read from disk once
+    metadata_dd = metadata_dd.map_partitions(
+        lambda df: df.assign(body_bucket=df.body_path.map(body_text_cache_bucket).astype("int64"))
     )
+    metadata_dd = metadata_dd.set_index("body_bucket", divisions=list(range(NUM_BODY_TEXT_CACHE_BUCKETS + 1)))
+    return metadata_dd.reset_index(drop=True).map_partitions(attach_body_text)
 
 
 def remove_papers_with_null_cols(dask_df: dd, cols: List[str]) -> None:
@@ -73,135 +119,362 @@ def fill_in_missing_data(dask_df: dd) -> None:
     return dask_df.fillna("")
 
 
-def generate_embeddings(embedding_type: str, embedding_model_filename: str, docs: pd.Series) -> pd.Series:
-    if embedding_type == "tfidf":
-        tfidf_vectorizer = TfidfVectorizer()
-        doc_embeddings = tfidf_vectorizer.fit_transform(docs)
-        with open(embedding_model_filename, "wb") as ef:
-            pickle.dump(tfidf_vectorizer, ef)
-        print(f"Title embeddings shape: {doc_embeddings.toarray()}")
-    else:
+def _pdf_json_files_stat(pdf_json_files: str) -> str:
+    """
+    Cheap fingerprint of a paper's PDF parses (size and mtime) so content hashes change when a parse is updated
+    """
+    file_stats = []
+    for json_path in split_pdf_json_files(pdf_json_files):
         try:
-            # TODO: Correctly load and generate embeddings using CORD19 embeddings and HuggingFace transformers lib
-            embeddings = DEEP_EMBEDDINGS_MAP[embedding_type]
-        except KeyError:
-            raise KeyError(
-                f"Embedding type {embedding_type} nonexistent in embedding map: {DEEP_EMBEDDINGS_MAP}. Make sure the embedding type exists as a key in the embedding map."
-            )
+            json_stat = os.stat(json_path)
+            file_stats.append(f"{json_stat.st_size}:{json_stat.st_mtime_ns}")
+        except FileNotFoundError:
+            file_stats.append("missing")
+    return ";".join(file_stats)
 
-    return doc_embeddings
-
-
-def preprocess_papers(metadata_filename) -> pd.DataFrame:
-    # Get metadata of research papers
-    metadata_cols = [
-        "cord_uid",
-        "title",
-        "authors",
-        "abstract",
-        "publish_time",
-        "url",
-        "journal",
-        "pdf_json_files",
-    ]
-    metadata_cols_dtypes = {col: str for col in metadata_cols}
-    metadata_dd = dd.read_csv(metadata_filename, dtype=metadata_cols_dtypes, usecols=metadata_cols)
-    print(f"Memory usage of metadata_df before clean: {metadata_dd.memory_usage(deep=True).sum()}")
+
+def compute_content_hashes(df: pd.DataFrame) -> pd.Series:
+    pdf_json_stats = df.pdf_json_files.map(_pdf_json_files_stat)
+    content_hashes = pd.util.hash_pandas_object(df[METADATA_COLS].assign(pdf_json_stats=pdf_json_stats), index=False)
+    return content_hashes.map("{:016x}".format)
+
+
+def load_paper_metadata(metadata_filename: str) -> dd:
+    """
+    Read and clean metadata of research papers, keeping one row per cord_uid along with its content hash
+    """
+    metadata_cols_dtypes = {col: str for col in METADATA_COLS}
+    metadata_dd = dd.read_csv(metadata_filename, dtype=metadata_cols_dtypes, usecols=METADATA_COLS)
     # Perform operations in place to reduce memory usage
     metadata_dd = remove_papers_with_null_cols(metadata_dd, ["title"])
     metadata_dd = remove_papers_with_null_cols(metadata_dd, ["abstract", "url"])
     metadata_dd = remove_papers_with_null_cols(metadata_dd, ["authors"])
     metadata_dd = remove_papers_with_null_cols(metadata_dd, ["publish_time"])
     metadata_dd = fill_in_missing_data(metadata_dd)
-    print(f"Memory usage of metadata_df after clean: {metadata_dd.memory_usage(deep=True).sum()}")
+    # cord_uid is the doc id in the index, so duplicate rows would just overwrite each other
+    metadata_dd = metadata_dd.drop_duplicates(subset=["cord_uid"], split_out=metadata_dd.npartitions)
+    metadata_dd = metadata_dd.map_partitions(lambda df: df.assign(content_hash=compute_content_hashes(df)))
     print(f"# partitions in metadata dd: {metadata_dd.npartitions}")
+    return metadata_dd
+
+
+def select_changed_papers(metadata_dd: dd, manifest_df: pd.DataFrame) -> dd:
+    """
+    Keep papers that are new or whose content hash differs from the one recorded in the manifest
+    """
+    indexed_hashes_df = manifest_df.rename(columns={"content_hash": "indexed_content_hash"})
+    # Broadcast join against the (small) in-memory manifest; no shuffle of the metadata needed
+    metadata_dd = metadata_dd.merge(indexed_hashes_df, on="cord_uid", how="left")
+    changed_dd = metadata_dd[metadata_dd.content_hash != metadata_dd.indexed_content_hash]
+    return changed_dd.drop(columns=["indexed_content_hash"])
 
+
+def add_filter_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Boolean fields search_api filters and facets on (missing abstracts and bodies were filled in with "")
+    """
+    return df.assign(has_abstract=df.abstract.str.len() > 0, has_full_text=df.body.str.len() > 0)
+
+
+def preprocess_papers(
+    metadata_dd: dd, output_dir: str, profiler: BuildProfiler, partition_size: str = PARQUET_PARTITION_SIZE
+) -> None:
     # Get body of research papers and store in df
-    # TODO: Rename gather_papers_data and put below embedding computation logic in it
-    metadata_with_body_dd = gather_papers_data(metadata_dd)
-    metadata_with_body_dd = metadata_with_body_dd.repartition(partition_size="100MB")
+    metadata_with_body_dd = gather_papers_data(metadata_dd, profiler).map_partitions(add_filter_fields)
+    # Sizing the partitions computes every partition once (bodies included); its dask tasks show up in the profile
+    with profiler.stage("repartition") as stage:
+        metadata_with_body_dd = metadata_with_body_dd.repartition(partition_size=partition_size)
+        stage["num_partitions"] = metadata_with_body_dd.npartitions
     print(f"# partitions in research papers' metadata dd: {metadata_with_body_dd.npartitions}")
-    dd.to_parquet(
-        metadata_with_body_dd,
-        "research_paper_bodies/",
-        engine="fastparquet",
-        compute_kwargs={"scheduler": "synchronous"},  # synchronous ~2m40s
-    )
+    with profiler.stage("parquet_write") as stage:
+        dd.to_parquet(metadata_with_body_dd, output_dir, engine="fastparquet")
+        stage["bytes_written"] = sum(os.path.getsize(path) for path in list_parquet_files(output_dir))
+
 
-    # Get embeddings of each research paper's title and abstract (embeddings of body text would lose too much info due to current ineffective pooling techniques)
+def publish_index_generation(es: Elasticsearch, es_idx: str) -> str:
     """
-    embedding_type = "tfidf"
-    research_papers_df[f"title_{embedding_type}"] = research_papers_dd.map_partitions(
-        lambda df: generate_embeddings(embedding_type, "../covidsearch_backend/covidsearch_backend/models/tfidf_title_vectorizer.pk", df["title"])
-    ).compute(scheduler="processes")
-    research_papers_df[f"abstract_{embedding_type}"] = research_papers_dd.map_paritions(
-        lambda df: generate_embeddings(embedding_type, "../covidsearch_backend/covidsearch_backend/models/tfidf_abstract_vectorizer.pk", df["abstract"])
-    ).compute(scheduler="processes")
+    Stamp a new generation id into the index's _meta mapping.
+    search_api keys its result cache on this id, so publishing a generation invalidates all cached search results.
     """
+    generation = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    # _meta is replaced as a whole, so carry over the rest of it (e.g. mapping_version)
+    es.indices.put_mapping(index=es_idx, body={"_meta": {**index_meta(es, es_idx), "generation": generation}})
+    print(f"Published generation {generation} of index {es_idx}")
+    return generation
 
 
-def rec_to_actions(df, index):
-    for record in df.to_dict(orient="records"):
-        record_id = record["cord_uid"]
-        yield ('{ "index" : { "_index" : "%s", "_id": "%s" }}' % (index, record_id))
-        yield (json.dumps(record))
+def paper_embeddings_enricher(embeddings_dir: str) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Adds each paper's SPECTER embedding to its doc at upload time, so the Parquet files don't carry 768 floats per row
+    """
+    ids, embeddings = load_paper_embeddings(embeddings_dir)
+    row_by_id = {cord_uid: row for row, cord_uid in enumerate(ids.tolist())}
 
+    def add_embedding(record: Dict[str, Any]) -> Dict[str, Any]:
+        row = row_by_id.get(record["cord_uid"])
+        if row is not None:
+            # 6 decimals is well within float32 precision and keeps bulk requests small
+            record["specter_embedding"] = np.round(embeddings[row].astype(np.float64), 6).tolist()
+        return record
+
+    return add_embedding
 
-# pyre-fixme[56]: Pyre was not able to infer the type of argument
-@retry(stop_max_attempt_number=MAX_NUM_RETRIES)
-def upload_parquet_file_to_es_idx(es: Elasticsearch, es_idx: str, papers_dd: dd, partition_num: int) -> None:
-    try:
-        start = time.time()
-        papers_dd_partition = papers_dd.get_partition(partition_num)
-        papers_df_partition = papers_dd_partition.compute()
-        compute_end = time.time()
-        print(f"Partition #{partition_num} compute time: {compute_end - start}")
-        print(f"Papers partition memory size: {papers_df_partition.memory_usage(deep=True).sum()}")
-        print(f"Number of papers in partition: {papers_df_partition.shape[0]}")
-        r = es.bulk(rec_to_actions(papers_df_partition, es_idx))
-        upload_end = time.time()
-        print(f"Partition #{partition_num} upload time: {upload_end - compute_end}")
-        print(f"Errors in uploading partition #{partition_num}: {r['errors']}\n\n")
-    except TransportError as te:
-        transport_error_413_url = "https://github.com/elastic/elasticsearch/issues/2902"
-        transport_error_429_urls = [
-            "https://stackoverflow.com/questions/61870751/circuit-breaking-exception-parent-data-too-large-data-for-http-request",
-            "https://github.com/elastic/elasticsearch/issues/31197",
-        ]
-        if te.status_code == 413:
-            print(
-                f"Transport error with status code 413. Chunk size is too large, so try reducing chunk size constant or increase http.max_content_length in the yml file. More info here: {transport_error_413_url}"
-            )
-        elif te.status_code == 429:
-            print(
-                f"Transport error with status code 429. Elasticsearch's JVM heap size is too small, so try increasing ES_HEAP_SIZE env var in docker-compose.yml. More info here: {transport_error_429_urls}"
-            )
-        else:
-            # Could be ConnectionTimeout in connecting to index
-            print(f"Error stacktrace: {te.error, te.info}")
-        raise te
+
+def paper_quality_enricher(quality_dir: str) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Adds each paper's rank features (citation PageRank and count, completeness) to its doc at upload time.
+    rank_feature fields only take positive values, so papers nobody cites get no citation fields at all.
+    """
+    citation_signals = load_citation_signals(quality_dir)
+
+    def add_rank_features(record: Dict[str, Any]) -> Dict[str, Any]:
+        signals = citation_signals.get(record["cord_uid"])
+        if signals is not None:
+            record["citation_pagerank"], record["citation_count"] = round(signals[0], 4), signals[1]
+        # Positive for every paper: load_paper_metadata drops papers with neither an abstract nor a url
+        record["completeness"] = paper_completeness(record)
+        return record
+
+    return add_rank_features
+
+
+def list_parquet_files(parquet_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(parquet_dir, "*.parquet")))
 
 
 def upload_parquet_dir_to_es_idx(
-    parquet_dir: str, es_idx: str, es_hosts: List[str], chunk_size: int = UPLOAD_CHUNK_SIZE
-) -> None:
+    es: Elasticsearch,
+    parquet_dir: str,
+    es_idx: str,
+    num_workers: int = NUM_BULK_WORKERS,
+    max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+    skip_files: Optional[Set[str]] = None,
+    on_file_indexed: Optional[Callable[[str], None]] = None,
+    enrich_record: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+) -> BulkIndexingReport:
     """
-    Uploading Pandas DF to Elasticsearch Index: https://stackoverflow.com/questions/49726229/how-to-export-pandas-data-to-elasticsearch
+    Stream every Parquet file of parquet_dir (except skip_files) into the index with num_workers concurrent,
+    byte-bounded bulk requests
     """
-    # TODO: Catch other exceptions in the future: https://elasticsearch-py.readthedocs.io/en/master/exceptions.html
-    try:
-        es = Elasticsearch(hosts=es_hosts)
-        es.indices.create(index=es_idx, ignore=400)
-    except RequestError:
-        print(f"Index {es_idx} already exists; continue uploading papers to {es_idx}")
+    parquet_paths = [path for path in list_parquet_files(parquet_dir) if path not in (skip_files or set())]
+    print(f"Uploading {len(parquet_paths)} Parquet files with {num_workers} bulk workers")
+    report = bulk_index_parquet_files(
+        es,
+        es_idx,
+        parquet_paths,
+        num_workers=num_workers,
+        max_chunk_bytes=max_chunk_bytes,
+        on_file_indexed=on_file_indexed,
+        enrich_record=enrich_record,
+    )
+    print(f"Bulk upload report: {report.as_dict()}")
+    if report.failures:
+        report.write_failures(BULK_FAILURES_FILENAME)
+        print(f"Wrote {len(report.failures)} failed docs to {BULK_FAILURES_FILENAME}")
+    return report
 
-    papers_dd = dd.read_parquet(parquet_dir, engine="fastparquet")
-    for partition_num in range(papers_dd.npartitions):
-        upload_parquet_file_to_es_idx(es, es_idx, papers_dd, partition_num)
+
+def compact_papers_parquet(changed_parquet_dir: str, papers_parquet_dir: str, removed_ids: Set[str]) -> None:
+    """
+    Fold a build's new or changed papers into the full papers dataset, dropping stale and deleted versions
+    """
+    papers_dd = dd.read_parquet(papers_parquet_dir, engine="fastparquet")
+    papers_dd = papers_dd[~papers_dd.cord_uid.isin(list(removed_ids))]
+    if list_parquet_files(changed_parquet_dir):
+        papers_dd = dd.concat([papers_dd, dd.read_parquet(changed_parquet_dir, engine="fastparquet")])
+    papers_dd = papers_dd.repartition(partition_size="100MB")
+    next_papers_parquet_dir = f"{papers_parquet_dir.rstrip('/')}_next/"
+    shutil.rmtree(next_papers_parquet_dir, ignore_errors=True)
+    dd.to_parquet(papers_dd, next_papers_parquet_dir, engine="fastparquet")
+    shutil.rmtree(papers_parquet_dir, ignore_errors=True)
+    os.rename(next_papers_parquet_dir, papers_parquet_dir)
+
+
+def build_index(
+    es_hosts: List[str],
+    es_alias: str,
+    incremental: bool,
+    profiler: Optional[BuildProfiler] = None,
+    num_bulk_workers: int = NUM_BULK_WORKERS,
+    max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+    partition_size: str = PARQUET_PARTITION_SIZE,
+    rebuild_artifacts: bool = False,
+) -> None:
+    """
+    Build the index behind es_alias.
+    A full build writes a new index generation that only replaces the live one, atomically, once it's fully built.
+    An incremental build processes and uploads only new or changed papers into the live generation. The search API's
+    corpus-wide artifacts (ANN index, TF-IDF vectors, citation signals, BM25, spelling and suggest indexes) can't be
+    updated per paper, so an incremental build keeps the previous ones unless rebuild_artifacts is set.
+    Progress is checkpointed per Parquet file, so an interrupted build resumes where it stopped when rerun.
+    Each stage is recorded by profiler (which only prints wall times unless it's enabled).
+    """
+    profiler = profiler or BuildProfiler()
+    es = Elasticsearch(hosts=es_hosts, maxsize=num_bulk_workers, timeout=BULK_REQUEST_TIMEOUT)
+    checkpoint = load_build_checkpoint()
+    if checkpoint is not None:
+        print(f"Resuming build {checkpoint['build_id']}: {len(checkpoint['indexed_files'])} files already uploaded")
+    else:
+        live_idx = current_generation_index(es, es_alias)
+        if incremental and live_idx is None:
+            print(f"Alias {es_alias} doesn't exist; falling back to a full build")
+            incremental = False
+        elif incremental and index_meta(es, live_idx).get("mapping_version") != INDEX_MAPPING_VERSION:
+            print(f"{live_idx} has an outdated mapping; falling back to a full build")
+            incremental = False
+        rebuild_artifacts = rebuild_artifacts or not incremental
+        with profiler.stage("csv_read") as stage:
+            manifest_df = load_manifest(live_idx) if incremental else empty_manifest()
+            # Metadata without bodies fits in memory; persist it so the passes below don't re-read the CSV
+            metadata_dd = load_paper_metadata("metadata.csv").persist()
+            stage["num_docs"] = len(metadata_dd)
+            if profiler.enabled:
+                stage["metadata_bytes"] = int(metadata_dd.memory_usage(deep=True).sum().compute())
+        with profiler.stage("diff_manifest") as stage:
+            changed_dd = select_changed_papers(metadata_dd, manifest_df)
+            num_changed_papers = len(changed_dd)
+            deleted_ids = sorted(set(manifest_df.cord_uid) - set(metadata_dd.cord_uid.compute()))
+            stage.update(num_changed_docs=num_changed_papers, num_deleted_docs=len(deleted_ids))
+        print(f"# new or changed papers: {num_changed_papers}, # deleted papers: {len(deleted_ids)}")
+
+        shutil.rmtree(PAPERS_DELTA_PARQUET_DIR, ignore_errors=True)
+        if num_changed_papers:
+            preprocess_papers(changed_dd, PAPERS_DELTA_PARQUET_DIR, profiler, partition_size)
+        with profiler.stage("paper_embeddings") as stage:
+            embedding_ids, embeddings = build_paper_embeddings(
+                metadata_dd[["cord_uid", "title", "abstract"]].compute(),
+                MODELS_DIR,
+                embeddings_csv=find_cord19_embeddings_csv(),
+                changed_ids=set(changed_dd.cord_uid.compute()) if incremental else None,
+            )
+            stage["num_docs"] = len(embedding_ids)
+        if rebuild_artifacts:
+            with profiler.stage("vector_index") as stage:
+                if len(embedding_ids):
+                    build_vector_index(
+                        embedding_ids, embeddings, os.path.join(MODELS_DIR, ANN_DIR), quantize=ANN_QUANTIZE_INT8
+                    )
+                else:
+                    # An ANN index needs at least one vector; the search API keeps serving the previous one, if any
+                    print("No paper embeddings; skipping the ANN index")
+                stage["num_docs"] = len(embedding_ids)
+            with profiler.stage("tfidf_vectors"):
+                # TF-IDF vectors of title + abstract; IDF is corpus-wide, so they're rebuilt from every paper
+                build_tfidf_vectors(metadata_dd[["cord_uid", "title", "abstract"]], os.path.join(MODELS_DIR, TFIDF_DIR))
+            with profiler.stage("paper_quality") as stage:
+                # Citations cross build deltas, so the graph is rebuilt from the (cached) bib entries of every paper
+                json_paths = list_pdf_json_paths(metadata_dd)
+                update_body_text_cache(json_paths)
+                quality_meta = build_paper_quality(
+                    metadata_dd[["cord_uid", "title", "pdf_json_files"]].compute(), load_bib_titles(json_paths)
+                )
+                stage.update(num_docs=quality_meta["num_papers"], num_citations=quality_meta["num_citations"])
+        else:
+            # Uploaded papers still get their embeddings and the previous build's citation signals
+            print("Keeping the previous corpus-wide artifacts; pass --rebuild-artifacts to rebuild them")
+        if incremental:
+            es_idx = live_idx
+        else:
+            es_idx = new_generation_index_name(es_alias)
+            create_generation_index(es, es_idx, covid19_papers_index_body())
+        checkpoint = {
+            "build_id": datetime.utcnow().strftime("%Y%m%d%H%M%S"),
+            "es_idx": es_idx,
+            "incremental": incremental,
+            "rebuild_artifacts": rebuild_artifacts,
+            "deleted_ids": deleted_ids,
+            "indexed_files": [],
+        }
+        save_build_checkpoint(checkpoint)
+
+    def checkpoint_indexed_file(parquet_path: str) -> None:
+        checkpoint["indexed_files"].append(parquet_path)
+        save_build_checkpoint(checkpoint)
+        print(f"Finished uploading {parquet_path}")
+
+    es_idx = checkpoint["es_idx"]
+    add_embedding = paper_embeddings_enricher(MODELS_DIR)
+    add_rank_features = paper_quality_enricher(PAPER_QUALITY_DIR)
+    with profiler.stage("bulk_upload") as stage:
+        upload_report = upload_parquet_dir_to_es_idx(
+            es,
+            PAPERS_DELTA_PARQUET_DIR,
+            es_idx,
+            num_workers=num_bulk_workers,
+            max_chunk_bytes=max_chunk_bytes,
+            skip_files=set(checkpoint["indexed_files"]),
+            on_file_indexed=checkpoint_indexed_file,
+            enrich_record=lambda record: add_rank_features(add_embedding(record)),
+        )
+        stage.update(upload_report.as_dict())
+        stage["num_docs"] = upload_report.docs_indexed
+    if checkpoint["deleted_ids"]:
+        with profiler.stage("bulk_delete") as stage:
+            delete_report = bulk_delete_docs(es, es_idx, checkpoint["deleted_ids"])
+            stage.update(delete_report.as_dict())
+            stage["num_docs"] = delete_report.docs_indexed
+        print(f"Bulk delete report: {delete_report.as_dict()}")
+
+    # Bring the full papers dataset and the manifest in line with what the index now holds
+    with profiler.stage("compact_and_manifest"):
+        changed_parquet_paths = list_parquet_files(PAPERS_DELTA_PARQUET_DIR)
+        if not checkpoint["incremental"]:
+            if os.path.exists(PAPERS_DELTA_PARQUET_DIR):  # Already moved if resuming after this step
+                shutil.rmtree(PAPERS_PARQUET_DIR, ignore_errors=True)
+                os.rename(PAPERS_DELTA_PARQUET_DIR, PAPERS_PARQUET_DIR)
+        elif changed_parquet_paths or checkpoint["deleted_ids"]:
+            removed_ids = set(checkpoint["deleted_ids"])
+            if changed_parquet_paths:
+                changed_ids_dd = dd.read_parquet(PAPERS_DELTA_PARQUET_DIR, engine="fastparquet", columns=["cord_uid"])
+                removed_ids |= set(changed_ids_dd.cord_uid.compute())
+            compact_papers_parquet(PAPERS_DELTA_PARQUET_DIR, PAPERS_PARQUET_DIR, removed_ids)
+        manifest_df = dd.read_parquet(PAPERS_PARQUET_DIR, engine="fastparquet", columns=MANIFEST_COLS).compute()
+        save_manifest(manifest_df, es_idx)
+    if checkpoint.get("rebuild_artifacts", True):
+        with profiler.stage("bm25_index") as stage:
+            # The search API's ES-free fallback engine, built from the same papers the index now holds
+            papers_dd = dd.read_parquet(PAPERS_PARQUET_DIR, engine="fastparquet", columns=BM25_DOC_FIELDS)
+            stage["num_docs"] = build_bm25_index(papers_dd, os.path.join(MODELS_DIR, BM25_DIR))["num_docs"]
+        with profiler.stage("spelling_index"):
+            # Vocabulary the search API corrects query words against
+            build_spelling_index(papers_dd[["title", "abstract"]], os.path.join(MODELS_DIR, SPELLING_DIR))
+        with profiler.stage("suggest_index"):
+            # Phrase and title completions of the typeahead endpoint
+            build_suggest_index(papers_dd, os.path.join(MODELS_DIR, SUGGEST_DIR))
+    with profiler.stage("publish"):
+        publish_index_generation(es, es_idx)
+        if not checkpoint["incremental"]:
+            finalize_generation_index(es, es_idx)
+            swap_alias(es, es_alias, es_idx)
+            delete_old_generations(es, es_alias)
+    clear_build_checkpoint()
 
 
 def main():
-    start = time.time()
+    parser = argparse.ArgumentParser(description="Build the Elasticsearch index of CORD-19 research papers")
+    parser.add_argument(
+        "--incremental", action="store_true", help="Only process and upload papers that are new or changed"
+    )
+    parser.add_argument(
+        "--rebuild-artifacts",
+        action="store_true",
+        help="With --incremental, also rebuild the corpus-wide artifacts of the search API (full builds always do)",
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Discard the checkpoint of an interrupted build instead of resuming it"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=BUILD_PROFILE_FILENAME,
+        default=None,
+        help=f"Sample memory and dask tasks per stage and write a JSON report (default: {BUILD_PROFILE_FILENAME})",
+    )
+    parser.add_argument("--trace-malloc", action="store_true", help="Also record tracemalloc peaks (slows the build)")
+    parser.add_argument("--bulk-workers", type=int, default=NUM_BULK_WORKERS)
+    parser.add_argument("--max-chunk-bytes", type=int, default=BULK_MAX_CHUNK_BYTES)
+    parser.add_argument("--partition-size", default=PARQUET_PARTITION_SIZE, help="Parquet partition size, e.g. 100MB")
+    args = parser.parse_args()
     """
     NOTE: Below lines lead to cwd and file issues. 
     Investigate issue using docs here: https://docs.dask.org/en/latest/setup/single-distributed.html
@@ -212,13 +485,39 @@ def main():
     # client = Client(n_workers=NUM_CPU_CORES)  # Set to number of cores of machine
     # dask_scheduler_workers = list(client.scheduler_info()["workers"].values())
     # print(f"Workers of Dask scheduler: {dask_scheduler_workers}\n\n")
-    preprocess_papers("metadata.csv")
-    preprocessing_end = time.time()
-    print(f"Preprocessing time (in seconds): {preprocessing_end - start}\n\n")  # Takes ~60-65 seconds
-    # upload_papers_to_es_idx(research_papers_dd, COVID19_PAPERS_INDEX, ["localhost"])
-    upload_parquet_dir_to_es_idx("research_paper_bodies/*", COVID19_PAPERS_INDEX, ["localhost"])
-    build_es_index_end = time.time()
-    print(f"Upload to elasticsearch idx: {build_es_index_end - preprocessing_end}")  # Takes ~240-270 seconds
+    if args.restart:
+        clear_build_checkpoint()
+    # Like bulk_failures.jsonl, the report is written to the dataset dir
+    profiler = BuildProfiler(
+        enabled=args.profile is not None,
+        trace_malloc=args.trace_malloc,
+        config={
+            "incremental": args.incremental,
+            "rebuild_artifacts": args.rebuild_artifacts,
+            "bulk_workers": args.bulk_workers,
+            "max_chunk_bytes": args.max_chunk_bytes,
+            "max_chunk_docs": BULK_MAX_CHUNK_DOCS,
+            "partition_size": args.partition_size,
+            "extraction_processes": NUM_EXTRACTION_PROCESSES,
+            "cpu_cores": NUM_CPU_CORES,
+        },
+    )
+    try:
+        build_index(
+            ["localhost"],
+            COVID19_PAPERS_INDEX,
+            args.incremental,
+            profiler=profiler,
+            num_bulk_workers=args.bulk_workers,
+            max_chunk_bytes=args.max_chunk_bytes,
+            partition_size=args.partition_size,
+            rebuild_artifacts=args.rebuild_artifacts,
+        )
+    finally:
+        # A profile of a failed build still shows how far it got and what memory looked like
+        if args.profile is not None:
+            profiler.write_report(args.profile)
+        profiler.close()
 
 
 if __name__ == "__main__":
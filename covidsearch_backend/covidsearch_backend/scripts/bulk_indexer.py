@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+
+# bulk_indexer.py
+# Streams Parquet files into an Elasticsearch index with byte-bounded bulk requests sent by concurrent workers
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from elasticsearch import ConnectionTimeout, Elasticsearch, TransportError
+import json
+import pyarrow.parquet as pq
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024  # Far below http.max_content_length, so no more 413s
+BULK_MAX_CHUNK_DOCS = 500
+NUM_BULK_WORKERS = 4
+BULK_MAX_RETRIES = 8
+BULK_INITIAL_BACKOFF = 1.0  # Seconds
+BULK_MAX_BACKOFF = 60.0
+PARQUET_BATCH_SIZE = 1000  # Rows materialized at once per Parquet file
+TRANSPORT_ERROR_413_URL = "https://github.com/elastic/elasticsearch/issues/2902"
+TRANSPORT_ERROR_429_URLS = [
+    "https://stackoverflow.com/questions/61870751/circuit-breaking-exception-parent-data-too-large-data-for-http-request",
+    "https://github.com/elastic/elasticsearch/issues/31197",
+]
+
+BulkAction = Tuple[str, bytes]  # (doc id, serialized action and source lines)
+
+
+class AdaptiveBackoff:
+    """
+    Pause shared by all bulk workers: doubles whenever Elasticsearch pushes back with a 429
+    and decays after successful requests, so the workers settle near the rate the cluster can absorb
+    """
+
+    def __init__(self, initial_backoff: float = BULK_INITIAL_BACKOFF, max_backoff: float = BULK_MAX_BACKOFF):
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._delay = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        delay = self._delay
+        if delay:
+            time.sleep(delay)
+
+    def on_rejected(self) -> None:
+        with self._lock:
+            self._delay = min(self.max_backoff, max(self.initial_backoff, self._delay * 2))
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._delay = self._delay / 2 if self._delay > self.initial_backoff / 8 else 0.0
+
+
+class BulkIndexingReport:
+    """
+    Thread-safe counters and per-item failures of a bulk indexing run
+    """
+
+    def __init__(self):
+        self.docs_indexed = 0
+        self.bytes_sent = 0
+        self.num_requests = 0
+        self.num_rejections = 0
+        self.failures: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_request(self, num_bytes: int) -> None:
+        with self._lock:
+            self.num_requests += 1
+            self.bytes_sent += num_bytes
+
+    def add_rejection(self) -> None:
+        with self._lock:
+            self.num_rejections += 1
+
+    def add_indexed(self, num_docs: int) -> None:
+        with self._lock:
+            self.docs_indexed += num_docs
+
+    def add_failure(self, doc_id: str, status: Any, error: Any) -> None:
+        with self._lock:
+            self.failures.append({"_id": doc_id, "status": status, "error": error})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "docs_indexed": self.docs_indexed,
+            "docs_failed": len(self.failures),
+            "bytes_sent": self.bytes_sent,
+            "num_requests": self.num_requests,
+            "num_rejections": self.num_rejections,
+        }
+
+    def write_failures(self, failures_filename: str) -> None:
+        with open(failures_filename, "w") as failures_file:
+            for failure in self.failures:
+                failures_file.write(f"{json.dumps(failure, default=str)}\n")
+
+
+def iter_parquet_records(parquet_path: str, batch_size: int = PARQUET_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily read a Parquet file batch by batch instead of materializing the whole partition in pandas
+    """
+    parquet_file = pq.ParquetFile(parquet_path)
+    # Skip index columns written by dask/fastparquet (e.g. __null_dask_index__)
+    columns = [name for name in parquet_file.schema_arrow.names if not name.startswith("__")]
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield from record_batch.to_pylist()
+
+
+def serialize_index_actions(records: Iterable[Dict[str, Any]], es_idx: str, id_field: str) -> Iterator[BulkAction]:
+    for record in records:
+        doc_id = record[id_field]
+        action = json.dumps({"index": {"_index": es_idx, "_id": doc_id}})
+        yield doc_id, f"{action}\n{json.dumps(record)}\n".encode("utf-8")
+
+
+def serialize_delete_actions(doc_ids: Iterable[str], es_idx: str) -> Iterator[BulkAction]:
+    for doc_id in doc_ids:
+        yield doc_id, f"{json.dumps({'delete': {'_index': es_idx, '_id': doc_id}})}\n".encode("utf-8")
+
+
+def chunk_actions(
+    actions: Iterable[BulkAction],
+    max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+    max_chunk_docs: int = BULK_MAX_CHUNK_DOCS,
+) -> Iterator[List[BulkAction]]:
+    """
+    Group serialized actions into bulk requests bounded by both size in bytes and number of docs
+    """
+    chunk: List[BulkAction] = []
+    chunk_bytes = 0
+    for doc_id, action_lines in actions:
+        if chunk and (chunk_bytes + len(action_lines) > max_chunk_bytes or len(chunk) >= max_chunk_docs):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append((doc_id, action_lines))
+        chunk_bytes += len(action_lines)
+    if chunk:
+        yield chunk
+
+
+def send_bulk_chunk(
+    es: Elasticsearch,
+    chunk: List[BulkAction],
+    backoff: AdaptiveBackoff,
+    report: BulkIndexingReport,
+    max_retries: int = BULK_MAX_RETRIES,
+) -> None:
+    """
+    Send one bulk request, retrying only the items Elasticsearch rejected with 429 and recording other item failures
+    """
+    pending = chunk
+    for _ in range(max_retries + 1):
+        backoff.wait()
+        body = b"".join(action_lines for _, action_lines in pending)
+        report.add_request(len(body))
+        try:
+            res = es.bulk(body=body)
+        except ConnectionTimeout:
+            backoff.on_rejected()
+            report.add_rejection()
+            continue
+        except TransportError as te:
+            if te.status_code == 429:
+                backoff.on_rejected()
+                report.add_rejection()
+                continue
+            if te.status_code == 413:
+                print(
+                    f"Transport error with status code 413. Chunk size is too large, so try reducing BULK_MAX_CHUNK_BYTES or increase http.max_content_length in the yml file. More info here: {TRANSPORT_ERROR_413_URL}"
+                )
+            raise te
+
+        rejected = []
+        num_indexed = 0
+        for (doc_id, action_lines), item in zip(pending, res["items"]):
+            op_type, item_result = next(iter(item.items()))
+            if item_result["status"] == 429:
+                rejected.append((doc_id, action_lines))
+            elif op_type == "delete" and item_result["status"] == 404:
+                num_indexed += 1  # Already gone
+            elif item_result["status"] >= 300:
+                report.add_failure(doc_id, item_result["status"], item_result.get("error"))
+            else:
+                num_indexed += 1
+        report.add_indexed(num_indexed)
+        if not rejected:
+            backoff.on_success()
+            return
+        backoff.on_rejected()
+        report.add_rejection()
+        pending = rejected
+
+    print(
+        f"{len(pending)} docs still rejected after {max_retries} retries. Elasticsearch's JVM heap size may be too small, so try increasing ES_JAVA_OPTS in docker-compose.yml or lowering the number of bulk workers. More info here: {TRANSPORT_ERROR_429_URLS}"
+    )
+    for doc_id, _ in pending:
+        report.add_failure(doc_id, 429, "Rejected after retries")
+
+
+def bulk_index_parquet_files(
+    es: Elasticsearch,
+    es_idx: str,
+    parquet_paths: List[str],
+    id_field: str = "cord_uid",
+    num_workers: int = NUM_BULK_WORKERS,
+    max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+    max_chunk_docs: int = BULK_MAX_CHUNK_DOCS,
+    on_file_indexed: Optional[Callable[[str], None]] = None,
+    enrich_record: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+) -> BulkIndexingReport:
+    """
+    Stream Parquet files into es_idx with num_workers concurrent bulk requests.
+    At most 2 * num_workers chunks are serialized ahead of the workers, which bounds memory.
+    on_file_indexed(path) is called once every chunk of a file has been sent.
+    enrich_record(record) can add fields that aren't stored in the Parquet files (e.g. embeddings) before upload.
+    """
+    report = BulkIndexingReport()
+    backoff = AdaptiveBackoff()
+    chunks_in_flight: Set[Future] = set()
+    file_chunks: Dict[str, Set[Future]] = {}
+    files_read: Set[str] = set()
+
+    def finish_files(done_chunks: Set[Future]) -> None:
+        for done_chunk in done_chunks:
+            done_chunk.result()  # Re-raise worker errors
+        for parquet_path in list(file_chunks):
+            file_chunks[parquet_path] -= done_chunks
+            if parquet_path in files_read and not file_chunks[parquet_path]:
+                del file_chunks[parquet_path]
+                if on_file_indexed is not None:
+                    on_file_indexed(parquet_path)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for parquet_path in parquet_paths:
+            file_chunks[parquet_path] = set()
+            records = iter_parquet_records(parquet_path)
+            if enrich_record is not None:
+                records = map(enrich_record, records)
+            actions = serialize_index_actions(records, es_idx, id_field)
+            for chunk in chunk_actions(actions, max_chunk_bytes, max_chunk_docs):
+                if len(chunks_in_flight) >= 2 * num_workers:
+                    done_chunks, chunks_in_flight = wait(chunks_in_flight, return_when=FIRST_COMPLETED)
+                    finish_files(done_chunks)
+                future = executor.submit(send_bulk_chunk, es, chunk, backoff, report)
+                chunks_in_flight.add(future)
+                file_chunks[parquet_path].add(future)
+            files_read.add(parquet_path)
+        done_chunks, _ = wait(chunks_in_flight)
+        finish_files(done_chunks)
+
+    return report
+
+
+def bulk_delete_docs(
+    es: Elasticsearch, es_idx: str, doc_ids: Iterable[str], max_chunk_docs: int = BULK_MAX_CHUNK_DOCS * 10
+) -> BulkIndexingReport:
+    """
+    Delete docs in large bulk requests (delete actions are tiny, so chunks hold many more docs than index chunks)
+    """
+    report = BulkIndexingReport()
+    backoff = AdaptiveBackoff()
+    for chunk in chunk_actions(serialize_delete_actions(doc_ids, es_idx), max_chunk_docs=max_chunk_docs):
+        send_bulk_chunk(es, chunk, backoff, report)
+    return report
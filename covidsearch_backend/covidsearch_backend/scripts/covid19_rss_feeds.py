@@ -1,23 +1,20 @@
 #!/usr/bin/python3
 
-# import aiohttp
-from aiohttp import ClientSession
+import argparse
+from article_summarizer import (
+    SUMMARIZER_PROFILES,
+    SummarizationWorker,
+    SummaryCache,
+    summarize_article_files,
+    summarizer_from_profile,
+)
 import asyncio
-from bs4 import BeautifulSoup
 import dask
 from datetime import date
-import feedparser
-import html5lib
-import json
-
-# from multiprocessing import Pool, Process
-import torch.multiprocessing as mp
-from torch.multiprocessing import Pool, Process
 import os
-import re
+from rss_crawler import crawl_rss_feeds
 import time
-from transformers import AutoModelWithLMHead, AutoTokenizer
-from typing import Any, List
+from typing import List, Optional
 
 FEEDS = {
     "nyt_health": "https://rss.nytimes.com/services/xml/rss/nyt/Health.xml",
@@ -33,75 +30,30 @@ FEEDS_SCRAPE_TAG = {
     "wired_rss": "article__chunks",
     "mit_technology_review_rss": "storyContent",
 }
-NUM_PROCESSES = 4  # Dependent on # cores of machine
-
-
-async def _scrape_article_text(
-    feed_session: ClientSession,
-    feed_dir: str,
-    feed_title: str,
-    feed_scrape_tag: str,
-    page_title: str,
-    page_url: str,
-) -> None:
-    # Get text of article
-    async with feed_session.get(page_url) as article_html:
-        # article_content = article_html.content
-        article_content = await article_html.text()
-        soup_article = BeautifulSoup(article_content, "html5lib")
-        article_bodies = soup_article.find_all(
-            "div", class_=re.compile(feed_scrape_tag)
-        )
-        if not article_bodies:
-            print(f"Could not find article body for {page_title} at {page_url}")
-            """
-            with open(f"{page_title}.txt", "w") as f:
-                f.write(soup_article.prettify())
-            """
-            return ""
-
-        # Create feed dir and filename
-        feed_domain_dir = os.path.join(feed_dir, feed_title)
-        if not os.path.exists(feed_domain_dir):
-            os.makedirs(feed_domain_dir)
-        page_title_filename = f"{page_title.replace(' ', '_')}.txt"
-        article_text_path = os.path.join(feed_domain_dir, page_title_filename)
-
-        # Write article text into these files
-        with open(article_text_path, "w+") as article_text_file:
-            for article_body in article_bodies:
-                body_text = article_body.find_all("p")
-                for paragraph in body_text:
-                    paragraph_text = paragraph.get_text()
-                    article_text_file.write(f"{paragraph_text}\n")
-
-
-async def _write_feed_metadata_and_article_text(
-    feed_dir: str, feed_data_file: str, feed: str, rss_url: str
-) -> None:
-    rss_parsed = feedparser.parse(rss_url)
-    feed_data_file.write(f"Feed: {feed}\n")
-    feed_data_file.write(json.dumps(rss_parsed, indent=4))
 
-    feed_scrape_tag = FEEDS_SCRAPE_TAG[feed]
-    feed_metadata = rss_parsed["feed"]
-    feed_title = feed_metadata["title"]
-    feed_entries = rss_parsed["entries"]
-    if not feed_entries:
-        return
-
-    for feed_entry in feed_entries:
-        article_title = feed_entry["title"]
-        article_url = feed_entry["link"]
-        async with ClientSession() as feed_session:
-            await _scrape_article_text(
-                feed_session,
-                feed_dir,
-                feed_title,
-                feed_scrape_tag,
-                article_title,
-                article_url,
-            )
+# Fixed set of articles saved by earlier crawls; summarized by main and by benchmark_summarizer.py
+SAVED_ARTICLE_FILES = [
+    "rss_feeds_11-24-2020/Wired/Google_Is_Testing_End-to-End_Encryption_in_Android_Messages.txt",
+    "rss_feeds_11-24-2020/Wired/A_Solar-Powered_Rocket_Might_Be_Our_Interstellar_Ticket.txt",
+    "rss_feeds_11-24-2020/Wired/This_Pandemic_Must_Be_Seen.txt",
+    "rss_feeds_12-02-2020/Wired/The_Race_To_Crack_Battery_Recycling—Before_It’s_Too_Late.txt",
+    "rss_feeds_12-02-2020/New on MIT Technology Review/Blood_plasma_taken_from_covid-19_survivors_might_help_patients_fight_it_off.txt",
+    "rss_feeds_12-02-2020/New on MIT Technology Review/Why_does_it_suddenly_feel_like_1999_on_the_internet?.txt",
+    "rss_feeds_12-02-2020/New on MIT Technology Review/Why_does_it_suddenly_feel_like_1999_on_the_internet?.txt",
+    "rss_feeds_12-02-2020/NYT > Health/Biden’s_Plan_for_Seniors_Is_Not_Just_a_Plan_for_Seniors.txt",
+    "rss_feeds_12-02-2020/NYT > Science/Virus_May_Have_Arrived_in_U.S._in_December,_but_Didn’t_Spread_Until_Later.txt",
+    "rss_feeds_12-02-2020/NYT > Health/Vaccines_Are_Coming,_but_Pandemic_Experts_Expect_a_'Horrible'_Winter.txt",
+    # "rss_feeds_12-12-2020/Wired/The_Smoking_Gun_in_the_Facebook_Antitrust_Case.txt",
+    # "rss_feeds_12-12-2020/Wired/Hackers_Accessed_Covid_Vaccine_Data_Through_the_EU_Regulator.txt",
+    # "rss_feeds_12-12-2020/Wired/The_Dark_Side_of_Big_Tech’s_Funding_for_AI_Research.txt",
+    # "rss_feeds_12-12-2020/New on MIT Technology Review/WhatsApp_is_limiting_message_forwarding_to_combat_coronavirus_misinformation.txt",
+    # "rss_feeds_12-12-2020/New on MIT Technology Review/Here_are_the_states_that_will_suffer_the_worst_hospital_bed_shortages.txt",
+    # "rss_feeds_12-12-2020/New on MIT Technology Review/The_coronavirus_test_that_might_exempt_you_from_social_distancing—if_you_pass.txt",
+    # "rss_feeds_12-12-2020/NYT > Science/F.D.A._Clears_Pfizer_Vaccine,_and_Millions_of_Doses_Will_Be_Shipped_Right_Away.txt",
+    # "rss_feeds_12-12-2020/NYT > Science/Earth_Is_Still_Sailing_Into_Climate_Chaos,_Report_Says,_but_Its_Course_Could_Shift.txt",
+    # "rss_feeds_12-12-2020/NYT > Health/Covid_Testing:_What_You_Need_to_Know.txt",
+    # "rss_feeds_12-12-2020/Wired/Severe_Wildfires_Are_Devastating_the_California_Condor.txt",
+]
 
 
 async def parse_and_upload_rss_feed_data(feed_data_filename: str) -> None:
@@ -114,126 +66,44 @@ async def parse_and_upload_rss_feed_data(feed_data_filename: str) -> None:
         os.makedirs(feed_dir)
     feed_data_path = os.path.join(feed_dir, feed_data_filename)
 
-    with open(feed_data_path, "w+") as feed_data_file:
-        await asyncio.gather(
-            *[
-                _write_feed_metadata_and_article_text(
-                    feed_dir, feed_data_file, feed, rss_url
-                )
-                for feed, rss_url in FEEDS.items()
-            ]
-        )
+    crawl_stats = await crawl_rss_feeds(FEEDS, FEEDS_SCRAPE_TAG, feed_dir, feed_data_path)
+    print(f"Crawl stats: {crawl_stats}")
 
 
-def _summarize_news_article(model: Any, tokenizer: Any, article_filename: str) -> str:
-    # print(f"Process: {os.getpid()}")
-    with open(article_filename, "r") as article_file:
-        article = article_file.read()
-    # print(f"Read the file: {article_filename}")
+def _summarize_articles(article_filenames: List[str], profile: str, num_threads: Optional[int]) -> None:
+    summarizer = summarizer_from_profile(profile, num_threads=num_threads)
+    cache = SummaryCache()
+    worker = SummarizationWorker(summarizer, cache)
+    try:
+        article_summaries = summarize_article_files(article_filenames, worker)
+    finally:
+        worker.close()
+        cache.close()
+    for article_filename, article_summary in article_summaries.items():
+        print(f"Article summary of {article_filename}: {article_summary}")
 
-    inputs = tokenizer.encode(
-        "summarize: " + article, return_tensors="pt", max_length=512, truncation=True,
+
+async def main():
+    parser = argparse.ArgumentParser(description="Crawl COVID-19 news RSS feeds or summarize crawled articles")
+    parser.add_argument(
+        "--crawl", action="store_true", help="Crawl the RSS feeds instead of summarizing saved articles"
     )
-    # print(f"Encoding the file: {article_filename}")
-    outputs = model.generate(
-        inputs,
-        max_length=150,
-        min_length=100,
-        length_penalty=1.2,
-        num_beams=4,
-        early_stopping=True,
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads of the summarizer")
+    parser.add_argument(
+        "--profile", choices=list(SUMMARIZER_PROFILES), default="baseline", help="Summarizer inference profile"
     )
-    # print(f"Summarization task output: {outputs}")
-    article_summary = tokenizer.decode(outputs[0])
-
-    return article_summary
-
-
-def _parallelize_summarizations(article_filenames: List[str]) -> None:
-    model = AutoModelWithLMHead.from_pretrained("t5-base", return_dict=True)
-    model.share_memory()
-    tokenizer = AutoTokenizer.from_pretrained("t5-base")
-
-    """
-    # Multiprocessing #1
-    # Hangs on Ubuntu machine for some reason (tried using torch.multiprocessing, moving outside of main method, using model and tokenizer as params, etc; nothing works)
-    # For some reason, worked fine in 40-45 seconds on FB Mac
-    # 102-105 seconds
-    mp.set_start_method("spawn")
-    with Pool(NUM_PROCESSES) as p:
-        article_summaries = p.starmap(
-            _summarize_news_article,
-            [
-                (model, tokenizer, article_filename)
-                for article_filename in article_filenames
-            ],
-        )
-        print(f"Article summaries: {article_summaries}")
-    p.close()
-    p.join()
-    """
-
-    # Multiprocesing #2
-    # Issue #1: https://stackoverflow.com/questions/50168647/multiprocessing-causes-python-to-crash-and-gives-an-error-may-have-been-in-progr
-    # 40-45 seconds
-    # 90-105 seconds (more variance than multiprocessing #1, but first approach should be better since it's better to fix # processes created)
-    """
-    procs = []
-    for article_file in article_files:
-        proc = Process(
-            target=_summarize_news_article, args=(model, tokenizer, article_file,)
-        )
-        procs.append(proc)
-        proc.start()
-
-    for proc in procs:
-        proc.join()
-    """
-
-    # List Comprehension
-    # 90-95 seconds
-    # ~220 seconds
-    article_summaries = [
-        _summarize_news_article(model, tokenizer, article_file)
-        for article_file in article_filenames
-    ]
-    for article_summary in article_summaries:
-        print(f"Article summary: {article_summary}")
-
+    args = parser.parse_args()
+    if args.crawl:
+        start_time = time.time()
+        await parse_and_upload_rss_feed_data(f"feed_data.txt")
+        # Took 20-30 seconds for 5 RSS feeds or ~170 articles with a session per article fetched one by one
+        print(f"Execution time (async): {time.time() - start_time}")
+        return
 
-async def main():
-    """
-    start_time = time.time()
-    await parse_and_upload_rss_feed_data(f"feed_data.txt")
-    end_time = time.time()
-    # Takes around 20-30 seconds (more precisely, 24.56 seconds for 5 RSS feeds or ~170 articles)
-    print(f"Execution time (async): {end_time - start_time}")
-    """
-    article_files = [
-        "rss_feeds_11-24-2020/Wired/Google_Is_Testing_End-to-End_Encryption_in_Android_Messages.txt",
-        "rss_feeds_11-24-2020/Wired/A_Solar-Powered_Rocket_Might_Be_Our_Interstellar_Ticket.txt",
-        "rss_feeds_11-24-2020/Wired/This_Pandemic_Must_Be_Seen.txt",
-        "rss_feeds_12-02-2020/Wired/The_Race_To_Crack_Battery_Recycling—Before_It’s_Too_Late.txt",
-        "rss_feeds_12-02-2020/New on MIT Technology Review/Blood_plasma_taken_from_covid-19_survivors_might_help_patients_fight_it_off.txt",
-        "rss_feeds_12-02-2020/New on MIT Technology Review/Why_does_it_suddenly_feel_like_1999_on_the_internet?.txt",
-        "rss_feeds_12-02-2020/New on MIT Technology Review/Why_does_it_suddenly_feel_like_1999_on_the_internet?.txt",
-        "rss_feeds_12-02-2020/NYT > Health/Biden’s_Plan_for_Seniors_Is_Not_Just_a_Plan_for_Seniors.txt",
-        "rss_feeds_12-02-2020/NYT > Science/Virus_May_Have_Arrived_in_U.S._in_December,_but_Didn’t_Spread_Until_Later.txt",
-        "rss_feeds_12-02-2020/NYT > Health/Vaccines_Are_Coming,_but_Pandemic_Experts_Expect_a_'Horrible'_Winter.txt",
-        # "rss_feeds_12-12-2020/Wired/The_Smoking_Gun_in_the_Facebook_Antitrust_Case.txt",
-        # "rss_feeds_12-12-2020/Wired/Hackers_Accessed_Covid_Vaccine_Data_Through_the_EU_Regulator.txt",
-        # "rss_feeds_12-12-2020/Wired/The_Dark_Side_of_Big_Tech’s_Funding_for_AI_Research.txt",
-        # "rss_feeds_12-12-2020/New on MIT Technology Review/WhatsApp_is_limiting_message_forwarding_to_combat_coronavirus_misinformation.txt",
-        # "rss_feeds_12-12-2020/New on MIT Technology Review/Here_are_the_states_that_will_suffer_the_worst_hospital_bed_shortages.txt",
-        # "rss_feeds_12-12-2020/New on MIT Technology Review/The_coronavirus_test_that_might_exempt_you_from_social_distancing—if_you_pass.txt",
-        # "rss_feeds_12-12-2020/NYT > Science/F.D.A._Clears_Pfizer_Vaccine,_and_Millions_of_Doses_Will_Be_Shipped_Right_Away.txt",
-        # "rss_feeds_12-12-2020/NYT > Science/Earth_Is_Still_Sailing_Into_Climate_Chaos,_Report_Says,_but_Its_Course_Could_Shift.txt",
-        # "rss_feeds_12-12-2020/NYT > Health/Covid_Testing:_What_You_Need_to_Know.txt",
-        # "rss_feeds_12-12-2020/Wired/Severe_Wildfires_Are_Devastating_the_California_Condor.txt",
-    ]
     start_time = time.time()
 
-    _parallelize_summarizations(article_files)
+    # Took 90-220 seconds for these 10 articles one at a time (4-beam t5-base); cached summaries are never recomputed
+    _summarize_articles(SAVED_ARTICLE_FILES, args.profile, args.threads)
 
     summarization_exec_time = time.time() - start_time
     print(f"Summarization execution time: {summarization_exec_time}")
@@ -1,76 +1,227 @@
 #!/usr/local/bin/python3
 
-# https://www.elastic.co/blog/how-to-find-and-remove-duplicate-documents-in-elasticsearch
+# deduplicate_docs.py
+# Removes duplicate papers from the search index, keeping one canonical doc per group of duplicates:
+# * Exact duplicates share the same DEDUP_KEY_FIELDS values (docs indexed under several _ids).
+# * Near duplicates (e.g. the same preprint indexed under several cord_uids) have near-identical title + abstract.
+#   They're found with MinHash signatures of word shingles and locality-sensitive hashing (LSH) of signature bands,
+#   so only papers sharing a band are compared, i.e. O(n) work instead of comparing all pairs.
+# The index is read with a sliced scroll (ES 7.8 has no point-in-time API) whose slices are scanned in parallel,
+# fetching only the fields needed to fingerprint each paper; duplicates are then deleted in large bulk requests.
+# Based on https://www.elastic.co/blog/how-to-find-and-remove-duplicate-documents-in-elasticsearch
 
-import hashlib
-from elasticsearch import Elasticsearch
+import argparse
 from build_research_paper_index import COVID19_PAPERS_INDEX
+from bulk_indexer import bulk_delete_docs
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import Elasticsearch
+import hashlib
+from index_generations import current_generation_index
+import json
+import numpy as np
+import re
+from typing import Any, Dict, Iterator, List, Tuple
+import zlib
+
+DEDUP_KEY_FIELDS = ["cord_uid"]  # Fields that are equal for exact duplicates
+DEDUP_SOURCE_FIELDS = ["cord_uid", "title", "abstract"]
+DEDUP_SCAN_PAGE_SIZE = 5000
+DEDUP_SCROLL_KEEP_ALIVE = "5m"
+NUM_DEDUP_SLICES = 4
+DEDUP_REPORT_FILENAME = "duplicate_groups.jsonl"
+# MinHash/LSH: 16 bands of 8 rows make papers with Jaccard similarity >= ~0.7 likely to share a band,
+# and candidate pairs are then confirmed on their estimated similarity
+MINHASH_NUM_PERMUTATIONS = 128
+LSH_NUM_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = 0.9
+SHINGLE_NUM_WORDS = 3
+MIN_NUM_SHINGLES = 8  # Shorter texts (e.g. a title like "Editorial" without abstract) aren't specific enough
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.default_rng(0)
+# Coefficients below 2^29 keep a * (32-bit shingle hash) + b below 2^61, so the permutations can't overflow uint64
+_PERMUTATION_A = _rng.integers(1, 1 << 29, MINHASH_NUM_PERMUTATIONS, dtype=np.uint64)
+_PERMUTATION_B = _rng.integers(0, 1 << 29, MINHASH_NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i : i + SHINGLE_NUM_WORDS]) for i in range(max(1, len(words) - SHINGLE_NUM_WORDS + 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64)
+
+
+def minhash_signature(hashes: np.ndarray) -> np.ndarray:
+    """
+    Min of each random permutation (a * x + b mod p) over the shingle hashes
+    """
+    if not len(hashes):
+        return np.full(MINHASH_NUM_PERMUTATIONS, _MAX_HASH, dtype=np.uint32)
+    permuted = (hashes[:, None] * _PERMUTATION_A + _PERMUTATION_B) % np.uint64(_MERSENNE_PRIME)
+    return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+
+def fingerprint_paper(hit: Dict[str, Any]) -> Dict[str, Any]:
+    source = hit["_source"]
+    exact_key = "\x1f".join(str(source.get(field, "")) for field in DEDUP_KEY_FIELDS)
+    hashes = shingle_hashes(f"{source.get('title', '')} {source.get('abstract', '')}")
+    return {
+        "_id": hit["_id"],
+        "cord_uid": source.get("cord_uid", ""),
+        "abstract_len": len(source.get("abstract") or ""),
+        "exact_digest": hashlib.md5(exact_key.encode("utf-8")).digest(),
+        "signature": minhash_signature(hashes) if len(hashes) >= MIN_NUM_SHINGLES else None,
+    }
+
+
+def scan_slice(es: Elasticsearch, es_idx: str, slice_id: int, num_slices: int) -> List[Dict[str, Any]]:
+    """
+    Fingerprint every doc of one slice of a sliced scroll
+    """
+    body = {"size": DEDUP_SCAN_PAGE_SIZE, "sort": ["_doc"], "_source": DEDUP_SOURCE_FIELDS}
+    if num_slices > 1:
+        body["slice"] = {"id": slice_id, "max": num_slices}
+    res = es.search(index=es_idx, body=body, scroll=DEDUP_SCROLL_KEEP_ALIVE)
+    scroll_id = res["_scroll_id"]
+    fingerprints = []
+    try:
+        while res["hits"]["hits"]:
+            fingerprints.extend(fingerprint_paper(hit) for hit in res["hits"]["hits"])
+            res = es.scroll(scroll_id=scroll_id, scroll=DEDUP_SCROLL_KEEP_ALIVE)
+            scroll_id = res["_scroll_id"]
+    finally:
+        es.clear_scroll(scroll_id=scroll_id)
+    return fingerprints
+
+
+def scan_index(es: Elasticsearch, es_idx: str, num_slices: int) -> List[Dict[str, Any]]:
+    with ThreadPoolExecutor(max_workers=num_slices) as executor:
+        slices = executor.map(lambda slice_id: scan_slice(es, es_idx, slice_id, num_slices), range(num_slices))
+        return [fingerprint for fingerprints in slices for fingerprint in fingerprints]
 
-es = Elasticsearch(["localhost"])
-dict_of_duplicate_docs = {}
-# The following line defines the fields that will be
-# used to determine if a document is a duplicate
-keys_to_include_in_hash = ["cord_uid"]
-# Process documents returned by the current search/scroll
-def populate_dict_of_duplicate_docs(hits):
-    for item in hits:
-        combined_key = ""
-        for mykey in keys_to_include_in_hash:
-            combined_key += str(item["_source"][mykey])
-        _id = item["_id"]
-        hashval = hashlib.md5(combined_key.encode("utf-8")).digest()
-        # If the hashval is new, then we will create a new key
-        # in the dict_of_duplicate_docs, which will be
-        # assigned a value of an empty array.
-        # We then immediately push the _id onto the array.
-        # If hashval already exists, then
-        # we will just push the new _id onto the existing array
-        dict_of_duplicate_docs.setdefault(hashval, []).append(_id)
-
-
-# Loop over all documents in the index, and populate the
-# dict_of_duplicate_docs data structure.
-def scroll_over_all_docs():
-    data = es.search(index=COVID19_PAPERS_INDEX, scroll="1m", body={"query": {"match_all": {}}})
-    # Get the scroll ID
-    sid = data["_scroll_id"]
-    scroll_size = len(data["hits"]["hits"])
-    # Before scroll, process current batch of hits
-    populate_dict_of_duplicate_docs(data["hits"]["hits"])
-    while scroll_size > 0:
-        data = es.scroll(scroll_id=sid, scroll="2m")
-        # Process current batch of hits
-        populate_dict_of_duplicate_docs(data["hits"]["hits"])
-        # Update the scroll ID
-        sid = data["_scroll_id"]
-        # Get the number of results that returned in the last scroll
-        scroll_size = len(data["hits"]["hits"])
-
-
-def loop_over_hashes_and_remove_duplicates():
-    # Search through the hash of doc values to see if any
-    # duplicate hashes have been found
-    for _, array_of_ids in dict_of_duplicate_docs.items():
-        if len(array_of_ids) > 1:
-            # print("********** Duplicate docs hash=%s **********" % hashval)
-            # Get the documents that have mapped to the current hashval
-            matching_docs = es.mget(index=COVID19_PAPERS_INDEX, body={"ids": array_of_ids},)
-            doc_ids = [doc["_id"] for doc in matching_docs["docs"]]
-
-            # Delete in bulk; much faster operation than deleting one by one: https://stackoverflow.com/questions/30859142/how-to-delete-documents-from-elasticsearch
-            bulk_delete_body = [
-                '{{"delete": {{"_index": "{}", "_id": "{}"}}}}'.format(COVID19_PAPERS_INDEX, doc_id)
-                for doc_id in doc_ids
-            ]
-            es.bulk("\n".join(bulk_delete_body))
+
+class DisjointSets:
+    """
+    Union-find over doc positions, merging exact and near duplicates into groups
+    """
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        self.parent[self.find(i)] = self.find(j)
+
+    def groups(self) -> Iterator[List[int]]:
+        groups: Dict[int, List[int]] = {}
+        for i in range(len(self.parent)):
+            groups.setdefault(self.find(i), []).append(i)
+        return (group for group in groups.values() if len(group) > 1)
+
+
+def union_exact_duplicates(fingerprints: List[Dict[str, Any]], doc_sets: DisjointSets) -> int:
+    first_by_digest: Dict[bytes, int] = {}
+    num_duplicates = 0
+    for i, fingerprint in enumerate(fingerprints):
+        first = first_by_digest.setdefault(fingerprint["exact_digest"], i)
+        if first != i:
+            doc_sets.union(i, first)
+            num_duplicates += 1
+    return num_duplicates
+
+
+def union_near_duplicates(fingerprints: List[Dict[str, Any]], doc_sets: DisjointSets, threshold: float) -> int:
+    """
+    LSH: papers whose signatures agree on all rows of a band are candidates, confirmed on their estimated Jaccard
+    """
+    positions = np.array([i for i, fingerprint in enumerate(fingerprints) if fingerprint["signature"] is not None])
+    if len(positions) < 2:
+        return 0
+    signatures = np.stack([fingerprints[i]["signature"] for i in positions])
+    rows_per_band = MINHASH_NUM_PERMUTATIONS // LSH_NUM_BANDS
+    num_pairs = 0
+    for band in range(LSH_NUM_BANDS):
+        band_signatures = np.ascontiguousarray(signatures[:, band * rows_per_band : (band + 1) * rows_per_band])
+        _, buckets, bucket_sizes = np.unique(
+            band_signatures.view(f"V{band_signatures.itemsize * rows_per_band}").ravel(),
+            return_inverse=True,
+            return_counts=True,
+        )
+        order = np.argsort(buckets, kind="stable")
+        bucket_starts = np.cumsum(bucket_sizes) - bucket_sizes
+        for bucket in np.flatnonzero(bucket_sizes > 1):
+            members = order[bucket_starts[bucket] : bucket_starts[bucket] + bucket_sizes[bucket]]
+            # Compare each member with the bucket's first one only; the other bands link the rest transitively
+            similarities = (signatures[members[1:]] == signatures[members[0]]).mean(axis=1)
+            for member in members[1:][similarities >= threshold]:
+                if doc_sets.find(positions[member]) != doc_sets.find(positions[members[0]]):
+                    doc_sets.union(positions[member], positions[members[0]])
+                    num_pairs += 1
+    return num_pairs
+
+
+def canonical_doc(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Keep the doc addressable by its cord_uid, then the one with the longest abstract, then the smallest _id
+    """
+    return min(group, key=lambda doc: (doc["_id"] != doc["cord_uid"], -doc["abstract_len"], doc["_id"]))
+
+
+def find_duplicate_groups(
+    fingerprints: List[Dict[str, Any]], near_duplicates: bool, threshold: float
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    doc_sets = DisjointSets(len(fingerprints))
+    stats = {"num_docs": len(fingerprints), "num_exact_duplicates": union_exact_duplicates(fingerprints, doc_sets)}
+    if near_duplicates:
+        stats["num_near_duplicate_pairs"] = union_near_duplicates(fingerprints, doc_sets, threshold)
+    duplicate_groups = []
+    for group_positions in doc_sets.groups():
+        group = [fingerprints[i] for i in group_positions]
+        keep = canonical_doc(group)
+        duplicate_groups.append(
+            {"keep": keep["_id"], "delete": sorted(doc["_id"] for doc in group if doc["_id"] != keep["_id"])}
+        )
+    stats["num_duplicate_groups"] = len(duplicate_groups)
+    stats["num_docs_to_delete"] = sum(len(group["delete"]) for group in duplicate_groups)
+    return duplicate_groups, stats
 
 
 def main():
-    pre_total_num_hits = es.count(index=COVID19_PAPERS_INDEX, body={"query": {"match_all": {}}})
-    scroll_over_all_docs()
-    loop_over_hashes_and_remove_duplicates()
-    post_total_num_hits = es.count(index=COVID19_PAPERS_INDEX, body={"query": {"match_all": {}}})
+    parser = argparse.ArgumentParser(description="Remove exact and near duplicate papers from the search index")
+    parser.add_argument("--es-host", default="localhost")
+    parser.add_argument("--index", default=COVID19_PAPERS_INDEX, help="Index or alias to deduplicate")
+    parser.add_argument(
+        "--dry-run", action="store_true", help=f"Only write the groups found to {DEDUP_REPORT_FILENAME}"
+    )
+    parser.add_argument("--exact-only", action="store_true", help="Skip near-duplicate detection")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD, help="Min. Jaccard similarity")
+    parser.add_argument("--slices", type=int, default=NUM_DEDUP_SLICES)
+    args = parser.parse_args()
+
+    es = Elasticsearch(hosts=[args.es_host], maxsize=args.slices)
+    es_idx = current_generation_index(es, args.index) or args.index
+    pre_total_num_hits = es.count(index=es_idx)["count"]
+    fingerprints = scan_index(es, es_idx, args.slices)
+    duplicate_groups, stats = find_duplicate_groups(fingerprints, not args.exact_only, args.threshold)
+    print(f"Deduplication of {es_idx}: {stats}")
+    with open(DEDUP_REPORT_FILENAME, "w") as report_file:
+        for group in duplicate_groups:
+            report_file.write(f"{json.dumps(group)}\n")
+    if args.dry_run:
+        print(f"Dry run; duplicate groups written to {DEDUP_REPORT_FILENAME}")
+        return
+
+    doc_ids = (doc_id for group in duplicate_groups for doc_id in group["delete"])
+    report = bulk_delete_docs(es, es_idx, doc_ids)
+    es.indices.refresh(index=es_idx)
+    post_total_num_hits = es.count(index=es_idx)["count"]
+    print(f"Bulk delete report: {report.as_dict()}")
     print(f"Number of entries before and after deduplication: {pre_total_num_hits}, {post_total_num_hits}")
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,16 @@ from typing import List
 
 from elasticsearch import Elasticsearch
 from build_research_paper_index import COVID19_PAPERS_INDEX
+from index_generations import list_generation_indices
 
 
 def delete_idx(es_hosts: List[str], idx_name: str) -> None:
+    """
+    Delete every generation behind the idx_name alias (which removes the alias too) and any legacy index named idx_name
+    """
     es = Elasticsearch(hosts=es_hosts)
+    for generation_idx in list_generation_indices(es, idx_name):
+        es.indices.delete(index=generation_idx, ignore=[400, 404])
     es.indices.delete(index=idx_name, ignore=[400, 404])
 
 
@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+# extract_body_text.py
+# Body-text extraction stage of the index build.
+# PDF parses (document_parses/pdf_json) are parsed with orjson by a process pool, and only their body_text is kept,
+# in a columnar cache keyed by file path. The cache is split into buckets by hash of path, each one a Parquet file,
+# so a build only re-parses files whose size or mtime changed and only rewrites the buckets holding them.
+# The titles of each parse's bib_entries are cached alongside the body, for the citation graph of paper_quality.py.
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import orjson
+import os
+import pandas as pd
+from typing import Dict, Iterable, List, Tuple
+import zlib
+
+BODY_TEXT_CACHE_DIR = "body_text_cache/"
+BODY_TEXT_CACHE_VERSION = "2"  # Bump when the cached columns or extraction logic change
+NUM_BODY_TEXT_CACHE_BUCKETS = 64
+NUM_EXTRACTION_PROCESSES = multiprocessing.cpu_count()
+BODY_TEXT_CACHE_INDEX_COLS = ["path", "size", "mtime_ns", "num_chars"]
+
+FileStat = Tuple[int, int]  # (size, mtime_ns)
+
+
+def body_text_cache_bucket(json_path: str) -> int:
+    # Stable across processes and runs, unlike hash()
+    return zlib.crc32(json_path.encode("utf-8")) % NUM_BODY_TEXT_CACHE_BUCKETS
+
+
+def _bucket_filename(cache_dir: str, bucket: int) -> str:
+    return os.path.join(cache_dir, f"bucket_{bucket:03d}.parquet")
+
+
+def parse_pdf_json(json_path: str) -> Tuple[str, str]:
+    """
+    Body and bib titles of a PDF parse.
+    The body joins the body paragraphs, skipping the abstract (stored separately in the metadata). The bib titles are
+    the distinct non-empty titles of the parse's bib_entries, one per line.
+    """
+    with open(json_path, "rb") as paper_json:
+        full_text_dict = orjson.loads(paper_json.read())
+    body = "\n".join(
+        paragraph_dict["text"]
+        for paragraph_dict in full_text_dict["body_text"]
+        if paragraph_dict["section"].lower() != "abstract"
+    )
+    bib_titles = dict.fromkeys(
+        " ".join(bib_entry.get("title", "").split())
+        for bib_entry in full_text_dict.get("bib_entries", {}).values()
+        if bib_entry.get("title")
+    )
+    return body, "\n".join(bib_titles)
+
+
+def split_pdf_json_files(pdf_json_files: str) -> List[str]:
+    if type(pdf_json_files) is not str or not pdf_json_files:
+        return []
+    return pdf_json_files.split("; ")
+
+
+def _stat_files(json_paths: Iterable[str]) -> Dict[str, FileStat]:
+    file_stats = {}
+    for json_path in json_paths:
+        try:
+            json_stat = os.stat(json_path)
+        except FileNotFoundError:
+            print(f"Failed on {json_path}: file not found")
+            continue
+        file_stats[json_path] = (json_stat.st_size, json_stat.st_mtime_ns)
+    return file_stats
+
+
+def load_body_text_cache_index(cache_dir: str = BODY_TEXT_CACHE_DIR) -> pd.DataFrame:
+    """
+    Load every cached (path, size, mtime_ns, num_chars) entry; the body and bib_titles columns are never read here
+    """
+    bucket_indices = [
+        pd.read_parquet(_bucket_filename(cache_dir, bucket), columns=BODY_TEXT_CACHE_INDEX_COLS)
+        for bucket in range(NUM_BODY_TEXT_CACHE_BUCKETS)
+        if os.path.exists(_bucket_filename(cache_dir, bucket))
+    ]
+    if not bucket_indices:
+        return pd.DataFrame({col: pd.Series([], dtype="int64") for col in BODY_TEXT_CACHE_INDEX_COLS}).astype(
+            {"path": str}
+        )
+    return pd.concat(bucket_indices, ignore_index=True)
+
+
+def _refresh_bucket(cache_dir: str, bucket: int, stale_file_stats: Dict[str, FileStat]) -> int:
+    """
+    Parse the bucket's new or changed files and rewrite its Parquet file; runs in a worker process
+    """
+    bucket_filename = _bucket_filename(cache_dir, bucket)
+    if os.path.exists(bucket_filename):
+        cached_df = pd.read_parquet(bucket_filename)
+        cached_df = cached_df[~cached_df.path.isin(list(stale_file_stats))]
+    else:
+        cached_df = None
+
+    extracted_rows = []
+    for json_path, (size, mtime_ns) in stale_file_stats.items():
+        try:
+            body, bib_titles = parse_pdf_json(json_path)
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            print(f"Failed on {json_path} with exception: {str(e)}")
+            body, bib_titles = "", ""
+        extracted_rows.append(
+            {
+                "path": json_path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "num_chars": len(body),
+                "body": body,
+                "bib_titles": bib_titles,
+            }
+        )
+    bucket_df = pd.DataFrame(extracted_rows, columns=BODY_TEXT_CACHE_INDEX_COLS + ["body", "bib_titles"])
+    if cached_df is not None:
+        bucket_df = pd.concat([cached_df, bucket_df], ignore_index=True)
+
+    tmp_bucket_filename = f"{bucket_filename}.tmp"
+    bucket_df.to_parquet(tmp_bucket_filename, index=False)
+    os.replace(tmp_bucket_filename, bucket_filename)
+    return len(extracted_rows)
+
+
+def _check_cache_version(cache_dir: str) -> None:
+    version_filename = os.path.join(cache_dir, "VERSION")
+    if os.path.exists(version_filename):
+        with open(version_filename) as version_file:
+            if version_file.read().strip() == BODY_TEXT_CACHE_VERSION:
+                return
+    print(f"Body text cache at {cache_dir} is missing or outdated; rebuilding it")
+    for bucket in range(NUM_BODY_TEXT_CACHE_BUCKETS):
+        if os.path.exists(_bucket_filename(cache_dir, bucket)):
+            os.remove(_bucket_filename(cache_dir, bucket))
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(version_filename, "w") as version_file:
+        version_file.write(BODY_TEXT_CACHE_VERSION)
+
+
+def update_body_text_cache(
+    json_paths: Iterable[str], cache_dir: str = BODY_TEXT_CACHE_DIR, num_processes: int = NUM_EXTRACTION_PROCESSES
+) -> pd.DataFrame:
+    """
+    Make sure the cache holds the current body text of every given PDF parse and return the cache index.
+    Only files that are new or whose size or mtime changed since they were cached are parsed.
+    """
+    _check_cache_version(cache_dir)
+    file_stats = _stat_files(set(json_paths))
+    cache_index_df = load_body_text_cache_index(cache_dir)
+    cached_file_stats = dict(
+        zip(cache_index_df.path, zip(cache_index_df["size"].tolist(), cache_index_df.mtime_ns.tolist()))
+    )
+    stale_file_stats_by_bucket: Dict[int, Dict[str, FileStat]] = {}
+    for json_path, file_stat in file_stats.items():
+        if cached_file_stats.get(json_path) != file_stat:
+            stale_file_stats_by_bucket.setdefault(body_text_cache_bucket(json_path), {})[json_path] = file_stat
+    num_stale_files = sum(len(stale_file_stats) for stale_file_stats in stale_file_stats_by_bucket.values())
+    print(f"Body text cache: {len(file_stats) - num_stale_files} files cached, {num_stale_files} to parse")
+
+    if stale_file_stats_by_bucket:
+        with ProcessPoolExecutor(max_workers=num_processes) as executor:
+            list(
+                executor.map(
+                    _refresh_bucket,
+                    [cache_dir] * len(stale_file_stats_by_bucket),
+                    list(stale_file_stats_by_bucket),
+                    list(stale_file_stats_by_bucket.values()),
+                )
+            )
+        cache_index_df = load_body_text_cache_index(cache_dir)
+    return cache_index_df
+
+
+def choose_body_paths(pdf_json_files: pd.Series, num_chars_by_path: Dict[str, int]) -> pd.Series:
+    """
+    Pick each paper's first PDF parse with a non-empty body, or "" if none has one
+    """
+    return pdf_json_files.map(
+        lambda files: next(
+            (json_path for json_path in split_pdf_json_files(files) if num_chars_by_path.get(json_path, 0) > 0), ""
+        )
+    )
+
+
+def attach_body_text(df: pd.DataFrame, cache_dir: str = BODY_TEXT_CACHE_DIR) -> pd.DataFrame:
+    """
+    Look up the cached body text of the df's body_path column, reading only the cache buckets the df needs
+    """
+    bodies = []
+    body_paths = df.body_path[df.body_path != ""]
+    for bucket, bucket_paths in body_paths.groupby(body_paths.map(body_text_cache_bucket)):
+        bucket_df = pd.read_parquet(
+            _bucket_filename(cache_dir, bucket), columns=["path", "body"], filters=[("path", "in", list(bucket_paths))]
+        )
+        bodies.append(bucket_df)
+    if bodies:
+        body_by_path = pd.concat(bodies, ignore_index=True).set_index("path").body
+        body = df.body_path.map(body_by_path).fillna("")
+    else:
+        body = pd.Series("", index=df.index)
+    return df.assign(body=body).drop(columns=["body_path"])
+
+
+def load_bib_titles(json_paths: Iterable[str], cache_dir: str = BODY_TEXT_CACHE_DIR) -> Dict[str, List[str]]:
+    """
+    Cached bib titles of the given PDF parses, which must already be in the cache (see update_body_text_cache)
+    """
+    json_paths = pd.Series(sorted(set(json_paths)), dtype=object)
+    bib_titles_by_path = {}
+    for bucket, bucket_paths in json_paths.groupby(json_paths.map(body_text_cache_bucket)):
+        bucket_df = pd.read_parquet(
+            _bucket_filename(cache_dir, bucket),
+            columns=["path", "bib_titles"],
+            filters=[("path", "in", list(bucket_paths))],
+        )
+        bib_titles_by_path.update(
+            (path, bib_titles.split("\n"))
+            for path, bib_titles in zip(bucket_df.path, bucket_df.bib_titles)
+            if bib_titles
+        )
+    return bib_titles_by_path
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+# index_generations.py
+# Zero-downtime reindexing: every full build writes a new versioned index (a "generation", e.g.
+# covid19_papers_v20201212093000) that is atomically swapped behind the alias search_api queries.
+
+from datetime import datetime
+from elasticsearch import Elasticsearch, NotFoundError
+from typing import Any, Dict, List, Optional
+
+KEEP_INDEX_GENERATIONS = 2  # Live generation plus the previous one, to roll back to
+SERVING_NUMBER_OF_REPLICAS = 0  # docker-compose runs a single-node cluster, where replicas can't be allocated
+SERVING_REFRESH_INTERVAL = "1s"
+FORCEMERGE_REQUEST_TIMEOUT = 3600  # Seconds
+# Ingestion settings: no periodic refreshes and no replicas to copy every bulk request to
+BULK_LOAD_INDEX_SETTINGS = {"number_of_replicas": 0, "refresh_interval": "-1"}
+
+
+def new_generation_index_name(alias: str) -> str:
+    return f"{alias}_v{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+
+
+def list_generation_indices(es: Elasticsearch, alias: str) -> List[str]:
+    # Timestamped names sort chronologically
+    return sorted(es.indices.get(index=f"{alias}_v*", expand_wildcards="open,closed").keys())
+
+
+def _alias_targets(es: Elasticsearch, alias: str) -> List[str]:
+    try:
+        return sorted(es.indices.get_alias(name=alias).keys())
+    except NotFoundError:
+        return []
+
+
+def current_generation_index(es: Elasticsearch, alias: str) -> Optional[str]:
+    """
+    Concrete index the alias points to, or None if the alias doesn't exist yet
+    """
+    alias_targets = _alias_targets(es, alias)
+    return alias_targets[-1] if alias_targets else None
+
+
+def index_meta(es: Elasticsearch, es_idx: str) -> Dict[str, Any]:
+    """
+    _meta of a concrete index's mapping (e.g. mapping_version and generation)
+    """
+    return es.indices.get_mapping(index=es_idx)[es_idx]["mappings"].get("_meta", {})
+
+
+def create_generation_index(es: Elasticsearch, es_idx: str, index_body: Optional[Dict[str, Any]] = None) -> None:
+    index_body = dict(index_body or {})
+    index_body["settings"] = {**index_body.get("settings", {}), **BULK_LOAD_INDEX_SETTINGS}
+    es.indices.create(index=es_idx, body=index_body)
+    print(f"Created index generation {es_idx} with bulk-load settings {BULK_LOAD_INDEX_SETTINGS}")
+
+
+def finalize_generation_index(es: Elasticsearch, es_idx: str) -> None:
+    """
+    Restore serving settings after ingestion, then merge the index down to one segment per shard for faster searches
+    """
+    es.indices.put_settings(
+        index=es_idx,
+        body={"number_of_replicas": SERVING_NUMBER_OF_REPLICAS, "refresh_interval": SERVING_REFRESH_INTERVAL},
+    )
+    es.indices.refresh(index=es_idx)
+    es.indices.forcemerge(index=es_idx, max_num_segments=1, request_timeout=FORCEMERGE_REQUEST_TIMEOUT)
+    es.cluster.health(index=es_idx, wait_for_status="green", request_timeout=FORCEMERGE_REQUEST_TIMEOUT)
+    print(f"Finalized index generation {es_idx}")
+
+
+def swap_alias(es: Elasticsearch, alias: str, es_idx: str) -> None:
+    """
+    Atomically point the alias at es_idx. A legacy concrete index named like the alias is dropped in the same request.
+    """
+    actions = [{"remove": {"index": old_idx, "alias": alias}} for old_idx in _alias_targets(es, alias)]
+    if not actions and es.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": es_idx, "alias": alias}})
+    es.indices.update_aliases(body={"actions": actions})
+    print(f"Alias {alias} now points to {es_idx}")
+
+
+def delete_old_generations(es: Elasticsearch, alias: str, keep: int = KEEP_INDEX_GENERATIONS) -> List[str]:
+    live_idx = current_generation_index(es, alias)
+    old_generations = [es_idx for es_idx in list_generation_indices(es, alias) if es_idx != live_idx]
+    # The live generation counts towards the kept generations
+    expired_generations = old_generations[: max(len(old_generations) - (keep - 1), 0)]
+    for es_idx in expired_generations:
+        es.indices.delete(index=es_idx, ignore=[400, 404])
+        print(f"Deleted old index generation {es_idx}")
+    return expired_generations
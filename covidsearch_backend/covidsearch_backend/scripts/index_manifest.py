@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+# index_manifest.py
+# Bookkeeping for incremental, resumable index builds:
+# * The manifest records the content hash of every indexed paper (keyed on cord_uid), so a new CORD-19 release
+#   only reprocesses and re-uploads new or changed papers.
+# * The build checkpoint records the progress of an in-flight build, so an interrupted build resumes where it stopped.
+
+import json
+import os
+import pandas as pd
+from typing import Any, Dict, Optional
+
+MANIFEST_FILENAME = "index_manifest.parquet"
+BUILD_CHECKPOINT_FILENAME = "build_checkpoint.json"
+MANIFEST_COLS = ["cord_uid", "content_hash"]
+
+
+def empty_manifest() -> pd.DataFrame:
+    return pd.DataFrame({col: pd.Series([], dtype=str) for col in MANIFEST_COLS})
+
+
+def load_manifest(es_idx: str, manifest_filename: str = MANIFEST_FILENAME) -> pd.DataFrame:
+    """
+    Load the manifest of es_idx; a manifest recorded for another index generation is of no use and treated as empty
+    """
+    if not os.path.exists(manifest_filename):
+        return empty_manifest()
+    manifest_df = pd.read_parquet(manifest_filename, columns=MANIFEST_COLS + ["es_index"])
+    if manifest_df.empty or manifest_df.es_index.iloc[0] != es_idx:
+        return empty_manifest()
+    return manifest_df[MANIFEST_COLS]
+
+
+def save_manifest(manifest_df: pd.DataFrame, es_idx: str, manifest_filename: str = MANIFEST_FILENAME) -> None:
+    # Write then rename, so a crash never leaves a truncated manifest behind
+    tmp_manifest_filename = f"{manifest_filename}.tmp"
+    manifest_df = manifest_df[MANIFEST_COLS].reset_index(drop=True).assign(es_index=es_idx)
+    manifest_df.to_parquet(tmp_manifest_filename, index=False)
+    os.replace(tmp_manifest_filename, manifest_filename)
+
+
+def load_build_checkpoint(checkpoint_filename: str = BUILD_CHECKPOINT_FILENAME) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(checkpoint_filename):
+        return None
+    with open(checkpoint_filename) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def save_build_checkpoint(checkpoint: Dict[str, Any], checkpoint_filename: str = BUILD_CHECKPOINT_FILENAME) -> None:
+    tmp_checkpoint_filename = f"{checkpoint_filename}.tmp"
+    with open(tmp_checkpoint_filename, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(tmp_checkpoint_filename, checkpoint_filename)
+
+
+def clear_build_checkpoint(checkpoint_filename: str = BUILD_CHECKPOINT_FILENAME) -> None:
+    if os.path.exists(checkpoint_filename):
+        os.remove(checkpoint_filename)
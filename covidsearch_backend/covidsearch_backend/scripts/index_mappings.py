@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# index_mappings.py
+# Explicit, versioned mapping of the research papers index, shaped after the queries search_api runs:
+# * Full-text fields are only title, abstract and body (plus authors). title and abstract index two-word shingles
+#   (index_phrases), so the phrase clause that boosts exact matches doesn't have to walk positions.
+# * body stores offsets, so highlighting reads them from the index instead of re-analyzing multi-MB bodies.
+# * specter_embedding is a dense_vector only read by the semantic rescore script; it's kept out of _source so
+#   search responses and stored fields don't carry 768 floats per paper.
+# * Facet and sort fields are keyword-only, publish_time is a real date, and fields that are only ever returned
+#   (url, pdf_json_files, content_hash) are neither indexed nor kept in doc values.
+# * Filters of search_api (has_abstract, has_full_text, journal, publish_time) are precomputed fields, so they run as
+#   cacheable term/range filters; journal builds its global ordinals at refresh, so the facet agg doesn't have to.
+# * Static quality signals of paper_quality.py (citation_pagerank, citation_count, completeness) are rank_feature
+#   fields, which store each value as a term frequency, so rank_feature queries boost by them without doc values.
+
+from typing import Any, Dict
+
+# Bump whenever COVID19_PAPERS_MAPPING changes; a full build is needed to apply a new mapping version
+INDEX_MAPPING_VERSION = 4
+
+_STORED_ONLY_KEYWORD = {"type": "keyword", "index": False, "doc_values": False}
+
+COVID19_PAPERS_SETTINGS = {
+    # ~200k papers fit comfortably in one shard, which saves the fan-out and reduce phase of every search
+    "number_of_shards": 1,
+    # Deflate instead of LZ4 for stored fields: _source (mostly body text) shrinks a lot, at a small fetch cost
+    "codec": "best_compression",
+}
+
+COVID19_PAPERS_MAPPING = {
+    # Reject docs with unmapped fields instead of silently growing the mapping again
+    "dynamic": "strict",
+    "_meta": {"mapping_version": INDEX_MAPPING_VERSION},
+    "_source": {"excludes": ["specter_embedding"]},
+    "properties": {
+        "cord_uid": {"type": "keyword"},  # Doc id and sort tiebreaker
+        "title": {"type": "text", "index_phrases": True},
+        "abstract": {"type": "text", "index_phrases": True},
+        "body": {"type": "text", "index_options": "offsets"},
+        "authors": {"type": "text", "norms": False},
+        "publish_time": {
+            "type": "date",
+            # CORD-19 mixes full dates with bare months and years
+            "format": "yyyy-MM-dd||yyyy-MM||yyyy",
+            "ignore_malformed": True,
+        },
+        "journal": {"type": "keyword", "ignore_above": 256, "eager_global_ordinals": True},
+        "has_abstract": {"type": "boolean"},
+        "has_full_text": {"type": "boolean"},
+        "url": _STORED_ONLY_KEYWORD,
+        "pdf_json_files": _STORED_ONLY_KEYWORD,
+        "content_hash": _STORED_ONLY_KEYWORD,
+        "specter_embedding": {"type": "dense_vector", "dims": 768},  # paper_embeddings.EMBEDDING_DIMS
+        "citation_pagerank": {"type": "rank_feature"},
+        "citation_count": {"type": "rank_feature"},
+        "completeness": {"type": "rank_feature"},
+    },
+}
+
+
+def covid19_papers_index_body() -> Dict[str, Any]:
+    """
+    Body of the indices.create request for a new generation of the research papers index
+    """
+    return {"settings": dict(COVID19_PAPERS_SETTINGS), "mappings": dict(COVID19_PAPERS_MAPPING)}
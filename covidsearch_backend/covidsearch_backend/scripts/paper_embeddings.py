@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+# paper_embeddings.py
+# SPECTER embeddings of research papers (title + abstract) for semantic search.
+# CORD-19 ships precomputed SPECTER embeddings (cord_19_embeddings_<date>.csv), so the build loads those and only
+# encodes papers missing from the CSV. Queries are encoded with the same model at search time.
+# Embeddings are L2-normalized float32 rows saved as .npy next to an array of their cord_uids, so they can be mmap'd.
+
+import glob
+import numpy as np
+import os
+import pandas as pd
+from typing import Iterable, List, Optional, Set, Tuple
+
+SPECTER_MODEL_NAME = "allenai/specter"  # Model behind CORD-19's embeddings: https://github.com/allenai/specter
+EMBEDDING_DIMS = 768
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_MAX_TOKENS = 512
+EMBEDDINGS_CSV_CHUNK_ROWS = 10000
+PAPER_EMBEDDINGS_FILENAME = "paper_embeddings.npy"
+PAPER_EMBEDDING_IDS_FILENAME = "paper_embedding_ids.npy"
+
+
+class SpecterEncoder:
+    """
+    Batched SPECTER encoder; the model is loaded on first use since importing torch and loading weights is slow
+    """
+
+    def __init__(
+        self,
+        model_name: str = SPECTER_MODEL_NAME,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        num_threads: Optional[int] = None,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_threads = num_threads  # torch intra-op threads; None keeps torch's default of one per core
+        self._tokenizer = None
+        self._model = None
+
+    def _load(self) -> None:
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self._model = AutoModel.from_pretrained(self.model_name)
+        self._model.eval()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        import torch
+
+        if self._model is None:
+            self._load()
+        embeddings = np.empty((len(texts), EMBEDDING_DIMS), dtype=np.float32)
+        # Batches of similar lengths waste less compute on padding
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        with torch.no_grad():
+            for start in range(0, len(texts), self.batch_size):
+                batch_idxs = order[start : start + self.batch_size]
+                inputs = self._tokenizer(
+                    [texts[i] for i in batch_idxs],
+                    padding=True,
+                    truncation=True,
+                    max_length=EMBEDDING_MAX_TOKENS,
+                    return_tensors="pt",
+                )
+                # SPECTER embeds a paper as the final hidden state of its [CLS] token
+                embeddings[batch_idxs] = self._model(**inputs).last_hidden_state[:, 0, :].numpy()
+        return normalize_rows(embeddings)
+
+    def paper_texts(self, titles: Iterable[str], abstracts: Iterable[str]) -> List[str]:
+        if self._tokenizer is None:
+            self._load()
+        return [f"{title}{self._tokenizer.sep_token}{abstract}" for title, abstract in zip(titles, abstracts)]
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize rows in place, so cosine similarity becomes a dot product
+    """
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+    return embeddings
+
+
+def find_cord19_embeddings_csv(dataset_dir: str = ".") -> Optional[str]:
+    for pattern in ["cord_19_embeddings*.csv", "cord_19_embeddings*/cord_19_embeddings*.csv"]:
+        csv_paths = sorted(glob.glob(os.path.join(dataset_dir, pattern)))
+        if csv_paths:
+            return csv_paths[-1]
+    return None
+
+
+def load_cord19_embeddings(csv_path: str, cord_uids: Set[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the precomputed embeddings of cord_uids from CORD-19's CSV (cord_uid followed by EMBEDDING_DIMS floats)
+    """
+    ids, embeddings = [], []
+    dtypes = {0: str, **{col: np.float32 for col in range(1, EMBEDDING_DIMS + 1)}}
+    for chunk_df in pd.read_csv(csv_path, header=None, dtype=dtypes, chunksize=EMBEDDINGS_CSV_CHUNK_ROWS):
+        chunk_df = chunk_df[chunk_df[0].isin(cord_uids)].drop_duplicates(subset=[0])
+        ids.append(chunk_df[0].to_numpy(dtype=object))
+        embeddings.append(chunk_df.iloc[:, 1:].to_numpy(dtype=np.float32))
+    if not ids:
+        return np.empty(0, dtype=object), np.empty((0, EMBEDDING_DIMS), dtype=np.float32)
+    return np.concatenate(ids), normalize_rows(np.concatenate(embeddings))
+
+
+def load_paper_embeddings(embeddings_dir: str, mmap: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load (cord_uids, embeddings); the embeddings matrix is memory-mapped unless mmap is False
+    """
+    ids = np.load(os.path.join(embeddings_dir, PAPER_EMBEDDING_IDS_FILENAME))
+    embeddings = np.load(os.path.join(embeddings_dir, PAPER_EMBEDDINGS_FILENAME), mmap_mode="r" if mmap else None)
+    return ids, embeddings
+
+
+def save_paper_embeddings(embeddings_dir: str, ids: np.ndarray, embeddings: np.ndarray) -> None:
+    os.makedirs(embeddings_dir, exist_ok=True)
+    # Fixed-width unicode ids load without pickle; write then rename, so the search API never mmaps a partial file
+    for filename, array in [(PAPER_EMBEDDING_IDS_FILENAME, ids.astype(str)), (PAPER_EMBEDDINGS_FILENAME, embeddings)]:
+        tmp_path = os.path.join(embeddings_dir, f"{filename}.tmp")
+        with open(tmp_path, "wb") as array_file:
+            np.save(array_file, array, allow_pickle=False)
+        os.replace(tmp_path, os.path.join(embeddings_dir, filename))
+
+
+def build_paper_embeddings(
+    papers_df: pd.DataFrame,
+    embeddings_dir: str,
+    embeddings_csv: Optional[str] = None,
+    changed_ids: Optional[Set[str]] = None,
+    encoder: Optional[SpecterEncoder] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Assemble the embeddings of every paper in papers_df (cord_uid, title, abstract) and save them in embeddings_dir.
+    Embeddings come from CORD-19's CSV, else from the previous build unless the paper changed (changed_ids=None means
+    every paper may have changed), else they're encoded with SPECTER.
+    """
+    cord_uids = set(papers_df.cord_uid)
+    id_chunks, embedding_chunks = [], []
+    if embeddings_csv is not None:
+        csv_ids, csv_embeddings = load_cord19_embeddings(embeddings_csv, cord_uids)
+        id_chunks.append(csv_ids)
+        embedding_chunks.append(csv_embeddings)
+        print(f"Loaded {len(csv_ids)} precomputed embeddings from {embeddings_csv}")
+    else:
+        print("No CORD-19 embeddings CSV found; skipping precomputed embeddings")
+    found_ids = set(np.concatenate(id_chunks)) if id_chunks else set()
+
+    if changed_ids is not None and os.path.exists(os.path.join(embeddings_dir, PAPER_EMBEDDINGS_FILENAME)):
+        prev_ids, prev_embeddings = load_paper_embeddings(embeddings_dir, mmap=False)
+        skip_ids = found_ids | changed_ids
+        reusable = np.array([cord_uid in cord_uids and cord_uid not in skip_ids for cord_uid in prev_ids], dtype=bool)
+        id_chunks.append(prev_ids[reusable])
+        embedding_chunks.append(prev_embeddings[reusable])
+        found_ids |= set(prev_ids[reusable])
+
+    missing_df = papers_df[~papers_df.cord_uid.isin(found_ids)].drop_duplicates(subset=["cord_uid"])
+    if not missing_df.empty:
+        print(f"Encoding {len(missing_df)} papers without precomputed embeddings with {SPECTER_MODEL_NAME}")
+        encoder = encoder or SpecterEncoder()
+        id_chunks.append(missing_df.cord_uid.to_numpy(dtype=object))
+        embedding_chunks.append(encoder.encode(encoder.paper_texts(missing_df.title, missing_df.abstract)))
+
+    ids = np.concatenate(id_chunks) if id_chunks else np.empty(0, dtype=object)
+    embeddings = np.concatenate(embedding_chunks) if embedding_chunks else np.empty((0, EMBEDDING_DIMS), np.float32)
+    save_paper_embeddings(embeddings_dir, ids, embeddings)
+    return ids, embeddings
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+# paper_quality.py
+# Static, query-independent quality signals of research papers, indexed as rank_feature fields:
+# * citation_pagerank and citation_count: PageRank and in-degree of each paper in CORD-19's own citation graph.
+#   Citations are the bib_entries of the PDF parses (cached by extract_body_text.py), resolved to papers of the corpus
+#   by normalized title. The graph is a CSR adjacency matrix, and PageRank is a power iteration of sparse mat-vecs.
+# * completeness: how many of abstract, url and full text a paper has.
+# search_api adds a rank_feature clause per field to its lexical query, which ES scores from the field's postings,
+# so boosting by quality costs about as much as matching one more term.
+
+from datetime import datetime
+from extract_body_text import split_pdf_json_files
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import scipy.sparse as sp
+import shutil
+from typing import Any, Dict, List, Tuple
+
+PAPER_QUALITY_DIR = "paper_quality/"  # Written to the dataset dir, like the body text cache
+PAPER_QUALITY_META_FILENAME = "paper_quality.json"
+PAPER_QUALITY_FILENAMES = {
+    "ids": "citation_ids.npy",
+    "pagerank": "citation_pagerank.npy",  # Scaled by the number of papers, so the average paper has a rank of 1
+    "counts": "citation_counts.npy",
+}
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-6  # L1 change of the (unscaled) ranks at which the iteration stops
+PAGERANK_MAX_ITERATIONS = 100
+MIN_TITLE_WORDS = 3  # Shorter titles ("Introduction", "Coronavirus") match papers by chance
+WORD_PATTERN = re.compile(r"(?u)\b\w+\b")
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(WORD_PATTERN.findall(title.lower()))
+
+
+def citation_edges(papers_df: pd.DataFrame, bib_titles_by_path: Dict[str, List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (citing, cited) row numbers in papers_df (title, pdf_json_files) of every citation between two of its papers.
+    A paper cites another if a bib title of any of its PDF parses is the other's title, once normalized.
+    """
+    rows_by_title: Dict[str, int] = {}
+    ambiguous_titles = set()
+    for row, title in enumerate(papers_df.title.map(normalize_title)):
+        if len(title.split()) < MIN_TITLE_WORDS:
+            continue
+        if title in rows_by_title:
+            ambiguous_titles.add(title)
+        rows_by_title.setdefault(title, row)
+    # A title shared by several papers (editorials, errata, ...) can't tell which one is cited
+    for title in ambiguous_titles:
+        del rows_by_title[title]
+
+    normalized_titles: Dict[str, str] = {}  # Popular references are cited by thousands of papers
+    citing, cited = [], []
+    for row, pdf_json_files in enumerate(papers_df.pdf_json_files):
+        cited_rows = set()
+        for json_path in split_pdf_json_files(pdf_json_files):
+            for bib_title in bib_titles_by_path.get(json_path, []):
+                if bib_title not in normalized_titles:
+                    normalized_titles[bib_title] = normalize_title(bib_title)
+                cited_rows.add(rows_by_title.get(normalized_titles[bib_title]))
+        cited_rows -= {None, row}
+        citing.extend([row] * len(cited_rows))
+        cited.extend(cited_rows)
+    return np.array(citing, dtype=np.int64), np.array(cited, dtype=np.int64)
+
+
+def pagerank(graph: sp.csr_matrix) -> Tuple[np.ndarray, int]:
+    """
+    PageRank of every node of graph (a CSR adjacency matrix, one row of out-links per node) and the iterations it took.
+    Dangling nodes (that cite nothing) spread their rank over all nodes.
+    """
+    num_nodes = graph.shape[0]
+    if num_nodes == 0:
+        return np.empty(0, dtype=np.float64), 0
+    out_degrees = np.asarray(graph.sum(axis=1), dtype=np.float64).ravel()
+    dangling = out_degrees == 0
+    inverse_out_degrees = np.divide(1.0, out_degrees, out=np.zeros(num_nodes), where=~dangling)
+    # Transposed once, so each iteration is a single CSR mat-vec that pulls rank along in-links
+    transitions = (sp.diags(inverse_out_degrees) @ graph).T.tocsr()
+    ranks = np.full(num_nodes, 1.0 / num_nodes)
+    for iteration in range(1, PAGERANK_MAX_ITERATIONS + 1):
+        next_ranks = transitions @ ranks
+        next_ranks += ranks[dangling].sum() / num_nodes
+        next_ranks = PAGERANK_DAMPING * next_ranks + (1 - PAGERANK_DAMPING) / num_nodes
+        delta = np.abs(next_ranks - ranks).sum()
+        ranks = next_ranks
+        if delta < PAGERANK_TOLERANCE:
+            break
+    return ranks, iteration
+
+
+def build_paper_quality(
+    papers_df: pd.DataFrame, bib_titles_by_path: Dict[str, List[str]], output_dir: str = PAPER_QUALITY_DIR
+) -> Dict[str, Any]:
+    """
+    Compute the citation PageRank and count of every paper of papers_df (cord_uid, title, pdf_json_files) and save
+    them to output_dir. The new signals are written next to the old ones and swapped in once complete.
+    """
+    papers_df = papers_df.drop_duplicates(subset=["cord_uid"]).reset_index(drop=True)
+    num_papers = len(papers_df)
+    citing, cited = citation_edges(papers_df, bib_titles_by_path)
+    graph = sp.csr_matrix((np.ones(len(citing), dtype=np.float32), (citing, cited)), shape=(num_papers, num_papers))
+    ranks, num_iterations = pagerank(graph)
+    citation_counts = np.bincount(cited, minlength=num_papers).astype(np.int32)
+
+    next_output_dir = f"{output_dir.rstrip('/')}_next/"
+    shutil.rmtree(next_output_dir, ignore_errors=True)
+    os.makedirs(next_output_dir)
+    arrays = {
+        "ids": papers_df.cord_uid.to_numpy().astype(str),
+        "pagerank": (ranks * num_papers).astype(np.float32),
+        "counts": citation_counts,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(next_output_dir, PAPER_QUALITY_FILENAMES[name]), array, allow_pickle=False)
+    meta = {
+        "built_at": datetime.utcnow().strftime("%Y%m%d%H%M%S%f"),
+        "num_papers": num_papers,
+        "num_citations": len(citing),
+        "num_cited_papers": int(np.count_nonzero(citation_counts)),
+        "pagerank_iterations": num_iterations,
+    }
+    with open(os.path.join(next_output_dir, PAPER_QUALITY_META_FILENAME), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(next_output_dir, output_dir)
+    print(f"Built paper quality signals in {output_dir}: {meta}")
+    return meta
+
+
+def load_citation_signals(quality_dir: str = PAPER_QUALITY_DIR) -> Dict[str, Tuple[float, int]]:
+    """
+    (PageRank, citation count) of every paper that's cited at least once
+    """
+    arrays = {
+        name: np.load(os.path.join(quality_dir, filename)) for name, filename in PAPER_QUALITY_FILENAMES.items()
+    }
+    cited = arrays["counts"] > 0
+    return dict(
+        zip(arrays["ids"][cited].tolist(), zip(arrays["pagerank"][cited].tolist(), arrays["counts"][cited].tolist()))
+    )
+
+
+def paper_completeness(record: Dict[str, Any]) -> int:
+    """
+    How many of abstract, url and full text the paper of record has (missing ones were filled in with "")
+    """
+    return int(bool(record.get("abstract"))) + int(bool(record.get("url"))) + int(bool(record.get("has_full_text")))
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+
+# rss_crawler.py
+# Crawls RSS feeds and the text of their articles concurrently:
+# * One pooled aiohttp session for every request, with a semaphore per host so no site gets more than
+#   RSS_CRAWL_MAX_REQUESTS_PER_HOST requests at once while other hosts keep being crawled.
+# * Conditional GETs: the ETag/Last-Modified validators of every fetched feed and article are persisted, so unchanged
+#   feeds and articles come back as empty 304s and are skipped.
+# * Parsing happens off the event loop: feedparser in a thread, BeautifulSoup (html5lib, pure Python and slow) in a
+#   process pool, so the loop only waits on the network.
+
+import aiohttp
+import asyncio
+from bs4 import BeautifulSoup
+from concurrent.futures import Executor, ProcessPoolExecutor
+import feedparser
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+RSS_CRAWL_MAX_CONNECTIONS = 64
+RSS_CRAWL_MAX_REQUESTS_PER_HOST = 8
+RSS_CRAWL_TIMEOUT = 30  # Seconds per request
+RSS_HTTP_CACHE_FILENAME = "rss_http_cache.json"
+NUM_HTML_PARSING_PROCESSES = os.cpu_count() or 1
+
+
+class ConditionalGetCache:
+    """
+    ETag/Last-Modified validators of fetched URLs, persisted as JSON between crawls
+    """
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        try:
+            with open(cache_path) as cache_file:
+                self.validators: Dict[str, Dict[str, str]] = json.load(cache_file)
+        except FileNotFoundError:
+            self.validators = {}
+
+    def request_headers(self, url: str) -> Dict[str, str]:
+        validators = self.validators.get(url, {})
+        headers = {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def update(self, url: str, response_headers: Any) -> None:
+        validators = {}
+        if "ETag" in response_headers:
+            validators["etag"] = response_headers["ETag"]
+        if "Last-Modified" in response_headers:
+            validators["last_modified"] = response_headers["Last-Modified"]
+        if validators:
+            self.validators[url] = validators
+
+    def save(self) -> None:
+        tmp_cache_path = f"{self.cache_path}.tmp"
+        with open(tmp_cache_path, "w") as cache_file:
+            json.dump(self.validators, cache_file)
+        os.replace(tmp_cache_path, self.cache_path)
+
+
+class RssCrawler:
+    """
+    Shared state of one crawl: pooled session, per-host semaphores, conditional GET cache, HTML parsing pool and stats
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, http_cache: ConditionalGetCache, html_executor: Executor):
+        self.session = session
+        self.http_cache = http_cache
+        self.html_executor = html_executor
+        self.stats = {
+            "feeds_fetched": 0,
+            "feeds_unchanged": 0,
+            "articles_written": 0,
+            "articles_unchanged": 0,
+            "articles_without_body": 0,
+            "requests_failed": 0,
+        }
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(RSS_CRAWL_MAX_REQUESTS_PER_HOST)
+        return self._host_semaphores[host]
+
+    async def fetch(self, url: str) -> Tuple[Optional[bytes], Any]:
+        """
+        Body and headers of url, or a None body if it hasn't changed since the last crawl (304)
+        """
+        async with self._host_semaphore(url):
+            async with self.session.get(url, headers=self.http_cache.request_headers(url)) as response:
+                if response.status == 304:
+                    return None, response.headers
+                response.raise_for_status()
+                return await response.read(), response.headers
+
+
+def extract_article_paragraphs(article_html: bytes, feed_scrape_tag: str) -> List[str]:
+    """
+    Paragraphs of the article's body divs; runs in the HTML parsing process pool
+    """
+    soup_article = BeautifulSoup(article_html, "html5lib")
+    article_bodies = soup_article.find_all("div", class_=re.compile(feed_scrape_tag))
+    return [paragraph.get_text() for article_body in article_bodies for paragraph in article_body.find_all("p")]
+
+
+def article_text_path(feed_dir: str, feed_title: str, page_title: str) -> str:
+    page_title_filename = f"{page_title.replace(' ', '_').replace('/', '_')}.txt"
+    return os.path.join(feed_dir, feed_title, page_title_filename)
+
+
+async def _scrape_article_text(
+    crawler: RssCrawler, feed_dir: str, feed_title: str, feed_scrape_tag: str, page_title: str, page_url: str
+) -> bool:
+    """
+    Save the text of a new or changed article; False if it couldn't be fetched
+    """
+    text_path = article_text_path(feed_dir, feed_title, page_title)
+    try:
+        article_html, headers = await crawler.fetch(page_url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        print(f"Failed to fetch article {page_title} at {page_url}: {exc!r}")
+        crawler.stats["requests_failed"] += 1
+        return False
+    if article_html is None:
+        crawler.stats["articles_unchanged"] += 1
+        return True
+
+    loop = asyncio.get_running_loop()
+    paragraphs = await loop.run_in_executor(
+        crawler.html_executor, extract_article_paragraphs, article_html, feed_scrape_tag
+    )
+    if not paragraphs:
+        print(f"Could not find article body for {page_title} at {page_url}")
+        crawler.stats["articles_without_body"] += 1
+        return True
+    os.makedirs(os.path.dirname(text_path), exist_ok=True)
+    with open(text_path, "w+") as article_text_file:
+        article_text_file.writelines(f"{paragraph_text}\n" for paragraph_text in paragraphs)
+    # Only remember the validators once the article is saved, so a failed article is fetched again next time
+    crawler.http_cache.update(page_url, headers)
+    crawler.stats["articles_written"] += 1
+    return True
+
+
+async def _crawl_feed(
+    crawler: RssCrawler, feed_dir: str, feed_data_file: Any, feed: str, rss_url: str, feed_scrape_tag: str
+) -> None:
+    try:
+        rss_content, headers = await crawler.fetch(rss_url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        print(f"Failed to fetch feed {feed} at {rss_url}: {exc!r}")
+        crawler.stats["requests_failed"] += 1
+        return
+    if rss_content is None:
+        crawler.stats["feeds_unchanged"] += 1
+        return
+    rss_parsed = await asyncio.get_running_loop().run_in_executor(None, feedparser.parse, rss_content)
+    crawler.stats["feeds_fetched"] += 1
+    feed_data_file.write(f"Feed: {feed}\n")
+    feed_data_file.write(json.dumps(rss_parsed, indent=4, default=str))
+
+    feed_title = rss_parsed["feed"].get("title", feed)
+    articles_scraped = await asyncio.gather(
+        *[
+            _scrape_article_text(
+                crawler, feed_dir, feed_title, feed_scrape_tag, feed_entry["title"], feed_entry["link"]
+            )
+            for feed_entry in rss_parsed["entries"]
+            if "title" in feed_entry and "link" in feed_entry
+        ]
+    )
+    # A feed is only skipped as unchanged once every one of its articles has been fetched
+    if all(articles_scraped):
+        crawler.http_cache.update(rss_url, headers)
+
+
+async def crawl_rss_feeds(
+    feeds: Dict[str, str],
+    feeds_scrape_tag: Dict[str, str],
+    feed_dir: str,
+    feed_data_path: str,
+    http_cache_path: str = RSS_HTTP_CACHE_FILENAME,
+    html_executor: Optional[Executor] = None,
+) -> Dict[str, int]:
+    """
+    Write each feed's metadata into feed_data_path and the text of its new or changed articles into feed_dir
+    """
+    http_cache = ConditionalGetCache(http_cache_path)
+    owns_executor = html_executor is None
+    if owns_executor:
+        html_executor = ProcessPoolExecutor(max_workers=NUM_HTML_PARSING_PROCESSES)
+    connector = aiohttp.TCPConnector(limit=RSS_CRAWL_MAX_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(total=RSS_CRAWL_TIMEOUT)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            crawler = RssCrawler(session, http_cache, html_executor)
+            with open(feed_data_path, "w+") as feed_data_file:
+                await asyncio.gather(
+                    *[
+                        _crawl_feed(crawler, feed_dir, feed_data_file, feed, rss_url, feeds_scrape_tag[feed])
+                        for feed, rss_url in feeds.items()
+                    ]
+                )
+    finally:
+        http_cache.save()
+        if owns_executor:
+            html_executor.shutdown()
+    return crawler.stats
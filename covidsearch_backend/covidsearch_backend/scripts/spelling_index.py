@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+# spelling_index.py
+# Spelling correction of search queries against the corpus vocabulary, with the symmetric delete algorithm (SymSpell).
+# The build counts the terms of every paper's title + abstract. For each term that's frequent enough, it precomputes
+# every string reachable by deleting up to MAX_EDIT_DISTANCE characters from the term's prefix. At query time, the
+# deletes of a misspelled word are looked up in that table, and the candidates are verified with an edit distance.
+# No edits, insertions or transpositions are ever generated, so a lookup only costs a few dozen hash lookups.
+# The vocabulary and the delete table are plain sorted arrays, so the search API memory-maps them.
+
+import dask
+import dask.dataframe as dd
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import shutil
+from collections import Counter
+from datetime import datetime
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from typing import Any, Dict, Optional, Set, Tuple
+
+SPELLING_DIR = "spelling"  # Subdirectory of the models dir
+SPELLING_META_FILENAME = "spelling_index.json"
+SPELLING_FILENAMES = {
+    "terms": "spelling_terms.npy",  # Sorted
+    "term_counts": "spelling_term_counts.npy",
+    "delete_hashes": "spelling_delete_hashes.npy",  # Sorted
+    "delete_terms": "spelling_delete_terms.npy",  # Term of each delete
+}
+MIN_TERM_COUNT = 3  # Rarer terms are as likely to be typos as the queries they'd correct
+MAX_TERM_LENGTH = 30
+MAX_EDIT_DISTANCE = 2
+SHORT_WORD_LENGTH = 5  # Words up to this long are only corrected within edit distance 1
+MIN_CORRECTED_WORD_LENGTH = 4
+PREFIX_LENGTH = 7  # Deletes are only generated from the first characters of terms, which bounds the table's size
+WORD_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def _is_correctable(word: str) -> bool:
+    return word.isalpha() and word not in ENGLISH_STOP_WORDS
+
+
+def _partition_term_counts(df: pd.DataFrame) -> Counter:
+    term_counts: Counter = Counter()
+    for text in df.title.fillna("") + " " + df.abstract.fillna(""):
+        term_counts.update(word for word in WORD_PATTERN.findall(text.lower()) if _is_correctable(word))
+    return term_counts
+
+
+def _deletes(word: str, max_distance: int) -> Set[str]:
+    """
+    word and every string made by deleting up to max_distance of its characters
+    """
+    deletes = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1 :] for w in frontier if len(w) > 1 for i in range(len(w))}
+        deletes |= frontier
+    return deletes
+
+
+def _hash(string: str) -> int:
+    return int.from_bytes(hashlib.blake2b(string.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def build_spelling_index(papers_dd: dd, output_dir: str, scheduler: str = "processes") -> Dict[str, Any]:
+    """
+    Count the terms of papers_dd (title, abstract) and save the vocabulary and delete table to output_dir.
+    The new index is written next to the old one and swapped in once complete.
+    """
+    term_counts: Counter = Counter()
+    count_tasks = [dask.delayed(_partition_term_counts)(partition) for partition in papers_dd.to_delayed()]
+    for partition_term_counts in dask.compute(*count_tasks, scheduler=scheduler):
+        term_counts.update(partition_term_counts)
+    terms = sorted(t for t, count in term_counts.items() if count >= MIN_TERM_COUNT and len(t) <= MAX_TERM_LENGTH)
+
+    delete_hashes, delete_terms = [], []
+    for term_id, term in enumerate(terms):
+        for delete in _deletes(term[:PREFIX_LENGTH], MAX_EDIT_DISTANCE):
+            delete_hashes.append(_hash(delete))
+            delete_terms.append(term_id)
+    delete_hashes = np.array(delete_hashes, dtype=np.uint64)
+    order = np.argsort(delete_hashes, kind="stable")
+
+    next_output_dir = f"{output_dir.rstrip('/')}_next/"
+    shutil.rmtree(next_output_dir, ignore_errors=True)
+    os.makedirs(next_output_dir)
+    arrays = {
+        "terms": np.array(terms, dtype=f"<U{MAX_TERM_LENGTH}"),
+        "term_counts": np.array([term_counts[term] for term in terms], dtype=np.int64),
+        "delete_hashes": delete_hashes[order],
+        "delete_terms": np.array(delete_terms, dtype=np.int32)[order],
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(next_output_dir, SPELLING_FILENAMES[name]), array)
+    meta = {
+        "built_at": datetime.utcnow().strftime("%Y%m%d%H%M%S%f"),
+        "num_terms": len(terms),
+        "num_deletes": len(delete_hashes),
+        "max_edit_distance": MAX_EDIT_DISTANCE,
+        "prefix_length": PREFIX_LENGTH,
+    }
+    with open(os.path.join(next_output_dir, SPELLING_META_FILENAME), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(next_output_dir, output_dir)
+    print(f"Built spelling index in {output_dir}: {meta}")
+    return meta
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions), or max_distance + 1 if it's larger
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_row, row = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        previous_row, row, before_previous_row = row, [i] + [0] * len(b), previous_row
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return row[-1]
+
+
+class SpellingIndex:
+    """
+    Read-only, memory-mapped vocabulary and delete table to correct query words with
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, SPELLING_META_FILENAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        arrays = {
+            name: np.load(os.path.join(index_dir, filename), mmap_mode="r")
+            for name, filename in SPELLING_FILENAMES.items()
+        }
+        self.terms = arrays["terms"]
+        self.term_counts = arrays["term_counts"]
+        self.delete_hashes = arrays["delete_hashes"]
+        self.delete_terms = arrays["delete_terms"]
+
+    def __contains__(self, word: str) -> bool:
+        position = int(np.searchsorted(self.terms, word))
+        return position < len(self.terms) and self.terms[position] == word
+
+    def correct_word(self, word: str) -> str:
+        """
+        The most frequent term closest to word, or word itself if it's known or nothing is close enough
+        """
+        if len(word) < MIN_CORRECTED_WORD_LENGTH or len(word) > MAX_TERM_LENGTH or not _is_correctable(word):
+            return word
+        if word in self:
+            return word
+        max_distance = 1 if len(word) <= SHORT_WORD_LENGTH else self.meta["max_edit_distance"]
+        hashes = np.array([_hash(d) for d in _deletes(word[: self.meta["prefix_length"]], max_distance)], np.uint64)
+        starts = np.searchsorted(self.delete_hashes, hashes, side="left")
+        ends = np.searchsorted(self.delete_hashes, hashes, side="right")
+        candidates = np.unique(np.concatenate([self.delete_terms[start:end] for start, end in zip(starts, ends)]))
+        best: Optional[Tuple[int, int, str]] = None  # (distance, -count, term)
+        for term_id in candidates:
+            term = str(self.terms[term_id])
+            distance = edit_distance(word, term, max_distance)
+            if distance <= max_distance:
+                candidate = (distance, -int(self.term_counts[term_id]), term)
+                best = candidate if best is None else min(best, candidate)
+        return word if best is None else best[2]
+
+    def correct(self, query: str) -> str:
+        """
+        query with each misspelled word replaced by its correction; everything else is kept as is
+        """
+        return WORD_PATTERN.sub(lambda match: self.correct_word(match.group()), query)
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+# suggest_index.py
+# Prefix index behind the typeahead endpoint (/suggest/), so keystrokes don't hit the full search path.
+# Two kinds of completions are indexed, each as sorted arrays of normalized keys with a score per key:
+# * Phrases: 1 to MAX_PHRASE_WORDS word n-grams of titles that occur in at least MIN_PHRASE_COUNT titles,
+#   scored by that count.
+# * Titles, scored by publish time, so the newest papers starting with the typed prefix come first.
+# The keys of a prefix are one contiguous range of the sorted keys (found with two binary searches), and the top k of
+# the range are picked with a vectorized partial sort of its scores. Every array is memory-mapped by the search API.
+
+import dask
+import dask.dataframe as dd
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import shutil
+from collections import Counter
+from datetime import datetime
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from typing import Any, Dict, List, Tuple
+
+SUGGEST_DIR = "suggest"  # Subdirectory of the models dir
+SUGGEST_META_FILENAME = "suggest_index.json"
+SUGGEST_FILENAMES = {
+    "phrase_keys": "suggest_phrase_keys.npy",  # Sorted
+    "phrase_counts": "suggest_phrase_counts.npy",
+    "title_keys": "suggest_title_keys.npy",  # Sorted
+    "title_scores": "suggest_title_scores.npy",
+    "title_offsets": "suggest_title_offsets.npy",
+    "titles": "suggest_titles.bin",  # UTF-8 JSON of each title's paper (cord_uid, title), in key order
+}
+MAX_PHRASE_WORDS = 3
+MIN_PHRASE_COUNT = 5
+MAX_KEY_BYTES = 64  # Longer keys are truncated; prefixes longer than that are checked against the full title
+WORD_PATTERN = re.compile(r"(?u)\b\w+\b")
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercased words separated by single spaces; keys and typed prefixes are normalized alike
+    """
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def _key(text: str) -> bytes:
+    return text.encode("utf-8")[:MAX_KEY_BYTES]
+
+
+def _partition_phrase_counts(df: pd.DataFrame) -> Counter:
+    phrase_counts: Counter = Counter()
+    for title in df.title.fillna(""):
+        words = normalize(title).split()
+        # Counted once per title, so a phrase repeated in one title doesn't outrank a common one
+        phrase_counts.update(
+            {
+                " ".join(words[start : start + length])
+                for length in range(1, MAX_PHRASE_WORDS + 1)
+                for start in range(len(words) - length + 1)
+                # Phrases starting or ending with a stop word make poor completions
+                if words[start] not in ENGLISH_STOP_WORDS and words[start + length - 1] not in ENGLISH_STOP_WORDS
+            }
+        )
+    # Partitions are merged in the build's process, so drop phrases that can't be frequent enough to matter
+    return Counter({phrase: count for phrase, count in phrase_counts.items() if count > 1})
+
+
+def _partition_titles(df: pd.DataFrame) -> pd.DataFrame:
+    # publish_time is yyyy, yyyy-MM or yyyy-MM-dd, so yyyyMMdd (padded with 0s) orders papers by recency
+    publish_dates = df.publish_time.fillna("").str.replace(r"\D", "", regex=True).str[:8].str.ljust(8, "0")
+    return pd.DataFrame(
+        {
+            "key": df.title.fillna("").map(normalize),
+            "score": pd.to_numeric(publish_dates, errors="coerce").fillna(0).astype(np.float64),
+            "cord_uid": df.cord_uid,
+            "title": df.title.fillna(""),
+        }
+    )
+
+
+def build_suggest_index(papers_dd: dd, output_dir: str, scheduler: str = "processes") -> Dict[str, Any]:
+    """
+    Index the phrases and titles of papers_dd (cord_uid, title, publish_time) and save the index to output_dir.
+    The new index is written next to the old one and swapped in once complete.
+    """
+    partitions = papers_dd[["cord_uid", "title", "publish_time"]].to_delayed()
+    phrase_tasks = [dask.delayed(_partition_phrase_counts)(partition) for partition in partitions]
+    title_tasks = [dask.delayed(_partition_titles)(partition) for partition in partitions]
+    phrase_counts: Counter = Counter()
+    partition_phrase_counts, partition_titles = dask.compute(phrase_tasks, title_tasks, scheduler=scheduler)
+    for counts in partition_phrase_counts:
+        phrase_counts.update(counts)
+    phrases = sorted((_key(phrase), count) for phrase, count in phrase_counts.items() if count >= MIN_PHRASE_COUNT)
+    titles_df = pd.concat(partition_titles, ignore_index=True)
+    titles_df = titles_df[titles_df.key != ""]
+    title_keys = np.array([_key(key) for key in titles_df.key], dtype=f"S{MAX_KEY_BYTES}")
+    order = np.argsort(title_keys, kind="stable")
+    title_jsons = [
+        json.dumps({"cord_uid": cord_uid, "title": title}).encode("utf-8")
+        for cord_uid, title in zip(titles_df.cord_uid.to_numpy()[order], titles_df.title.to_numpy()[order])
+    ]
+
+    next_output_dir = f"{output_dir.rstrip('/')}_next/"
+    shutil.rmtree(next_output_dir, ignore_errors=True)
+    os.makedirs(next_output_dir)
+    arrays = {
+        "phrase_keys": np.array([key for key, _ in phrases], dtype=f"S{MAX_KEY_BYTES}"),
+        "phrase_counts": np.array([count for _, count in phrases], dtype=np.float32),
+        "title_keys": title_keys[order],
+        "title_scores": titles_df.score.to_numpy()[order],
+        "title_offsets": np.concatenate([[0], np.cumsum([len(title_json) for title_json in title_jsons])]),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(next_output_dir, SUGGEST_FILENAMES[name]), array)
+    with open(os.path.join(next_output_dir, SUGGEST_FILENAMES["titles"]), "wb") as titles_file:
+        titles_file.write(b"".join(title_jsons))
+    meta = {
+        "built_at": datetime.utcnow().strftime("%Y%m%d%H%M%S%f"),
+        "num_phrases": len(phrases),
+        "num_titles": len(title_jsons),
+    }
+    with open(os.path.join(next_output_dir, SUGGEST_META_FILENAME), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(next_output_dir, output_dir)
+    print(f"Built suggest index in {output_dir}: {meta}")
+    return meta
+
+
+def _top_k_in_range(keys: np.ndarray, scores: np.ndarray, prefix: bytes, k: int) -> List[int]:
+    """
+    Positions of the k highest scoring keys starting with prefix, best first
+    """
+    start = int(np.searchsorted(keys, prefix, side="left"))
+    # 0xff never occurs in UTF-8, so it sorts after every key starting with prefix
+    end = int(np.searchsorted(keys, prefix + b"\xff", side="left"))
+    range_scores = np.asarray(scores[start:end])
+    if len(range_scores) > k:
+        top = np.argpartition(-range_scores, k - 1)[:k]
+    else:
+        top = np.arange(len(range_scores))
+    top = top[np.lexsort((top, -range_scores[top]))]
+    return (start + top).tolist()
+
+
+class SuggestIndex:
+    """
+    Read-only, memory-mapped phrase and title completions
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, SUGGEST_META_FILENAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        arrays = {
+            name: np.load(os.path.join(index_dir, filename), mmap_mode="r")
+            for name, filename in SUGGEST_FILENAMES.items()
+            if filename.endswith(".npy")
+        }
+        self.phrase_keys = arrays["phrase_keys"]
+        self.phrase_counts = arrays["phrase_counts"]
+        self.title_keys = arrays["title_keys"]
+        self.title_scores = arrays["title_scores"]
+        self.title_offsets = arrays["title_offsets"]
+        titles_path = os.path.join(index_dir, SUGGEST_FILENAMES["titles"])
+        # np.memmap can't map an empty file
+        self.titles = np.memmap(titles_path, dtype=np.uint8, mode="r") if os.path.getsize(titles_path) else b""
+
+    def title(self, position: int) -> Dict[str, str]:
+        start, end = self.title_offsets[position], self.title_offsets[position + 1]
+        return json.loads(bytes(self.titles[start:end]).decode("utf-8"))
+
+    def suggest(self, prefix: str, k: int) -> Tuple[List[str], List[Dict[str, str]]]:
+        """
+        Top k phrases and top k papers (cord_uid, title) whose normalized phrase or title starts with prefix
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return [], []
+        key = _key(prefix)
+        phrases = [
+            self.phrase_keys[position].decode("utf-8", errors="ignore")
+            for position in _top_k_in_range(self.phrase_keys, self.phrase_counts, key, k)
+        ]
+        if len(key) < MAX_KEY_BYTES:
+            papers = [self.title(position) for position in _top_k_in_range(self.title_keys, self.title_scores, key, k)]
+        else:
+            # Truncated keys only narrow the range down; the full titles decide (such long prefixes match few titles)
+            positions = _top_k_in_range(self.title_keys, self.title_scores, key, len(self.title_keys))
+            papers = [paper for paper in map(self.title, positions) if normalize(paper["title"]).startswith(prefix)]
+            papers = papers[:k]
+        return phrases, papers
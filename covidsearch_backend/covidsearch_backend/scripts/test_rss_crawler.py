@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+# test_rss_crawler.py
+# Crawls an in-process aiohttp test server with rss_crawler.py, checking its conditional GETs and retries:
+# * Feeds and articles that are unchanged since the last crawl come back as 304s, via ETag or Last-Modified.
+# * A failed article isn't remembered, and neither is its feed, so the next crawl fetches both again.
+# Run from the scripts dir, e.g. python3 test_rss_crawler.py or python3 -m pytest test_rss_crawler.py
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from concurrent.futures import ThreadPoolExecutor
+import os
+from rss_crawler import ConditionalGetCache, crawl_rss_feeds
+import tempfile
+from typing import Dict, List, Tuple
+import unittest
+
+STUB_FEED = "stub"
+STUB_SCRAPE_TAG = "article__chunks"
+
+
+class StubSite:
+    """
+    An RSS feed and its articles, versioned per path and validated by either ETag or Last-Modified
+    """
+
+    def __init__(self, num_articles: int, validator: str):
+        self.num_articles = num_articles
+        self.validator = validator
+        self.base_url = ""
+        self.versions: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}  # Path -> number of requests still to fail with a 500
+        self.requests: List[Tuple[str, int]] = []  # (path, status) of every request
+
+    def _validator_header(self, path: str) -> Tuple[str, str]:
+        version = self.versions.get(path, 1)
+        if self.validator == "etag":
+            return "ETag", f'"{path}-v{version}"'
+        return "Last-Modified", f"Mon, {version:02d} Jun 2020 00:00:00 GMT"
+
+    def _body(self, path: str) -> str:
+        if path == "/rss":
+            items = "".join(
+                f"<item><title>article {i}</title><link>{self.base_url}/article/{i}</link></item>"
+                for i in range(self.num_articles)
+            )
+            return f'<?xml version="1.0"?><rss version="2.0"><channel><title>{STUB_FEED}</title>{items}</channel></rss>'
+        return f'<html><body><div class="{STUB_SCRAPE_TAG}"><p>Text of {path}</p></div></body></html>'
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = request.path
+        if self.failures.get(path, 0) > 0:
+            self.failures[path] -= 1
+            self.requests.append((path, 500))
+            return web.Response(status=500)
+        header, value = self._validator_header(path)
+        conditional_header = "If-None-Match" if header == "ETag" else "If-Modified-Since"
+        if request.headers.get(conditional_header) == value:
+            self.requests.append((path, 304))
+            return web.Response(status=304, headers={header: value})
+        self.requests.append((path, 200))
+        return web.Response(text=self._body(path), headers={header: value})
+
+    def statuses(self) -> Dict[int, int]:
+        """
+        Number of requests per status since the last call
+        """
+        counts: Dict[int, int] = {}
+        for _, status in self.requests:
+            counts[status] = counts.get(status, 0) + 1
+        self.requests = []
+        return counts
+
+
+class RssCrawlerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.http_cache_path = os.path.join(self.tmp_dir.name, "rss_http_cache.json")
+        self.html_executor = ThreadPoolExecutor(max_workers=2)
+
+    async def asyncTearDown(self) -> None:
+        self.html_executor.shutdown()
+        self.tmp_dir.cleanup()
+
+    async def _serve(self, site: StubSite) -> TestServer:
+        app = web.Application()
+        app.router.add_get("/{path:.*}", site.handle)
+        server = TestServer(app)
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+        site.base_url = str(server.make_url("")).rstrip("/")
+        return server
+
+    async def _crawl(self, site: StubSite) -> Dict[str, int]:
+        return await crawl_rss_feeds(
+            {STUB_FEED: f"{site.base_url}/rss"},
+            {STUB_FEED: STUB_SCRAPE_TAG},
+            os.path.join(self.tmp_dir.name, "feeds"),
+            os.path.join(self.tmp_dir.name, "feed_data.txt"),
+            http_cache_path=self.http_cache_path,
+            html_executor=self.html_executor,
+        )
+
+    async def _assert_unchanged_crawls_get_304s(self, validator: str) -> None:
+        site = StubSite(num_articles=5, validator=validator)
+        await self._serve(site)
+
+        stats = await self._crawl(site)
+        self.assertEqual(stats["feeds_fetched"], 1)
+        self.assertEqual(stats["articles_written"], 5)
+        self.assertEqual(site.statuses(), {200: 6})
+        self.assertEqual(len(ConditionalGetCache(self.http_cache_path).validators), 6)
+
+        # Nothing changed: the feed is a 304, so its articles aren't requested at all
+        stats = await self._crawl(site)
+        self.assertEqual(stats["feeds_unchanged"], 1)
+        self.assertEqual(site.statuses(), {304: 1})
+
+        # A changed feed is fetched again, but only its changed article is
+        site.versions["/rss"] = 2
+        site.versions["/article/0"] = 2
+        stats = await self._crawl(site)
+        self.assertEqual(stats["feeds_fetched"], 1)
+        self.assertEqual(stats["articles_written"], 1)
+        self.assertEqual(stats["articles_unchanged"], 4)
+        self.assertEqual(site.statuses(), {200: 2, 304: 4})
+
+    async def test_etag(self) -> None:
+        await self._assert_unchanged_crawls_get_304s("etag")
+
+    async def test_last_modified(self) -> None:
+        await self._assert_unchanged_crawls_get_304s("last_modified")
+
+    async def test_failed_article_is_retried_on_next_crawl(self) -> None:
+        site = StubSite(num_articles=3, validator="etag")
+        await self._serve(site)
+        site.failures["/article/1"] = 1
+
+        stats = await self._crawl(site)
+        self.assertEqual(stats["requests_failed"], 1)
+        self.assertEqual(stats["articles_written"], 2)
+        validators = ConditionalGetCache(self.http_cache_path).validators
+        self.assertNotIn(f"{site.base_url}/article/1", validators)
+        self.assertNotIn(f"{site.base_url}/rss", validators)
+        site.statuses()
+
+        # The feed isn't skipped as unchanged, so the failed article is fetched again; the others are 304s
+        stats = await self._crawl(site)
+        self.assertEqual(stats["feeds_fetched"], 1)
+        self.assertEqual(stats["articles_written"], 1)
+        self.assertEqual(stats["articles_unchanged"], 2)
+        self.assertEqual(site.statuses(), {200: 2, 304: 2})
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "feeds", STUB_FEED, "article_1.txt")))
+
+        # Once every article is fetched, the feed is remembered too
+        stats = await self._crawl(site)
+        self.assertEqual(stats["feeds_unchanged"], 1)
+        self.assertEqual(site.statuses(), {304: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
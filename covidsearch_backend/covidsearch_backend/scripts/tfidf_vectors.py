@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+# tfidf_vectors.py
+# Out-of-core TF-IDF vectors of research papers (title + abstract).
+# Fitting a TfidfVectorizer per Dask partition runs out of memory and gives every partition its own vocabulary, so:
+# 1. Terms are hashed into a fixed space (HashingVectorizer), so every partition and every query share one vocabulary
+#    without a fitted vocabulary dict.
+# 2. One parallel pass over the partitions sums document frequencies into the global IDF.
+# 3. A second pass writes one L2-normalized sparse CSR block per partition, which are then merged into a single CSR
+#    matrix stored as plain .npy arrays, so the search API can memory-map it.
+# The model (hashing parameters + IDF) is pickled as a plain dict.
+
+import dask
+import dask.dataframe as dd
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import scipy.sparse as sp
+import shutil
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from typing import Any, Dict, List, Tuple
+
+TFIDF_DIR = "tfidf"  # Subdirectory of the models dir
+TFIDF_MODEL_FILENAME = "tfidf_model.pk"
+TFIDF_FILENAMES = {
+    "data": "tfidf_data.npy",
+    "indices": "tfidf_indices.npy",
+    "indptr": "tfidf_indptr.npy",
+    "ids": "tfidf_ids.npy",
+}
+TFIDF_HASHING_PARAMS = {
+    "n_features": 2 ** 20,  # Few collisions for CORD-19's vocabulary, while IDF stays a 4MB array
+    "ngram_range": (1, 1),
+    "stop_words": "english",
+    "alternate_sign": False,
+    "norm": None,
+    "dtype": np.float32,
+}
+
+
+def hashing_vectorizer(tfidf_model: Dict[str, Any]) -> HashingVectorizer:
+    return HashingVectorizer(**tfidf_model["hashing_params"])
+
+
+def paper_texts(df: pd.DataFrame) -> pd.Series:
+    return df.title.fillna("") + " " + df.abstract.fillna("")
+
+
+def _partition_document_frequencies(df: pd.DataFrame, hashing_params: Dict[str, Any]) -> Tuple[np.ndarray, int]:
+    term_counts = HashingVectorizer(**hashing_params).transform(paper_texts(df))
+    return np.bincount(term_counts.indices, minlength=hashing_params["n_features"]).astype(np.int64), len(df)
+
+
+def _write_partition_block(
+    df: pd.DataFrame, tfidf_model: Dict[str, Any], blocks_dir: str, partition: int
+) -> Tuple[str, int]:
+    term_counts = hashing_vectorizer(tfidf_model).transform(paper_texts(df))
+    tfidf = normalize(term_counts.multiply(tfidf_model["idf"]).tocsr().astype(np.float32))
+    block_path = os.path.join(blocks_dir, f"block_{partition:05d}.npz")
+    sp.save_npz(block_path, tfidf, compressed=False)
+    np.save(os.path.join(blocks_dir, f"block_{partition:05d}_ids.npy"), df.cord_uid.to_numpy().astype(str))
+    return block_path, tfidf.nnz
+
+
+def _merge_blocks(blocks: List[Tuple[str, int]], output_dir: str) -> int:
+    """
+    Concatenate the per-partition CSR blocks into one memory-mappable CSR matrix, one block in memory at a time
+    """
+    total_nnz = sum(nnz for _, nnz in blocks)
+    data = np.lib.format.open_memmap(
+        os.path.join(output_dir, TFIDF_FILENAMES["data"]), mode="w+", dtype=np.float32, shape=(total_nnz,)
+    )
+    indices = np.lib.format.open_memmap(
+        os.path.join(output_dir, TFIDF_FILENAMES["indices"]), mode="w+", dtype=np.int32, shape=(total_nnz,)
+    )
+    indptrs, ids = [np.zeros(1, dtype=np.int64)], []
+    nnz_offset = 0
+    for block_path, nnz in blocks:
+        block = sp.load_npz(block_path)
+        data[nnz_offset : nnz_offset + nnz] = block.data
+        indices[nnz_offset : nnz_offset + nnz] = block.indices
+        indptrs.append(block.indptr[1:].astype(np.int64) + nnz_offset)
+        ids.append(np.load(block_path.replace(".npz", "_ids.npy")))
+        nnz_offset += nnz
+    data.flush()
+    indices.flush()
+    np.save(os.path.join(output_dir, TFIDF_FILENAMES["indptr"]), np.concatenate(indptrs))
+    all_ids = np.concatenate(ids) if ids else np.empty(0, dtype=str)
+    np.save(os.path.join(output_dir, TFIDF_FILENAMES["ids"]), all_ids)
+    return len(all_ids)
+
+
+def build_tfidf_vectors(papers_dd: dd, output_dir: str, scheduler: str = "processes") -> Dict[str, Any]:
+    """
+    Vectorize every paper of papers_dd (cord_uid, title, abstract) and save the model and vectors to output_dir.
+    The new vectors are written next to the old ones and swapped in once complete.
+    """
+    partitions = papers_dd.to_delayed()
+    document_frequency_tasks = [
+        dask.delayed(_partition_document_frequencies)(partition, TFIDF_HASHING_PARAMS) for partition in partitions
+    ]
+    document_frequencies, num_docs = np.zeros(TFIDF_HASHING_PARAMS["n_features"], dtype=np.int64), 0
+    for partition_frequencies, partition_docs in dask.compute(*document_frequency_tasks, scheduler=scheduler):
+        document_frequencies += partition_frequencies
+        num_docs += partition_docs
+    tfidf_model = {
+        "hashing_params": TFIDF_HASHING_PARAMS,
+        # Smoothed IDF, as in sklearn's TfidfVectorizer
+        "idf": (np.log((1 + num_docs) / (1 + document_frequencies)) + 1).astype(np.float32),
+        "num_docs": num_docs,
+    }
+
+    next_output_dir = f"{output_dir.rstrip('/')}_next/"
+    blocks_dir = os.path.join(next_output_dir, "blocks")
+    shutil.rmtree(next_output_dir, ignore_errors=True)
+    os.makedirs(blocks_dir)
+    block_tasks = [
+        dask.delayed(_write_partition_block)(partition, tfidf_model, blocks_dir, i)
+        for i, partition in enumerate(partitions)
+    ]
+    blocks = dask.compute(*block_tasks, scheduler=scheduler)
+    num_vectors = _merge_blocks(list(blocks), next_output_dir)
+    shutil.rmtree(blocks_dir)
+    with open(os.path.join(next_output_dir, TFIDF_MODEL_FILENAME), "wb") as model_file:
+        pickle.dump(tfidf_model, model_file)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(next_output_dir, output_dir)
+    print(f"Built TF-IDF vectors of {num_vectors} papers in {output_dir}")
+    return tfidf_model
+
+
+class TfidfVectors:
+    """
+    Read-only, memory-mapped TF-IDF vectors of the papers plus the model to vectorize queries with
+    """
+
+    def __init__(self, vectors_dir: str):
+        with open(os.path.join(vectors_dir, TFIDF_MODEL_FILENAME), "rb") as model_file:
+            self.model = pickle.load(model_file)
+        self._vectorizer = hashing_vectorizer(self.model)
+        arrays = {
+            name: np.load(os.path.join(vectors_dir, filename), mmap_mode="r")
+            for name, filename in TFIDF_FILENAMES.items()
+        }
+        self.data = arrays["data"]
+        self.indices = arrays["indices"]
+        self.indptr = np.array(arrays["indptr"])
+        self.ids = arrays["ids"]
+        self._id_order = np.argsort(self.ids)
+
+    def transform_query(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        L2-normalized TF-IDF vector of the query as (sorted term indices, weights)
+        """
+        query_vector = normalize(self._vectorizer.transform([query]).multiply(self.model["idf"]).tocsr())
+        query_vector.sort_indices()
+        return query_vector.indices, query_vector.data.astype(np.float32)
+
+    def positions(self, cord_uids: List[str]) -> np.ndarray:
+        """
+        Row of each cord_uid, or -1 if it has no vector
+        """
+        cord_uids = np.asarray(cord_uids, dtype=str)
+        sorted_positions = np.searchsorted(self.ids, cord_uids, sorter=self._id_order)
+        rows = self._id_order[np.minimum(sorted_positions, len(self._id_order) - 1)]
+        found = (sorted_positions < len(self._id_order)) & (self.ids[rows] == cord_uids)
+        return np.where(found, rows, -1)
+
+    def cosine_similarities(self, query: str, cord_uids: List[str]) -> np.ndarray:
+        """
+        Cosine similarity between the query and each paper (0 for papers without a vector)
+        """
+        query_indices, query_weights = self.transform_query(query)
+        similarities = np.zeros(len(cord_uids), dtype=np.float32)
+        if not len(query_indices) or not len(self.ids):
+            return similarities
+        for i, row in enumerate(self.positions(cord_uids)):
+            if row < 0:
+                continue
+            start, end = self.indptr[row], self.indptr[row + 1]
+            row_indices = np.asarray(self.indices[start:end])
+            # Sparse dot product: match the row's terms against the (sorted) query terms
+            matches = np.searchsorted(query_indices, row_indices)
+            matched = (matches < len(query_indices)) & (
+                query_indices[np.minimum(matches, len(query_indices) - 1)] == row_indices
+            )
+            similarities[i] = np.dot(np.asarray(self.data[start:end])[matched], query_weights[matches[matched]])
+        return similarities
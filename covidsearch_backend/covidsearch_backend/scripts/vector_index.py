@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+# vector_index.py
+# Approximate nearest neighbor (IVF) index over the paper embeddings, searched from inside the Django workers.
+# Vectors are clustered with spherical k-means; each cluster (inverted list) is stored as a contiguous slice of a
+# .npy matrix, optionally quantized to int8 with a per-row scale. Every file is memory-mapped, so all workers of a
+# machine share the same pages through the OS page cache instead of each loading a copy.
+# A query scans the centroids, then only the nprobe closest lists, so the cost grows with ~sqrt(# papers).
+
+import json
+import numpy as np
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+ANN_DIR = "ann"  # Subdirectory of the models dir
+ANN_INDEX_META_FILENAME = "ann_index.json"
+ANN_FILENAMES = {
+    "centroids": "ann_centroids.npy",
+    "list_offsets": "ann_list_offsets.npy",
+    "vectors": "ann_vectors.npy",
+    "scales": "ann_scales.npy",
+    "ids": "ann_ids.npy",
+}
+KMEANS_NUM_ITERATIONS = 10
+KMEANS_TRAINING_VECTORS_PER_LIST = 64  # Enough to place centroids well without clustering the whole corpus
+ASSIGNMENT_BATCH_SIZE = 8192
+DEFAULT_NPROBE = 16
+
+
+def default_num_lists(num_vectors: int) -> int:
+    # IVF rule of thumb: ~sqrt(n) lists of ~sqrt(n) vectors each balances the centroid scan against the list scans
+    return max(1, int(np.sqrt(num_vectors)))
+
+
+def _assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Closest centroid by dot product (vectors and centroids are L2-normalized), computed in batches to bound memory
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGNMENT_BATCH_SIZE):
+        batch = np.asarray(vectors[start : start + ASSIGNMENT_BATCH_SIZE], dtype=np.float32)
+        assignments[start : start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors: np.ndarray, num_lists: int, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means (Lloyd's iterations on unit vectors) over a sample of the vectors.
+    num_lists is capped at the number of vectors, since every centroid is seeded with a distinct vector.
+    """
+    if not len(vectors):
+        raise ValueError("Can't train centroids without vectors")
+    num_lists = min(num_lists, len(vectors))
+    rng = np.random.default_rng(seed)
+    num_training = min(len(vectors), num_lists * KMEANS_TRAINING_VECTORS_PER_LIST)
+    training = np.asarray(vectors[np.sort(rng.choice(len(vectors), num_training, replace=False))], dtype=np.float32)
+    centroids = training[rng.choice(num_training, num_lists, replace=False)].copy()
+    for _ in range(KMEANS_NUM_ITERATIONS):
+        assignments = _assign_to_centroids(training, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=num_lists)
+        # Re-seed empty clusters with random training vectors
+        sums = training[rng.choice(num_training, num_lists)]
+        nonempty = counts > 0
+        sums[nonempty] = np.add.reduceat(training[order], (np.cumsum(counts) - counts)[nonempty], axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row int8 quantization: row ~= int8_row * scale
+    """
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def build_vector_index(
+    ids: np.ndarray,
+    embeddings: np.ndarray,
+    index_dir: str,
+    num_lists: Optional[int] = None,
+    quantize: bool = False,
+) -> Dict:
+    """
+    Build an IVF index of L2-normalized embeddings (rows aligned with ids) and save it in index_dir.
+    The new index is written next to the old one and swapped in once complete.
+    """
+    num_lists = min(num_lists or default_num_lists(len(embeddings)), len(embeddings))
+    centroids = train_centroids(embeddings, num_lists)
+    assignments = _assign_to_centroids(embeddings, centroids)
+    # Lay each inverted list out contiguously, so probing a list reads one slice of the mmap'd matrix
+    order = np.argsort(assignments, kind="stable")
+    list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=num_lists), out=list_offsets[1:])
+    vectors = np.asarray(embeddings, dtype=np.float32)[order]
+    if quantize:
+        vectors, scales = quantize_int8(vectors)
+    else:
+        scales = np.ones(len(vectors), dtype=np.float32)
+
+    next_index_dir = f"{index_dir.rstrip('/')}_next/"
+    shutil.rmtree(next_index_dir, ignore_errors=True)
+    os.makedirs(next_index_dir)
+    arrays = {
+        "centroids": centroids,
+        "list_offsets": list_offsets,
+        "vectors": vectors,
+        "scales": scales,
+        "ids": np.asarray(ids).astype(str)[order],
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(next_index_dir, ANN_FILENAMES[name]), array, allow_pickle=False)
+    meta = {
+        "num_vectors": int(len(vectors)),
+        "dims": int(centroids.shape[1]),
+        "num_lists": int(num_lists),
+        "quantization": "int8" if quantize else "float32",
+    }
+    with open(os.path.join(next_index_dir, ANN_INDEX_META_FILENAME), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    # Swapped in as a whole, so a reader never sees the arrays of two builds
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.rename(next_index_dir, index_dir)
+    print(f"Built ANN index in {index_dir}: {meta}")
+    return meta
+
+
+class VectorIndex:
+    """
+    Read-only, memory-mapped IVF index
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, ANN_INDEX_META_FILENAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        arrays = {
+            name: np.load(os.path.join(index_dir, filename), mmap_mode="r") for name, filename in ANN_FILENAMES.items()
+        }
+        # Centroids and offsets are small and read by every query, so keep them in memory
+        self.centroids = np.array(arrays["centroids"])
+        self.list_offsets = np.array(arrays["list_offsets"])
+        self.vectors = arrays["vectors"]
+        self.scales = arrays["scales"]
+        self.ids = arrays["ids"]
+        self._id_order = np.argsort(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, cord_uid: str) -> Optional[int]:
+        i = np.searchsorted(self.ids, cord_uid, sorter=self._id_order)
+        if i < len(self._id_order) and self.ids[self._id_order[i]] == cord_uid:
+            return int(self._id_order[i])
+        return None
+
+    def vector(self, position: int) -> np.ndarray:
+        return np.asarray(self.vectors[position], dtype=np.float32) * self.scales[position]
+
+    def search(
+        self, query_vector: np.ndarray, k: int, nprobe: int = DEFAULT_NPROBE, exclude_position: Optional[int] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Approximate top k (cord_uid, cosine similarity) for an L2-normalized query vector
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        probed_lists = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+        candidate_scores, candidate_positions = [], []
+        for list_idx in probed_lists:
+            start, end = self.list_offsets[list_idx], self.list_offsets[list_idx + 1]
+            if start == end:
+                continue
+            list_vectors = np.asarray(self.vectors[start:end], dtype=np.float32)
+            candidate_scores.append((list_vectors @ query_vector) * self.scales[start:end])
+            candidate_positions.append(np.arange(start, end))
+        if not candidate_scores:
+            return []
+        scores = np.concatenate(candidate_scores)
+        positions = np.concatenate(candidate_positions)
+        if exclude_position is not None:
+            scores[positions == exclude_position] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(str(self.ids[positions[i]]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def similar(self, cord_uid: str, k: int, nprobe: int = DEFAULT_NPROBE) -> Optional[List[Tuple[str, float]]]:
+        """
+        Approximate top k papers most similar to cord_uid, or None if cord_uid isn't in the index
+        """
+        position = self.position(cord_uid)
+        if position is None:
+            return None
+        return self.search(self.vector(position), k, nprobe, exclude_position=position)
+
+
+def exact_search(embeddings: np.ndarray, query_vector: np.ndarray, k: int) -> np.ndarray:
+    """
+    Brute-force top k rows by dot product; ground truth for benchmarking the ANN index
+    """
+    scores = embeddings @ np.asarray(query_vector, dtype=np.float32)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
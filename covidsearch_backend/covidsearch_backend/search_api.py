@@ -1,110 +1,870 @@
 import asyncio
+import base64
+import binascii
 import json
-import logging
-import os
+import re
+import time
+from datetime import datetime
 
-from django.http import HttpRequest, HttpResponseNotAllowed, JsonResponse
-from elasticsearch import Elasticsearch, AsyncElasticsearch
-from sklearn.feature_extraction.text import TfidfVectorizer
-from typing import Any, Dict, List, Optional, Tuple, Union
+from django.conf import settings
+from django.http import HttpRequest, HttpResponseNotAllowed, JsonResponse, QueryDict, StreamingHttpResponse
+from elasticsearch import AsyncElasticsearch, NotFoundError, TransportError
+from elasticsearch import ConnectionError as ElasticsearchConnectionError
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from .admission import Overloaded, admit, coalesced, es_overloaded, sheds_load
+from .bm25_search import bm25_generation, bm25_index_available, bm25_search
+from .es_client import es_client
+from .metrics import (
+    BM25_FALLBACKS,
+    RESULT_SHAPING_SECONDS,
+    SEARCH_HITS,
+    SERIALIZATION_SECONDS,
+    instrumented_view,
+    observe_es,
+    timed,
+)
+from .search_cache import get_cached_results, index_generation, search_cache_key, set_cached_results
+from .semantic_search import encode_query
+from .spelling import correct_query
+from .suggest import suggest_index_available, suggestions
+from .tfidf_search import tfidf_similarities, tfidf_vectors_available
+from .vector_search import nearest_papers, similar_papers, vector_index_available
 
 NUM_INITIAL_SEARCH_RESULTS = 20
+MAX_SEARCH_RESULTS_SIZE = 100
+ES_MAX_RESULT_WINDOW = 10000  # index.max_result_window; deeper pages must use search_after cursors
+# Only ship what a results page needs; full bodies are fetched on demand from /paper/<cord_uid>/
+SEARCH_RESULT_FIELDS = ["cord_uid", "title", "authors", "abstract", "url", "publish_time", "journal"]
+PAPER_EXCLUDED_FIELDS = ["pdf_json_files"]
+# cord_uid tiebreaker gives every hit a unique sort key, which search_after cursors rely on
+SEARCH_SORT = ["_score", {"cord_uid": "asc"}]
+SEARCH_MODES = ["lexical", "semantic", "knn", "tfidf"]
+BATCH_SEARCH_MODES = ["lexical", "semantic"]  # Modes that run entirely in one ES search, so they fit in an _msearch
+FUZZY_SEARCH_MODES = ["lexical", "semantic"]
+NUM_SIMILAR_PAPERS = 10
+NUM_SUGGESTIONS = 5
+MAX_SUGGESTIONS = 20
+PUBLISH_TIME_FORMAT = "yyyy-MM-dd||yyyy-MM||yyyy"  # Format of the publish_time mapping
+# Partial dates cover their whole year, month or day: the range rounds from_date down and to_date up to the unit
+PUBLISH_TIME_ROUNDING = {len("yyyy"): "y", len("yyyy-MM"): "M", len("yyyy-MM-dd"): "d"}
+PUBLISH_TIME_PATTERN = re.compile(r"^\d{4}(-\d{2}(-\d{2})?)?$")
+PUBLISH_TIME_STRPTIME_FORMATS = {len("yyyy"): "%Y", len("yyyy-MM"): "%Y-%m", len("yyyy-MM-dd"): "%Y-%m-%d"}
+BOOLEAN_FILTER_FIELDS = ["has_abstract", "has_full_text"]
+NUM_JOURNAL_FACETS = 20
+SEARCH_AGGREGATIONS = {
+    "journal": {"terms": {"field": "journal", "size": NUM_JOURNAL_FACETS, "exclude": [""]}},
+    "publish_year": {
+        "date_histogram": {
+            "field": "publish_time",
+            "calendar_interval": "year",
+            "format": "yyyy",
+            "min_doc_count": 1,
+            "order": {"_key": "desc"},
+        }
+    },
+    "has_abstract": {"terms": {"field": "has_abstract"}},
+    "has_full_text": {"terms": {"field": "has_full_text"}},
+}
+# Cosine similarity shifted to be non-negative, as script scores must be; papers without an embedding sink to the bottom
+SEMANTIC_RESCORE_SCRIPT = (
+    "doc['specter_embedding'].size() == 0 ? 0 : cosineSimilarity(params.query_vector, 'specter_embedding') + 1.0"
+)
+SEARCH_HIGHLIGHT = {
+    "pre_tags": ["<em>"],
+    "post_tags": ["</em>"],
+    "fields": {
+        "title": {"number_of_fragments": 0},
+        "abstract": {"fragment_size": 200, "number_of_fragments": 2},
+        "body": {"fragment_size": 200, "number_of_fragments": 3},
+    },
+}
+
+_es_unreachable_until = 0.0  # Monotonic time; until then, searches go straight to the BM25 fallback
+
+
+def _encode_cursor(sort_values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode("utf-8")).decode("ascii")
 
 
-async def _search_elasticsearch_index(hosts: List[str], index: str, query: str) -> List[Dict]:
+def _decode_cursor(cursor: str) -> List[Any]:
+    try:
+        sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(sort_values, list) or len(sort_values) != len(SEARCH_SORT):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return sort_values
+
+
+def _parse_paging_params(params: QueryDict) -> Tuple[int, int, Optional[List[Any]]]:
     """
-    Asynchronous method to search papers in elasticsearch
+    Parse from/size (offset pagination) or cursor (search_after pagination) query params
     """
     try:
-        es = AsyncElasticsearch(hosts=hosts)
-        # Simple search by title
-        search_tasks = []
-        # title_match_query = {"match": {"title": {"query": query}}}
-        fuzzy_multimatch_query = {
-            "multi_match": {
-                "query": query,
-                "fields": ["title^2", "abstract", "body"],
-                "fuzziness": "AUTO",
-                "operator": "AND",
-            }
-        }
-        # Searching embeddings on Elasticsearch: https://www.elastic.co/blog/text-similarity-search-with-vectors-in-elasticsearch
-        # TODO: Modify below query to use with preprocessed embeddings from build_research_paper_index script
-        # Use source: https://sci2lab.github.io/ml_tutorial/tfidf/#Extra-Resources
-        """
-        tfidf_vectorizer = pickle.load(open("models/tfidf_title_vectorizer.pickle", "rb"))
-        query_vector = tfidf_vectorizer.transform(query)
-        script_query = {
-            "script_score": {
-                "query": {
-                    "match_all": {}
-                },  # TODO: Maybe replace with fuzzy_multimatch_query since we're using embeddings mainly for better ranking, not better discoverability?
-                "script": {
-                    "source": "cosineSimilarity(params.query_vector, doc['text_vector']) + 1.0",
-                    "params": {"query_vector": query_vector},
-                },
-            }
-        }
-        """
-        # TODO: Modify below query to use with preprocessed BERT (or other deep learning models) embeddings from build_research_paper_index script
-        # Source: https://github.com/Hironsan/bertsearch/blob/master/web/app.py
-        """
-        bc = BertClient(ip='bertserving', output_fmt='list')
-        query_vector = bc.encode([query])[0]
-        script_query = {
-            "script_score": {
-                "query": {"match_all": {}},
-                "script": {
-                    "source": "cosineSimilarity(params.query_vector, doc['text_vector']) + 1.0",
-                    "params": {"query_vector": query_vector}
+        size = int(params.get("size", NUM_INITIAL_SEARCH_RESULTS))
+        offset = int(params.get("from", 0))
+    except ValueError:
+        raise ValueError("Query params from and size must be integers")
+    if not 0 < size <= MAX_SEARCH_RESULTS_SIZE:
+        raise ValueError(f"Query param size must be between 1 and {MAX_SEARCH_RESULTS_SIZE}")
+    if offset < 0:
+        raise ValueError("Query param from must be non-negative")
+    if offset + size > ES_MAX_RESULT_WINDOW:
+        raise ValueError(f"Cannot page past {ES_MAX_RESULT_WINDOW} results with from/size; use next_cursor instead")
+
+    cursor = params.get("cursor")
+    search_after = _decode_cursor(cursor) if cursor else None
+    if search_after is not None and offset:
+        raise ValueError("Query param from cannot be combined with cursor")
+    return size, offset, search_after
+
+
+def _parse_bool_param(params: QueryDict, param: str, default: bool) -> bool:
+    value = params.get(param, str(default)).lower()
+    if value not in ("true", "false"):
+        raise ValueError(f"Query param {param} must be true or false")
+    return value == "true"
+
+
+def _parse_filter_params(params: QueryDict) -> List[Dict]:
+    """
+    Parse from_date/to_date (yyyy, yyyy-MM or yyyy-MM-dd), journal (repeatable), has_abstract and has_full_text
+    query params into filter clauses. They run in filter context, so ES caches them as bitsets instead of scoring them.
+    """
+    filters = []
+    publish_time_range = {}
+    for param, operator in [("from_date", "gte"), ("to_date", "lte")]:
+        if param not in params:
+            continue
+        date = params[param]
+        try:
+            if not PUBLISH_TIME_PATTERN.match(date):
+                raise ValueError(date)
+            # The pattern only checks the shape; ES fails the whole search on dates like 2020-13 or 2020-02-31
+            datetime.strptime(date, PUBLISH_TIME_STRPTIME_FORMATS[len(date)])
+        except ValueError:
+            raise ValueError(f"Query param {param} must be a date formatted as yyyy, yyyy-MM or yyyy-MM-dd")
+        publish_time_range[operator] = f"{date}||/{PUBLISH_TIME_ROUNDING[len(date)]}"
+    if "from_date" in params and "to_date" in params:
+        from_date, to_date = params["from_date"], params["to_date"]
+        # Zero-padded dates order as strings; comparing their common prefix lets e.g. 2020-05 to 2020 through
+        common_length = min(len(from_date), len(to_date))
+        if from_date[:common_length] > to_date[:common_length]:
+            raise ValueError("Query param from_date must not be after to_date")
+    if publish_time_range:
+        filters.append({"range": {"publish_time": {**publish_time_range, "format": PUBLISH_TIME_FORMAT}}})
+    # Sorted, so the same selection always makes the same cache key
+    journals = sorted(set(params.getlist("journal")))
+    if journals:
+        filters.append({"terms": {"journal": journals}})
+    for field in BOOLEAN_FILTER_FIELDS:
+        if field in params:
+            filters.append({"term": {field: _parse_bool_param(params, field, True)}})
+    return filters
+
+
+class SearchParams(NamedTuple):
+    query: str
+    mode: str
+    size: int
+    offset: int
+    search_after: Optional[List[Any]]
+    filters: List[Dict]
+    facets: bool
+    fuzzy: bool
+    did_you_mean: Optional[str]  # Spelling correction the search runs with, if the query was misspelled
+
+
+def _parse_search_params(params: QueryDict) -> SearchParams:
+    """
+    Parse and validate the params of one search; raises ValueError with the reason a search is a bad request
+    """
+    if "query" not in params:
+        raise ValueError("Missing query param: query")
+    size, offset, search_after = _parse_paging_params(params)
+    filters = _parse_filter_params(params)
+    facets = _parse_bool_param(params, "facets", True)
+    fuzzy = _parse_bool_param(params, "fuzzy", False)
+    mode = params.get("mode", "lexical")
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Query param mode must be one of {SEARCH_MODES}")
+    if fuzzy and mode not in FUZZY_SEARCH_MODES:
+        raise ValueError(f"Query param fuzzy is only supported in modes {FUZZY_SEARCH_MODES}")
+    if mode == "semantic" and (search_after is not None or offset + size > settings.SEMANTIC_RESCORE_WINDOW):
+        raise ValueError(
+            f"Semantic search only pages with from/size through the top {settings.SEMANTIC_RESCORE_WINDOW} results"
+        )
+    if mode == "knn":
+        if filters:
+            # The vector index knows nothing of the filter fields; post-filtering would return short, uneven pages
+            raise ValueError("kNN search doesn't support filters")
+        if search_after is not None or offset + size > settings.KNN_MAX_RESULTS:
+            raise ValueError(f"kNN search only pages with from/size through the top {settings.KNN_MAX_RESULTS} results")
+    if mode == "tfidf" and (search_after is not None or offset + size > settings.TFIDF_RERANK_WINDOW):
+        raise ValueError(
+            f"TF-IDF search only pages with from/size through the top {settings.TFIDF_RERANK_WINDOW} results"
+        )
+    query = params["query"].lower()
+    corrected_query = correct_query(query) if _parse_bool_param(params, "spellcheck", True) else query
+    did_you_mean = corrected_query if corrected_query != query else None
+    return SearchParams(corrected_query, mode, size, offset, search_after, filters, facets, fuzzy, did_you_mean)
+
+
+def _spelling_fields(search: Union[SearchParams, str]) -> Dict:
+    # Not part of cached results: different misspellings share the results of their correction
+    return {"did_you_mean": search.did_you_mean} if isinstance(search, SearchParams) and search.did_you_mean else {}
+
+
+def _search_params_cache_key(generation: str, search: SearchParams) -> str:
+    return search_cache_key(
+        generation,
+        search.query,
+        mode=search.mode,
+        offset=search.offset,
+        size=search.size,
+        search_after=search.search_after,
+        filters=search.filters,
+        facets=search.facets,
+        fuzzy=search.fuzzy,
+    )
+
+
+def _semantic_rescore(query_vector: List[float]) -> Dict:
+    """
+    Re-rank the top lexical hits by cosine similarity of their SPECTER embedding to the query's.
+    Only SEMANTIC_RESCORE_WINDOW hits per shard are scored, so latency doesn't grow with the corpus like a
+    script_score over match_all would.
+    """
+    return {
+        "window_size": settings.SEMANTIC_RESCORE_WINDOW,
+        "query": {
+            "rescore_query": {
+                "script_score": {
+                    "query": {"match_all": {}},
+                    "script": {"source": SEMANTIC_RESCORE_SCRIPT, "params": {"query_vector": query_vector}},
                 }
-            }
+            },
+            "query_weight": 0.0,
+            "rescore_query_weight": 1.0,
+        },
+    }
+
+
+def _quality_boosts() -> List[Dict]:
+    """
+    rank_feature clauses adding the static quality of a paper (citations, completeness) to its relevance
+    """
+    boosts = []
+    for field, boost, function in [
+        # Saturation (with the pivot ES derives from the field) caps how far citations can lift a weak match
+        ("citation_pagerank", settings.CITATION_PAGERANK_BOOST, {"saturation": {}}),
+        ("citation_count", settings.CITATION_COUNT_BOOST, {"saturation": {}}),
+        # log(1 + completeness): every one of abstract, url and full text counts, with diminishing returns
+        ("completeness", settings.COMPLETENESS_BOOST, {"log": {"scaling_factor": 1}}),
+    ]:
+        if boost > 0:
+            boosts.append({"rank_feature": {"field": field, "boost": boost, **function}})
+    return boosts
+
+
+def _lexical_query(query: str, filters: Optional[List[Dict]] = None, fuzzy: bool = False) -> Dict:
+    multimatch_query = {
+        "multi_match": {
+            "query": query,
+            "fields": ["title^2", "abstract", "body"],
+            "operator": "AND",
         }
-        """
+    }
+    if fuzzy:
+        # Expanding every term over the body's huge term dictionary is by far the most expensive part of a search,
+        # so queries are spell-corrected up front instead and fuzziness is only an opt-in fallback
+        multimatch_query["multi_match"]["fuzziness"] = "AUTO"
+    # Rank exact phrase matches higher; title and abstract index word pairs (index_phrases), which keeps this cheap
+    phrase_match_query = {"multi_match": {"query": query, "fields": ["title^2", "abstract"], "type": "phrase"}}
+    lexical_query = {"bool": {"must": multimatch_query, "should": [phrase_match_query] + _quality_boosts()}}
+    if filters:
+        lexical_query["bool"]["filter"] = filters
+    return lexical_query
+
+
+def _build_search_body(
+    query: str,
+    size: int,
+    offset: int,
+    search_after: Optional[List[Any]],
+    query_vector: Optional[List[float]] = None,
+    filters: Optional[List[Dict]] = None,
+    facets: bool = False,
+    fuzzy: bool = False,
+) -> Dict:
+    search_body = {
+        "size": size,
+        "query": _lexical_query(query, filters, fuzzy),
+        "_source": SEARCH_RESULT_FIELDS,
+        "highlight": SEARCH_HIGHLIGHT,
+    }
+    if facets:
+        search_body["aggs"] = SEARCH_AGGREGATIONS
+    if query_vector is not None:
+        # Rescoring only supports sorting by _score, so semantic results page with from/size within the window
+        search_body["rescore"] = _semantic_rescore(query_vector)
+    else:
+        search_body["sort"] = SEARCH_SORT
+    if search_after is not None:
+        search_body["search_after"] = search_after
+    else:
+        search_body["from"] = offset
+    return search_body
+
+
+def _format_paper(paper_data: Dict, highlights: Dict, score: float) -> Dict:
+    return {
+        "cord_uid": paper_data["cord_uid"],
+        "title": paper_data["title"],
+        "authors": paper_data["authors"],
+        "abstract": paper_data["abstract"],
+        "url": paper_data["url"],
+        "publish_time": paper_data["publish_time"],
+        "journal": paper_data.get("journal", ""),
+        "highlights": highlights,
+        "score": score,
+    }
+
+
+def _format_facets(aggregations: Dict) -> Dict[str, List[Dict]]:
+    return {
+        name: [
+            {"value": bucket.get("key_as_string", bucket["key"]), "count": bucket["doc_count"]}
+            for bucket in aggregation["buckets"]
+        ]
+        for name, aggregation in aggregations.items()
+    }
+
+
+def _format_search_results(res: Dict, size: int) -> Dict:
+    relevant_papers = [
+        _format_paper(paper["_source"], paper.get("highlight", {}), paper["_score"]) for paper in res["hits"]["hits"]
+    ]
+
+    hits = res["hits"]["hits"]
+    # A full page means there may be more results; the last hit's sort values resume the next page
+    next_cursor = _encode_cursor(hits[-1]["sort"]) if len(hits) == size and "sort" in hits[-1] else None
+    search_results = {"papers": relevant_papers, "total": res["hits"]["total"]["value"], "next_cursor": next_cursor}
+    if "aggregations" in res:
+        search_results["facets"] = _format_facets(res["aggregations"])
+    return search_results
+
+
+async def _search_elasticsearch_index(
+    es: AsyncElasticsearch,
+    index: str,
+    query: str,
+    size: int = NUM_INITIAL_SEARCH_RESULTS,
+    offset: int = 0,
+    search_after: Optional[List[Any]] = None,
+    query_vector: Optional[List[float]] = None,
+    filters: Optional[List[Dict]] = None,
+    facets: bool = False,
+    fuzzy: bool = False,
+) -> Dict:
+    """
+    Asynchronous method to search papers in elasticsearch; a query_vector re-ranks the lexical hits semantically
+    """
+    search_body = _build_search_body(query, size, offset, search_after, query_vector, filters, facets, fuzzy)
+    res = await observe_es("search", es.search(index=index, body=search_body))
+    with timed("shape", RESULT_SHAPING_SECONDS.labels("lexical" if query_vector is None else "semantic")):
+        return _format_search_results(res, size)
+
+
+async def _fetch_scored_papers(
+    es: AsyncElasticsearch, index: str, scored_ids: List[Tuple[str, float]], mode: str
+) -> List[Dict]:
+    """
+    Fetch the result fields of papers found by the vector index, keeping its order and similarity scores
+    """
+    if not scored_ids:
+        return []
+    doc_ids = [cord_uid for cord_uid, _ in scored_ids]
+    res = await observe_es("mget", es.mget(index=index, body={"ids": doc_ids}, _source=SEARCH_RESULT_FIELDS))
+    with timed("shape", RESULT_SHAPING_SECONDS.labels(mode)):
+        return [
+            _format_paper(doc["_source"], {}, score)
+            for doc, (_, score) in zip(res["docs"], scored_ids)
+            if doc.get("found")  # The vector index may briefly lag behind deletions from the search index
+        ]
+
+
+async def _knn_search(es: AsyncElasticsearch, index: str, query: str, size: int, offset: int) -> Dict:
+    neighbors = await nearest_papers(await encode_query(query), offset + size)
+    papers = await _fetch_scored_papers(es, index, neighbors[offset:], "knn")
+    return {"papers": papers, "total": len(neighbors), "next_cursor": None}
+
+
+async def _tfidf_search(
+    es: AsyncElasticsearch, index: str, query: str, size: int, offset: int, filters: List[Dict], facets: bool
+) -> Dict:
+    """
+    Re-rank the top lexical hits by TF-IDF cosine similarity, then fetch the requested page with highlights
+    """
+    candidates_body = {"size": settings.TFIDF_RERANK_WINDOW, "query": _lexical_query(query, filters), "_source": False}
+    if facets:
+        candidates_body["aggs"] = SEARCH_AGGREGATIONS
+    candidates = await observe_es("search", es.search(index=index, body=candidates_body))
+    candidate_ids = [hit["_id"] for hit in candidates["hits"]["hits"]]
+    # Facets count every lexical match, like in lexical mode, not just the re-ranked window
+    facet_results = {"facets": _format_facets(candidates["aggregations"])} if "aggregations" in candidates else {}
+    similarities = await tfidf_similarities(query, candidate_ids)
+    # Stable sort, so papers with equal similarity keep their lexical order
+    ranked = sorted(zip(candidate_ids, similarities), key=lambda scored_id: -scored_id[1])[offset : offset + size]
+    if not ranked:
+        return {"papers": [], "total": len(candidate_ids), "next_cursor": None, **facet_results}
+
+    page_body = {
+        "size": len(ranked),
+        "query": {"bool": {"must": _lexical_query(query), "filter": {"ids": {"values": [i for i, _ in ranked]}}}},
+        "_source": SEARCH_RESULT_FIELDS,
+        "highlight": SEARCH_HIGHLIGHT,
+    }
+    page = await observe_es("search", es.search(index=index, body=page_body))
+    with timed("shape", RESULT_SHAPING_SECONDS.labels("tfidf")):
+        hits_by_id = {hit["_id"]: hit for hit in page["hits"]["hits"]}
+        papers = [
+            _format_paper(hits_by_id[cord_uid]["_source"], hits_by_id[cord_uid].get("highlight", {}), score)
+            for cord_uid, score in ranked
+            if cord_uid in hits_by_id
+        ]
+    return {"papers": papers, "total": len(candidate_ids), "next_cursor": None, **facet_results}
+
+
+def _bm25_unsupported(search: SearchParams) -> Optional[str]:
+    """
+    Why the BM25 index can't serve a search, if it can't
+    """
+    if search.mode != "lexical":
+        return "Only lexical searches are served without Elasticsearch"
+    if search.filters:
+        return "Filters aren't supported without Elasticsearch"
+    if search.search_after is not None:
+        return "Cursors aren't supported without Elasticsearch; page with from/size"
+    return None
+
+
+async def _bm25_search_results(search: SearchParams) -> Dict:
+    cache_key = _search_params_cache_key(bm25_generation(), search)
+
+    async def run_search() -> Dict:
+        total, scored_papers = await bm25_search(search.query, search.size, search.offset)
+        with timed("shape", RESULT_SHAPING_SECONDS.labels("bm25")):
+            papers = [_format_paper(paper_data, {}, score) for paper_data, score in scored_papers]
+        search_results = {"papers": papers, "total": total, "next_cursor": None, "engine": "bm25"}
+        await set_cached_results(cache_key, search_results)
+        return search_results
+
+    search_results = await get_cached_results(cache_key)
+    if search_results is None:
+        search_results = await coalesced(cache_key, run_search)
+    return search_results
+
+
+def _json_response(data: Dict, endpoint: str) -> JsonResponse:
+    with timed("serialize", SERIALIZATION_SECONDS.labels(endpoint)):
+        return JsonResponse(data={"status": 200, **data})
 
-        # TODO: Figure out way to prioritize ranking for papers with non-empty abstract and urls
-        search_coroutine = es.search(
-            index="covid19_papers",
-            body={"from": 0, "size": NUM_INITIAL_SEARCH_RESULTS, "query": fuzzy_multimatch_query,},
+
+def _vector_index_unavailable() -> JsonResponse:
+    return JsonResponse(data={"status": 503, "error": "Vector index hasn't been built yet"}, status=503)
+
+
+def _bad_request(error: str) -> JsonResponse:
+    return JsonResponse(data={"status": 400, "error": error}, status=400)
+
+
+def _bm25_fallback_enabled() -> bool:
+    return settings.BM25_FALLBACK and bm25_index_available()
+
+
+async def _bm25_search_response(search: SearchParams, unsupported_status: int) -> JsonResponse:
+    if not bm25_index_available():
+        return JsonResponse(data={"status": 503, "error": "BM25 index hasn't been built yet"}, status=503)
+    unsupported = _bm25_unsupported(search)
+    if unsupported is not None:
+        return JsonResponse(data={"status": unsupported_status, "error": unsupported}, status=unsupported_status)
+    search_results = await _bm25_search_results(search)
+    SEARCH_HITS.labels("bm25").inc(len(search_results["papers"]))
+    return _json_response({**search_results, **_spelling_fields(search)}, "search")
+
+
+async def _bm25_fallback_response(search: SearchParams) -> JsonResponse:
+    BM25_FALLBACKS.inc()
+    # Searches the BM25 index can't serve fail like any search would while ES is down
+    return await _bm25_search_response(search, unsupported_status=503)
+
+
+@instrumented_view("search")
+@sheds_load
+async def search_covid19_papers(request: HttpRequest) -> JsonResponse:
+    global _es_unreachable_until
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    index = settings.COVID19_PAPERS_INDEX
+    try:
+        search = _parse_search_params(request.GET)
+    except ValueError as exc:
+        return _bad_request(str(exc))
+    if settings.SEARCH_ENGINE == "bm25":
+        return await _bm25_search_response(search, unsupported_status=400)
+    if search.mode == "knn" and not vector_index_available():
+        return _vector_index_unavailable()
+    if search.mode == "tfidf" and not tfidf_vectors_available():
+        return JsonResponse(data={"status": 503, "error": "TF-IDF vectors haven't been built yet"}, status=503)
+    if time.monotonic() < _es_unreachable_until and _bm25_fallback_enabled():
+        return await _bm25_fallback_response(search)
+    query, mode, size, offset, search_after, filters, facets, fuzzy, _ = search
+
+    try:
+        # Native async view: awaits ES on the worker's event loop instead of spinning up a new loop per request
+        async with es_client() as es:
+            generation = await index_generation(es, index)
+            cache_key = _search_params_cache_key(generation, search)
+
+            async def run_search() -> Dict:
+                async with admit():
+                    if mode == "knn":
+                        search_results = await _knn_search(es, index, query, size, offset)
+                    elif mode == "tfidf":
+                        search_results = await _tfidf_search(es, index, query, size, offset, filters, facets)
+                    else:
+                        query_vector = await encode_query(query) if mode == "semantic" else None
+                        search_results = await _search_elasticsearch_index(
+                            es, index, query, size, offset, search_after, query_vector, filters, facets
+                        )
+                        if fuzzy and not search_results["total"]:
+                            search_results = await _search_elasticsearch_index(
+                                es, index, query, size, offset, search_after, query_vector, filters, facets, fuzzy
+                            )
+                            search_results["fuzzy"] = True
+                await set_cached_results(cache_key, search_results)
+                return search_results
+
+            search_results = await get_cached_results(cache_key)
+            if search_results is None:
+                # Concurrent identical searches wait for the same ES request instead of each sending their own
+                search_results = await coalesced(cache_key, run_search)
+    except TransportError as exc:
+        # Unreachable, or overloaded and rejecting or failing requests (429, 5xx); anything else is a bug to surface
+        if not (isinstance(exc, ElasticsearchConnectionError) or es_overloaded(exc)) or not _bm25_fallback_enabled():
+            raise
+        # Skip ES for a while instead of making every search wait on it, or adding to the load of an overloaded ES
+        _es_unreachable_until = time.monotonic() + settings.BM25_FALLBACK_INTERVAL
+        return await _bm25_fallback_response(search)
+    SEARCH_HITS.labels(mode).inc(len(search_results["papers"]))
+    return _json_response({**search_results, **_spelling_fields(search)}, "search")
+
+
+@instrumented_view("paper")
+@sheds_load
+async def get_covid19_paper(request: HttpRequest, cord_uid: str) -> JsonResponse:
+    """
+    Fetch one full paper (including its body) on demand
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    index = settings.COVID19_PAPERS_INDEX
+    async with es_client() as es:
+        try:
+            async with admit():
+                paper = await observe_es(
+                    "get", es.get(index=index, id=cord_uid, _source_excludes=PAPER_EXCLUDED_FIELDS)
+                )
+        except NotFoundError:
+            return JsonResponse(data={"status": 404, "error": f"Paper {cord_uid} not found"}, status=404)
+    return _json_response({"paper": paper["_source"]}, "paper")
+
+
+@instrumented_view("similar")
+@sheds_load
+async def get_similar_papers(request: HttpRequest, cord_uid: str) -> JsonResponse:
+    """
+    "More like this paper": nearest neighbors of the paper's embedding in the vector index
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    try:
+        size = int(request.GET.get("size", NUM_SIMILAR_PAPERS))
+    except ValueError:
+        return _bad_request("Query param size must be an integer")
+    if not 0 < size <= settings.KNN_MAX_RESULTS:
+        return _bad_request(f"Query param size must be between 1 and {settings.KNN_MAX_RESULTS}")
+    if not vector_index_available():
+        return _vector_index_unavailable()
+
+    neighbors = await similar_papers(cord_uid, size)
+    if neighbors is None:
+        return JsonResponse(data={"status": 404, "error": f"Paper {cord_uid} not found"}, status=404)
+    async with es_client() as es, admit():
+        papers = await _fetch_scored_papers(es, settings.COVID19_PAPERS_INDEX, neighbors, "similar")
+    return _json_response({"papers": papers}, "similar")
+
+
+@instrumented_view("suggest")
+async def suggest_completions(request: HttpRequest) -> JsonResponse:
+    """
+    Typeahead: GET /suggest/?q=<prefix> returns the top phrase and paper title completions of the prefix.
+    Served from the in-memory prefix index, so keystrokes never reach ES.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    if "q" not in request.GET:
+        return _bad_request("Missing query param: q")
+    try:
+        size = int(request.GET.get("size", NUM_SUGGESTIONS))
+    except ValueError:
+        return _bad_request("Query param size must be an integer")
+    if not 0 < size <= MAX_SUGGESTIONS:
+        return _bad_request(f"Query param size must be between 1 and {MAX_SUGGESTIONS}")
+    if not suggest_index_available():
+        return JsonResponse(data={"status": 503, "error": "Suggest index hasn't been built yet"}, status=503)
+
+    phrases, papers = suggestions(request.GET["q"], size)
+    response = _json_response({"phrases": phrases, "papers": papers}, "suggest")
+    # Completions only change with a build, so browsers and proxies can absorb repeated keystrokes
+    response["Cache-Control"] = f"public, max-age={settings.SUGGEST_CACHE_MAX_AGE}"
+    return response
+
+
+def _batch_query_params(options: Any) -> QueryDict:
+    """
+    QueryDict of one batch query's options, so they're parsed and validated like the query params of /search/
+    """
+    if not isinstance(options, dict):
+        raise ValueError("Each query of a batch must be a JSON object")
+    params = QueryDict(mutable=True)
+    for name, value in options.items():
+        params.setlist(name, [str(item) for item in (value if isinstance(value, list) else [value])])
+    return params
+
+
+def _msearch_chunks(searches: List[Tuple[int, bytes]]) -> List[List[Tuple[int, bytes]]]:
+    """
+    Group serialized (header + body) searches into _msearch requests bounded by number of searches and bytes
+    """
+    chunks: List[List[Tuple[int, bytes]]] = []
+    chunk_bytes = 0
+    for position, search_lines in searches:
+        if (
+            not chunks
+            or len(chunks[-1]) >= settings.MSEARCH_MAX_SEARCHES
+            or chunk_bytes + len(search_lines) > settings.MSEARCH_MAX_BYTES
+        ):
+            chunks.append([])
+            chunk_bytes = 0
+        chunks[-1].append((position, search_lines))
+        chunk_bytes += len(search_lines)
+    return chunks
+
+
+async def _msearch(
+    es: AsyncElasticsearch, index: str, chunk: List[Tuple[int, bytes]], limiter: asyncio.Semaphore
+) -> List[Dict]:
+    async with limiter:
+        body = b"".join(search_lines for _, search_lines in chunk)
+        try:
+            async with admit():
+                res = await observe_es("msearch", es.msearch(index=index, body=body))
+        except Exception as exc:
+            # Fail the chunk's searches instead of cutting off a response that's already streaming
+            if isinstance(exc, Overloaded) or (isinstance(exc, TransportError) and es_overloaded(exc)):
+                return [{"status": 503, "error": "Search is overloaded; retry later"} for _ in chunk]
+            return [{"status": 502, "error": f"Elasticsearch request failed: {exc}"} for _ in chunk]
+    return res["responses"]
+
+
+def _batch_result_line(position: int, result: Dict, search: Union[SearchParams, str]) -> bytes:
+    return f"{json.dumps({'index': position, **result, **_spelling_fields(search)})}\n".encode("utf-8")
+
+
+class PreparedBatch(NamedTuple):
+    results: List[Optional[Dict]]  # Result of each invalid or cached search, None for those sent to ES
+    cache_keys: Dict[int, str]  # Position -> cache key of each valid search
+    positions_by_key: Dict[str, List[int]]  # Identical searches are sent once; maps the one sent to all of them
+    serialized_searches: List[Tuple[int, bytes]]  # (position, _msearch header + body) of each search sent
+
+
+async def _prepare_batch(es: AsyncElasticsearch, index: str, searches: List[Union[SearchParams, str]]) -> PreparedBatch:
+    """
+    Look up the cached results of a batch of searches, and encode and serialize the rest for _msearch requests
+    """
+    results: List[Optional[Dict]] = [
+        {"status": 400, "error": search} if isinstance(search, str) else None for search in searches
+    ]
+    generation = await index_generation(es, index)
+    positions = [position for position, search in enumerate(searches) if results[position] is None]
+    cache_keys = {position: _search_params_cache_key(generation, searches[position]) for position in positions}
+    cached_results = await asyncio.gather(*[get_cached_results(cache_keys[position]) for position in positions])
+    for position, search_results in zip(positions, cached_results):
+        if search_results is not None:
+            results[position] = {"status": 200, **search_results}
+
+    positions_by_key: Dict[str, List[int]] = {}
+    for position in positions:
+        if results[position] is None:
+            positions_by_key.setdefault(cache_keys[position], []).append(position)
+    uncached = [key_positions[0] for key_positions in positions_by_key.values()]
+    semantic_positions = [position for position in uncached if searches[position].mode == "semantic"]
+    query_vectors = await asyncio.gather(*[encode_query(searches[p].query) for p in semantic_positions])
+    query_vector_by_position = dict(zip(semantic_positions, query_vectors))
+    serialized_searches = []
+    for position in uncached:
+        search = searches[position]
+        search_body = _build_search_body(
+            search.query,
+            search.size,
+            search.offset,
+            search.search_after,
+            query_vector_by_position.get(position),
+            search.filters,
+            search.facets,
         )
-        search_tasks.append(search_coroutine)
-        # Just add more I/O heavy tasks (like db queries!) to search_tasks to get full benefit of async concurrency
-        (res,) = await asyncio.gather(*search_tasks)
-
-        relevant_papers = []
-        print(f"First result: {res['hits']['hits'][0]}")
-        for paper in res["hits"]["hits"]:
-            paper_relevance_score = paper["_score"]
-            paper_data = paper["_source"]
-            relevant_papers.append(
-                {
-                    "title": paper_data["title"],
-                    "authors": paper_data["authors"],
-                    "abstract": paper_data["abstract"],
-                    "body": paper_data["body"],
-                    "url": paper_data["url"],
-                    "publish_time": paper_data["publish_time"],
-                    "score": paper_relevance_score,
-                }
-            )
-    except Exception as exc:
-        # TODO: Haven't decided how to handle errors in Elasticsearch
-        # Raise IndexNotFound exception on 404 status code Not Found
-        raise exc
-
-    return relevant_papers
-
-
-def search_covid19_papers(request: HttpRequest) -> JsonResponse:
-    hosts = [
-        ":".join([os.environ["ES_HOST"], os.environ["ES_PORT"]]),
-        "localhost:9200",
-    ]  # IP address or domain name of Elasticsearch index
-    index = "covid19_papers"
-    query = request.GET["query"].lower()
-
-    # Run async method in synchronous method by creating event loop
-    loop = asyncio.new_event_loop()
-    relevant_papers = loop.run_until_complete(_search_elasticsearch_index(hosts, index, query))
-    loop.close()
-    return JsonResponse(data={"status": 200, "papers": relevant_papers})
+        serialized_searches.append((position, f"{{}}\n{json.dumps(search_body)}\n".encode("utf-8")))
+    return PreparedBatch(results, cache_keys, positions_by_key, serialized_searches)
+
+
+async def _stream_batch_results(
+    index: str, searches: List[Union[SearchParams, str]], batch: PreparedBatch
+) -> AsyncIterator[bytes]:
+    """
+    Run the uncached searches of a prepared batch through concurrent _msearch requests.
+    Yield one NDJSON line per search in request order, as soon as it and all searches before it are done.
+    """
+    results, cache_keys, positions_by_key, serialized_searches = batch
+    async with es_client() as es:
+        limiter = asyncio.Semaphore(settings.MSEARCH_CONCURRENCY)
+        chunks = _msearch_chunks(serialized_searches)
+        msearch_tasks = [asyncio.ensure_future(_msearch(es, index, chunk, limiter)) for chunk in chunks]
+        next_position = 0
+        try:
+            for chunk, msearch_task in zip(chunks, msearch_tasks):
+                for (position, _), res in zip(chunk, await msearch_task):
+                    search = searches[position]
+                    if "error" in res:
+                        error = res["error"]
+                        line = {
+                            "status": res.get("status", 500),
+                            "error": error.get("reason", str(error)) if isinstance(error, dict) else error,
+                        }
+                    else:
+                        with timed("shape", RESULT_SHAPING_SECONDS.labels(search.mode)):
+                            search_results = _format_search_results(res, search.size)
+                        await set_cached_results(cache_keys[position], search_results)
+                        SEARCH_HITS.labels(search.mode).inc(len(search_results["papers"]))
+                        line = {"status": 200, **search_results}
+                    for duplicate_position in positions_by_key[cache_keys[position]]:
+                        results[duplicate_position] = line
+                # Sent positions ascend, so every search up to the chunk's last one is done
+                while next_position < len(searches) and results[next_position] is not None:
+                    yield _batch_result_line(next_position, results[next_position], searches[next_position])
+                    results[next_position] = None  # Free streamed results
+                    next_position += 1
+            while next_position < len(searches):
+                yield _batch_result_line(next_position, results[next_position], searches[next_position])
+                next_position += 1
+        finally:
+            # The client may have gone away mid-stream
+            for msearch_task in msearch_tasks:
+                msearch_task.cancel()
+
+
+async def _stream_bm25_batch_results(
+    searches: List[Union[SearchParams, str]], unsupported_status: int
+) -> AsyncIterator[bytes]:
+    """
+    Serve a batch of searches from the BM25 index, yielding one NDJSON line per search in request order
+    """
+    for position, search in enumerate(searches):
+        if isinstance(search, str):
+            result = {"status": 400, "error": search}
+        else:
+            unsupported = _bm25_unsupported(search)
+            if unsupported is not None:
+                result = {"status": unsupported_status, "error": unsupported}
+            else:
+                search_results = await _bm25_search_results(search)
+                SEARCH_HITS.labels("bm25").inc(len(search_results["papers"]))
+                result = {"status": 200, **search_results}
+        yield _batch_result_line(position, result, search)
+
+
+def _bm25_batch_response(
+    searches: List[Union[SearchParams, str]], unsupported_status: int
+) -> Union[StreamingHttpResponse, JsonResponse]:
+    if not bm25_index_available():
+        return JsonResponse(data={"status": 503, "error": "BM25 index hasn't been built yet"}, status=503)
+    return StreamingHttpResponse(
+        _stream_bm25_batch_results(searches, unsupported_status), content_type="application/x-ndjson"
+    )
+
+
+def _bm25_batch_fallback_response(
+    searches: List[Union[SearchParams, str]],
+) -> Union[StreamingHttpResponse, JsonResponse]:
+    BM25_FALLBACKS.inc(len(searches))
+    return _bm25_batch_response(searches, unsupported_status=503)
+
+
+@instrumented_view("batch")
+@sheds_load
+async def batch_search_covid19_papers(request: HttpRequest) -> Union[StreamingHttpResponse, JsonResponse]:
+    """
+    Run many searches per request: POST {"queries": [{"query": ..., <any /search/ query param>: ...}, ...]}.
+    Lexical and semantic searches are sent to ES in a few _msearch requests, and their results are streamed back
+    as NDJSON lines ({"index": <position in queries>, "status": ..., ...}) in request order.
+    Like /search/, lexical searches are served from the BM25 index without ES or while ES is unreachable or overloaded.
+    """
+    global _es_unreachable_until
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        queries = json.loads(request.body)["queries"]
+    except (ValueError, KeyError, TypeError):
+        return _bad_request('Request body must be a JSON object with a list of "queries"')
+    if not isinstance(queries, list) or not 0 < len(queries) <= settings.BATCH_SEARCH_MAX_QUERIES:
+        return _bad_request(f"A batch must have between 1 and {settings.BATCH_SEARCH_MAX_QUERIES} queries")
+
+    searches: List[Union[SearchParams, str]] = []
+    for options in queries:
+        try:
+            search = _parse_search_params(_batch_query_params(options))
+        except ValueError as exc:
+            searches.append(str(exc))
+            continue
+        if search.mode not in BATCH_SEARCH_MODES:
+            searches.append(f"Batch searches only support modes {BATCH_SEARCH_MODES}")
+            continue
+        if search.fuzzy:
+            # A fallback search per query that matched nothing would need another round of _msearch requests
+            searches.append("Batch searches don't support fuzzy")
+            continue
+        searches.append(search)
+
+    if settings.SEARCH_ENGINE == "bm25":
+        return _bm25_batch_response(searches, unsupported_status=400)
+    if time.monotonic() < _es_unreachable_until and _bm25_fallback_enabled():
+        return _bm25_batch_fallback_response(searches)
+
+    index = settings.COVID19_PAPERS_INDEX
+    try:
+        # Whatever can fail for the whole batch fails before streaming, while the response can still say so;
+        # only the _msearch requests run mid-stream, and they fail their searches' lines instead
+        async with es_client() as es:
+            batch = await _prepare_batch(es, index, searches)
+    except TransportError as exc:
+        if (isinstance(exc, ElasticsearchConnectionError) or es_overloaded(exc)) and _bm25_fallback_enabled():
+            _es_unreachable_until = time.monotonic() + settings.BM25_FALLBACK_INTERVAL
+            return _bm25_batch_fallback_response(searches)
+        if es_overloaded(exc):
+            raise  # sheds_load responds with a 503 and Retry-After
+        if isinstance(exc, ElasticsearchConnectionError):
+            return JsonResponse(data={"status": 503, "error": "Elasticsearch is unreachable"}, status=503)
+        return JsonResponse(data={"status": 502, "error": f"Elasticsearch request failed: {exc}"}, status=502)
+    return StreamingHttpResponse(_stream_batch_results(index, searches, batch), content_type="application/x-ndjson")
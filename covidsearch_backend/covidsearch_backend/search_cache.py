@@ -0,0 +1,172 @@
+"""
+Two-tier cache of search results: an in-process LRU tier and an optional shared tier on redis
+
+Keys embed the index generation that build_research_paper_index stamps into the index's _meta mapping,
+so publishing a new generation invalidates every cached result without an explicit flush.
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from elasticsearch import AsyncElasticsearch
+
+from .admission import coalesced
+from .es_client import on_serving_loop
+from .metrics import ERRORS, SEARCH_CACHE_LOOKUPS, observe_es, record_stage
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Bounded in-process cache evicting the least recently used entry; entries expire after ttl seconds
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_local_tier = LRUCache(settings.SEARCH_CACHE_MAX_ENTRIES, settings.SEARCH_CACHE_TTL)
+_redis_tier = None
+_index_generation: Optional[str] = None
+_index_generation_checked_at = float("-inf")
+
+
+def _get_redis_tier():
+    """
+    Lazily connect to redis; the shared tier is only used on the ASGI serving loop since the pool is bound to it
+    """
+    global _redis_tier
+    if not settings.SEARCH_CACHE_REDIS_URL or not on_serving_loop():
+        return None
+    if _redis_tier is None:
+        import redis.asyncio as redis
+
+        _redis_tier = redis.from_url(
+            settings.SEARCH_CACHE_REDIS_URL,
+            socket_timeout=settings.SEARCH_CACHE_REDIS_TIMEOUT,
+            socket_connect_timeout=settings.SEARCH_CACHE_REDIS_TIMEOUT,
+        )
+    return _redis_tier
+
+
+async def index_generation(es: AsyncElasticsearch, index: str) -> str:
+    """
+    Return the generation of the index currently served, re-reading it at most every INDEX_GENERATION_CHECK_INTERVAL
+    seconds. The local tier is dropped as soon as a new generation is observed.
+    """
+    global _index_generation, _index_generation_checked_at
+    now = time.monotonic()
+    if _index_generation is not None and now - _index_generation_checked_at < settings.INDEX_GENERATION_CHECK_INTERVAL:
+        return _index_generation
+
+    # Requests arriving together after the check interval share one mapping request
+    mappings = await coalesced(
+        f"mapping:{index}", lambda: observe_es("get_mapping", es.indices.get_mapping(index=index)), kind="mapping"
+    )
+    generation = "|".join(
+        sorted(
+            f"{index_name}:{index_mapping['mappings'].get('_meta', {}).get('generation', '')}"
+            for index_name, index_mapping in mappings.items()
+        )
+    )
+    if generation != _index_generation:
+        if _index_generation is not None:
+            logger.info(
+                "Index generation changed from %s to %s; dropping cached results", _index_generation, generation
+            )
+        _local_tier.clear()
+        _index_generation = generation
+    _index_generation_checked_at = now
+    return generation
+
+
+def search_cache_key(generation: str, query: str, **params: Any) -> str:
+    """
+    Key on the normalized query and paging parameters, namespaced by index generation
+    """
+    normalized_query = " ".join(query.lower().split())
+    key_params = json.dumps({"query": normalized_query, **params}, sort_keys=True, default=str)
+    return f"search:{generation}:{hashlib.sha1(key_params.encode('utf-8')).hexdigest()}"
+
+
+def _record_lookup(outcome: str, start: float) -> None:
+    SEARCH_CACHE_LOOKUPS.labels(outcome).inc()
+    record_stage("cache", time.perf_counter() - start, outcome)
+
+
+async def get_cached_results(key: str) -> Optional[Dict]:
+    start = time.perf_counter()
+    results = _local_tier.get(key)
+    if results is not None:
+        _record_lookup("local_hit", start)
+        return results
+
+    redis_tier = _get_redis_tier()
+    if redis_tier is None:
+        _record_lookup("miss", start)
+        return None
+    try:
+        cached_results = await redis_tier.get(key)
+    except Exception as exc:
+        # Shared tier is best-effort; fall through to Elasticsearch if redis is unavailable
+        ERRORS.labels("search_cache").inc()
+        logger.warning("Search cache redis lookup failed: %s", exc)
+        _record_lookup("miss", start)
+        return None
+    if cached_results is None:
+        _record_lookup("miss", start)
+        return None
+    results = json.loads(cached_results)
+    _local_tier.set(key, results)
+    _record_lookup("redis_hit", start)
+    return results
+
+
+async def set_cached_results(key: str, results: Dict) -> None:
+    _local_tier.set(key, results)
+
+    redis_tier = _get_redis_tier()
+    if redis_tier is None:
+        return
+    try:
+        await redis_tier.set(key, json.dumps(results), ex=int(settings.SEARCH_CACHE_TTL))
+    except Exception as exc:
+        ERRORS.labels("search_cache").inc()
+        logger.warning("Search cache redis write failed: %s", exc)
+
+
+async def close_search_cache() -> None:
+    global _redis_tier
+    if _redis_tier is not None:
+        await _redis_tier.close()
+        _redis_tier = None
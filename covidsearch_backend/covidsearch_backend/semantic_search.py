@@ -0,0 +1,30 @@
+"""
+Query side of semantic search: encodes queries with the SPECTER model the paper embeddings were built with
+
+The model is loaded lazily, on the first semantic search of a worker. Queries are encoded on one dedicated thread,
+so the CPU-bound forward pass doesn't block the event loop and concurrent searches don't oversubscribe the cores.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Tuple
+
+from django.conf import settings
+
+from .scripts.paper_embeddings import SpecterEncoder
+
+_encoder = SpecterEncoder(settings.SEMANTIC_MODEL_NAME, batch_size=1, num_threads=settings.SEMANTIC_ENCODER_THREADS)
+_encoder_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-encoder")
+
+
+@lru_cache(maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE)
+def _encode_query(query: str) -> Tuple[float, ...]:
+    return tuple(_encoder.encode([query])[0].tolist())
+
+
+async def encode_query(query: str) -> List[float]:
+    """
+    L2-normalized SPECTER embedding of the query
+    """
+    loop = asyncio.get_running_loop()
+    return list(await loop.run_in_executor(_encoder_executor, _encode_query, query))
@@ -118,3 +118,148 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = "/static/"
+
+
+# Elasticsearch
+# https://elasticsearch-py.readthedocs.io/en/7.x/async.html
+
+ES_HOSTS = list(
+    dict.fromkeys(
+        [
+            ":".join([os.environ.get("ES_HOST", "localhost"), os.environ.get("ES_PORT", "9200")]),
+            "localhost:9200",
+        ]
+    )
+)  # IP address or domain name of Elasticsearch index
+
+if os.environ.get("ES_HOSTS"):
+    ES_HOSTS = os.environ["ES_HOSTS"].split(",")  # Explicit comma-separated host:port list, e.g. for benchmarks
+
+ES_MAX_CONNECTIONS = int(os.environ.get("ES_MAX_CONNECTIONS", "256"))  # Pooled connections per ES node and worker
+
+ES_KEEPALIVE_TIMEOUT = float(os.environ.get("ES_KEEPALIVE_TIMEOUT", "75"))  # Seconds an idle connection is kept
+
+ES_REQUEST_TIMEOUT = float(os.environ.get("ES_REQUEST_TIMEOUT", "10"))
+
+ES_MAX_RETRIES = int(os.environ.get("ES_MAX_RETRIES", "2"))
+
+COVID19_PAPERS_INDEX = "covid19_papers"
+
+
+# Search result cache
+# In-process LRU tier per worker plus an optional shared redis tier (docker-compose's redis service)
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "600"))  # Seconds
+
+SEARCH_CACHE_REDIS_URL = os.environ.get("SEARCH_CACHE_REDIS_URL")  # e.g. redis://redis:6379/0; unset disables tier
+
+SEARCH_CACHE_REDIS_TIMEOUT = float(os.environ.get("SEARCH_CACHE_REDIS_TIMEOUT", "0.05"))
+
+INDEX_GENERATION_CHECK_INTERVAL = float(os.environ.get("INDEX_GENERATION_CHECK_INTERVAL", "10"))  # Seconds
+
+
+# Semantic search
+# Queries are encoded with the model behind the paper embeddings; lexical hits in the window are re-ranked by cosine
+
+SEMANTIC_MODEL_NAME = os.environ.get("SEMANTIC_MODEL_NAME", "allenai/specter")
+
+SEMANTIC_RESCORE_WINDOW = int(os.environ.get("SEMANTIC_RESCORE_WINDOW", "100"))  # Lexical hits re-ranked per shard
+
+SEMANTIC_ENCODER_THREADS = int(os.environ.get("SEMANTIC_ENCODER_THREADS", "1"))  # torch threads per worker
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+
+MODELS_DIR = os.path.join(BASE_DIR, "covidsearch_backend", "models")  # Artifacts written by the index build
+
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "16"))  # Inverted lists scanned per kNN query; trades recall for latency
+
+KNN_MAX_RESULTS = int(os.environ.get("KNN_MAX_RESULTS", "100"))
+
+TFIDF_RERANK_WINDOW = int(os.environ.get("TFIDF_RERANK_WINDOW", "200"))  # Lexical hits re-ranked by TF-IDF cosine
+
+
+# BM25 fallback engine
+# Lexical searches are served from the build's embedded BM25 index (scripts/bm25_index.py) when ES is unreachable
+
+# "bm25" serves every search without ES, batch ones included; only lexical searches without filters or cursors work
+SEARCH_ENGINE = os.environ.get("SEARCH_ENGINE", "elasticsearch")
+
+BM25_FALLBACK = os.environ.get("BM25_FALLBACK", "1") == "1"
+
+BM25_FALLBACK_INTERVAL = float(os.environ.get("BM25_FALLBACK_INTERVAL", "5"))  # Seconds ES is skipped after failing
+
+
+# Typeahead suggestions
+# /suggest/ completes phrases and titles from the build's prefix index (scripts/suggest_index.py), without ES
+
+SUGGEST_CACHE_MAX_AGE = int(os.environ.get("SUGGEST_CACHE_MAX_AGE", "300"))  # Seconds clients and proxies may cache
+
+
+# Paper quality signals
+# Lexical queries add each paper's static rank features (scripts/paper_quality.py) to its score, weighted by these
+
+CITATION_PAGERANK_BOOST = float(os.environ.get("CITATION_PAGERANK_BOOST", "2.0"))  # 0 disables a signal
+
+CITATION_COUNT_BOOST = float(os.environ.get("CITATION_COUNT_BOOST", "1.0"))
+
+# Of the abstract, url and full text a paper has
+COMPLETENESS_BOOST = float(os.environ.get("COMPLETENESS_BOOST", "0.5"))
+
+
+# Admission control
+# Per ASGI worker: ES requests beyond ES_MAX_IN_FLIGHT queue; a full queue or a wait past ES_QUEUE_TIMEOUT gets a 503
+
+ES_MAX_IN_FLIGHT = int(os.environ.get("ES_MAX_IN_FLIGHT", "64"))
+
+ES_MAX_QUEUED = int(os.environ.get("ES_MAX_QUEUED", "256"))
+
+ES_QUEUE_TIMEOUT = float(os.environ.get("ES_QUEUE_TIMEOUT", "1.0"))  # Seconds
+
+OVERLOAD_RETRY_AFTER = int(os.environ.get("OVERLOAD_RETRY_AFTER", "1"))  # Seconds, sent in Retry-After of 503s
+
+
+# Batch search
+# POST /search/batch/ splits its searches into _msearch requests bounded by number of searches and bytes
+
+BATCH_SEARCH_MAX_QUERIES = int(os.environ.get("BATCH_SEARCH_MAX_QUERIES", "10000"))
+
+MSEARCH_MAX_SEARCHES = int(os.environ.get("MSEARCH_MAX_SEARCHES", "100"))
+
+MSEARCH_MAX_BYTES = int(os.environ.get("MSEARCH_MAX_BYTES", str(5 * 1024 * 1024)))  # Semantic searches carry ~15KB
+
+MSEARCH_CONCURRENCY = int(os.environ.get("MSEARCH_CONCURRENCY", "4"))  # _msearch requests in flight per batch
+
+
+# Metrics and logging
+# Prometheus metrics are served on /metrics; set PROMETHEUS_MULTIPROC_DIR to aggregate all gunicorn workers
+
+SERVER_TIMING_HEADERS = os.environ.get("SERVER_TIMING_HEADERS", "0") == "1"  # Per-stage timings on API responses
+
+SLOW_REQUEST_THRESHOLD = float(os.environ.get("SLOW_REQUEST_THRESHOLD", "1.0"))  # Seconds; slower requests are logged
+
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "10"))  # Records per call site and interval
+
+LOG_RATE_LIMIT_INTERVAL = float(os.environ.get("LOG_RATE_LIMIT_INTERVAL", "60"))  # Seconds
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "rate_limit": {
+            "()": "covidsearch_backend.log_filters.RateLimitFilter",
+            "rate": LOG_RATE_LIMIT,
+            "per": LOG_RATE_LIMIT_INTERVAL,
+        },
+    },
+    "formatters": {
+        "default": {"format": "%(asctime)s %(levelname)s %(name)s: %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "default", "filters": ["rate_limit"]},
+    },
+    "loggers": {
+        "covidsearch_backend": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
@@ -0,0 +1,28 @@
+"""
+"Did you mean" spelling correction of queries against the memory-mapped corpus vocabulary (scripts/spelling_index.py)
+
+Corrections take a few dozen hash lookups, so they run inline on the request path instead of in an executor.
+"""
+import os
+from typing import Optional
+
+from django.conf import settings
+
+from .build_artifacts import cached_artifact
+from .metrics import SPELLING_CORRECTION_SECONDS, timed
+from .scripts.spelling_index import SPELLING_DIR, SPELLING_META_FILENAME, SpellingIndex
+
+
+def _get_spelling_index() -> Optional[SpellingIndex]:
+    return cached_artifact(os.path.join(settings.MODELS_DIR, SPELLING_DIR), SPELLING_META_FILENAME, SpellingIndex)
+
+
+def correct_query(query: str) -> str:
+    """
+    query with misspelled words corrected, or query itself if the index hasn't been built yet
+    """
+    spelling_index = _get_spelling_index()
+    if spelling_index is None:
+        return query
+    with timed("spelling", SPELLING_CORRECTION_SECONDS):
+        return spelling_index.correct(query)
@@ -0,0 +1,27 @@
+"""
+Typeahead completions from the memory-mapped prefix index (scripts/suggest_index.py) written by the index build
+
+Lookups are two binary searches and a partial sort per kind of completion, so they run inline on the request path.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .build_artifacts import artifact_available, cached_artifact
+from .scripts.suggest_index import SUGGEST_DIR, SUGGEST_META_FILENAME, SuggestIndex
+
+
+def _get_suggest_index() -> Optional[SuggestIndex]:
+    return cached_artifact(os.path.join(settings.MODELS_DIR, SUGGEST_DIR), SUGGEST_META_FILENAME, SuggestIndex)
+
+
+def suggest_index_available() -> bool:
+    return artifact_available(os.path.join(settings.MODELS_DIR, SUGGEST_DIR), SUGGEST_META_FILENAME)
+
+
+def suggestions(prefix: str, k: int) -> Tuple[List[str], List[Dict[str, str]]]:
+    """
+    Top k phrase completions and top k papers (cord_uid, title) whose title starts with prefix
+    """
+    return _get_suggest_index().suggest(prefix, k)
@@ -0,0 +1,35 @@
+"""
+TF-IDF re-ranking over the memory-mapped sparse vectors (scripts/tfidf_vectors.py) written by the index build
+
+Only the rows of the re-ranked candidates are read, so a re-rank touches a few hundred rows of the mmap'd matrix.
+"""
+import asyncio
+import os
+from typing import List, Optional
+
+from django.conf import settings
+
+from .build_artifacts import artifact_available, cached_artifact
+from .scripts.tfidf_vectors import TFIDF_DIR, TFIDF_MODEL_FILENAME, TfidfVectors
+
+
+def _get_tfidf_vectors() -> Optional[TfidfVectors]:
+    return cached_artifact(os.path.join(settings.MODELS_DIR, TFIDF_DIR), TFIDF_MODEL_FILENAME, TfidfVectors)
+
+
+def tfidf_vectors_available() -> bool:
+    return artifact_available(os.path.join(settings.MODELS_DIR, TFIDF_DIR), TFIDF_MODEL_FILENAME)
+
+
+def _tfidf_similarities(query: str, cord_uids: List[str]) -> List[float]:
+    tfidf_vectors = _get_tfidf_vectors()
+    if tfidf_vectors is None:
+        return [0.0] * len(cord_uids)
+    return tfidf_vectors.cosine_similarities(query, cord_uids).tolist()
+
+
+async def tfidf_similarities(query: str, cord_uids: List[str]) -> List[float]:
+    """
+    TF-IDF cosine similarity between the query and each paper (0 for papers without a vector)
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, _tfidf_similarities, query, cord_uids)
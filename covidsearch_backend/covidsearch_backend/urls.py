@@ -16,9 +16,26 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
-from .search_api import search_covid19_papers
+from .metrics import metrics
+from .search_api import (
+    batch_search_covid19_papers,
+    get_covid19_paper,
+    get_similar_papers,
+    search_covid19_papers,
+    suggest_completions,
+)
+
+# Batch search is a read-only API called by jobs, not browsers, so it's left out of CsrfViewMiddleware.
+# Django 4.2's csrf_exempt wraps views in a sync function, so ASGI would run the async view in a thread and get back an
+# unawaited coroutine (async support arrives in Django 5.0); the middleware only reads this attribute, so it's set here.
+batch_search_covid19_papers.csrf_exempt = True
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", metrics),
     path("search/", search_covid19_papers),
+    path("search/batch/", batch_search_covid19_papers),
+    path("suggest/", suggest_completions),
+    path("paper/<str:cord_uid>/", get_covid19_paper),
+    path("paper/<str:cord_uid>/similar/", get_similar_papers),
 ]
@@ -0,0 +1,44 @@
+"""
+Nearest-neighbor searches over the memory-mapped ANN index (scripts/vector_index.py) written by the index build
+
+The index files are mmap'd, so the workers of a machine share their pages instead of each holding a copy.
+"""
+import asyncio
+import os
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+from .build_artifacts import artifact_available, cached_artifact
+from .scripts.vector_index import ANN_DIR, ANN_INDEX_META_FILENAME, VectorIndex
+
+
+def _get_vector_index() -> Optional[VectorIndex]:
+    return cached_artifact(os.path.join(settings.MODELS_DIR, ANN_DIR), ANN_INDEX_META_FILENAME, VectorIndex)
+
+
+def vector_index_available() -> bool:
+    return artifact_available(os.path.join(settings.MODELS_DIR, ANN_DIR), ANN_INDEX_META_FILENAME)
+
+
+def _nearest_papers(query_vector: List[float], k: int) -> List[Tuple[str, float]]:
+    return _get_vector_index().search(query_vector, k, nprobe=settings.ANN_NPROBE)
+
+
+def _similar_papers(cord_uid: str, k: int) -> Optional[List[Tuple[str, float]]]:
+    return _get_vector_index().similar(cord_uid, k, nprobe=settings.ANN_NPROBE)
+
+
+async def nearest_papers(query_vector: List[float], k: int) -> List[Tuple[str, float]]:
+    """
+    Approximate top k (cord_uid, cosine similarity) for a query embedding
+    """
+    # Off the event loop: page faults on cold lists of the mmap'd matrix can block on disk
+    return await asyncio.get_running_loop().run_in_executor(None, _nearest_papers, query_vector, k)
+
+
+async def similar_papers(cord_uid: str, k: int) -> Optional[List[Tuple[str, float]]]:
+    """
+    Approximate top k papers most similar to cord_uid, or None if the paper isn't in the index
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, _similar_papers, cord_uid, k)
@@ -2,4 +2,5 @@
 
 python3 manage.py makemigrations
 python3 manage.py migrate
-gunicorn covidsearch_backend.wsgi -b 0.0.0.0:5000 -w 4
+# ASGI workers: each worker serves many concurrent searches on one event loop with a pooled ES client
+gunicorn covidsearch_backend.asgi:application -k uvicorn.workers.UvicornWorker -b 0.0.0.0:5000 -w 4